@@ -5,6 +5,18 @@ from . import summarize_opsim
 from .simlib import *
 from .trig import *
 from .opsim_out import *
+from .columnar import *
+from .cache import *
+from .validation import *
+from .pipeline import *
+from .dithers import *
+from .ditherfile import *
+from .dbindex import *
+from .decompress import *
+from .parallel import *
+from .coverage import *
+from .pixelstats import *
+from .healpixels import *
 from .version import __VERSION__ as __version__
 
 here = __file__
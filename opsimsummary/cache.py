@@ -0,0 +1,135 @@
+"""
+Module providing an on-disk cache of normalized OpSim summary tables, so that
+repeated reads of the same OpSim database with the same options can skip
+reading and normalizing the database.
+"""
+from __future__ import division, print_function, absolute_import
+__all__ = ['SummaryCache']
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+from .columnar import write_columnar, read_columnar
+from .ditherfile import DitherTable
+from .version import __VERSION__
+
+
+class SummaryCache(object):
+    """
+    Cache of `OpSimOutput.summary` and proposal information in a directory.
+    Each entry is stored in a sub directory named by a hash of the identity
+    of the database file (absolute path, size and modification time) and the
+    options used to create the summary, so that an entry is not used if any
+    of these change.
+
+    Parameters
+    ----------
+    cache_dir : string
+        absolute path to the directory used for the cache. This is created
+        if it does not exist.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    @staticmethod
+    def _hashable(val):
+        """Return a json serializable representation of `val` to be used in
+        a hash"""
+        if val is None or isinstance(val, (bool, int, float, str)):
+            return val
+        if isinstance(val, np.random.RandomState):
+            state = val.get_state()
+            return ['RandomState', state[0],
+                    hashlib.sha1(state[1].tobytes()).hexdigest()] + \
+                list(state[2:])
+        if isinstance(val, (pd.DataFrame, pd.Series)):
+            hashes = pd.util.hash_pandas_object(val, index=True).values
+            return ['pandas', hashlib.sha1(hashes.tobytes()).hexdigest()]
+        if isinstance(val, DitherTable):
+            return ['DitherTable', val.fingerprint()]
+        if isinstance(val, np.ndarray):
+            return ['ndarray', str(val.dtype),
+                    hashlib.sha1(np.ascontiguousarray(val).tobytes()).hexdigest()]
+        if isinstance(val, np.generic):
+            return val.item()
+        if isinstance(val, dict):
+            return sorted((str(k), SummaryCache._hashable(v))
+                          for k, v in val.items())
+        if isinstance(val, (list, tuple)):
+            return list(SummaryCache._hashable(v) for v in val)
+        return repr(val)
+
+    @staticmethod
+    def key(dbname, **options):
+        """Return a string key for the database `dbname` and the options
+        `options` used to create the summary.
+
+        Parameters
+        ----------
+        dbname : string
+            path to the OpSim database, or its sqlalchemy URL
+            'sqlite:///path'
+        options :
+            keyword arguments, eg. `opsimversion`, `subset`, `user_propIDs`,
+            `dithercolumns`, `filterNull` which determine the summary.
+        """
+        if dbname.startswith('sqlite:///'):
+            dbname = dbname[len('sqlite:///'):]
+        dbname = os.path.abspath(dbname)
+        stat = os.stat(dbname)
+        ident = dict(dbname=dbname, size=stat.st_size,
+                     mtime=stat.st_mtime_ns if hasattr(stat, 'st_mtime_ns')
+                     else stat.st_mtime,
+                     version=__VERSION__,
+                     options=SummaryCache._hashable(options))
+        s = json.dumps(ident, sort_keys=True)
+        return hashlib.sha256(s.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        """absolute path to the directory for the entry `key`"""
+        return os.path.join(self.cache_dir, key)
+
+    def __contains__(self, key):
+        return os.path.exists(os.path.join(self.path(key), 'meta.json'))
+
+    def load(self, key, mmap_mode=None):
+        """Return the summary, the proposal table and the dictionary `meta`
+        stored for `key`. If `mmap_mode` is not `None`, the numeric columns
+        of the summary are memory mapped, see `read_columnar`."""
+        path = self.path(key)
+        summary = read_columnar(os.path.join(path, 'summary'),
+                                mmap_mode=mmap_mode)
+        proposals = read_columnar(os.path.join(path, 'proposals'))
+        proposals = proposals.reset_index(drop=True)
+        with open(os.path.join(path, 'meta.json')) as fh:
+            meta = json.load(fh)
+        return summary, proposals, meta
+
+    def store(self, key, summary, proposals, meta):
+        """Store `summary`, `proposals` and the json serializable dict
+        `meta` for `key`. The entry is written to a temporary directory and
+        then moved into place so that partially written entries are never
+        read."""
+        tmpdir = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp')
+        try:
+            write_columnar(summary, os.path.join(tmpdir, 'summary'))
+            write_columnar(proposals, os.path.join(tmpdir, 'proposals'))
+            with open(os.path.join(tmpdir, 'meta.json'), 'w') as fh:
+                json.dump(meta, fh)
+            if key in self:
+                shutil.rmtree(self.path(key))
+            os.rename(tmpdir, self.path(key))
+        except Exception:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            raise
+
+    def clear(self):
+        """Remove all entries in the cache"""
+        for name in os.listdir(self.cache_dir):
+            shutil.rmtree(os.path.join(self.cache_dir, name),
+                          ignore_errors=True)
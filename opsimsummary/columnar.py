@@ -0,0 +1,345 @@
+"""
+Module to serialize `pd.DataFrame` objects like `OpSimOutput.summary` to a
+simple columnar binary format: a directory with one `.npy` file for each
+column and a `meta.json` file describing the column names and types. Numeric
+columns can then be read back memory mapped with `np.load(mmap_mode='r')`.
+
+Rows may be partitioned into row groups by the values of a column, eg.
+`propID` or `night`, with the minimum and maximum (or the distinct values)
+of each column in each row group stored in `meta.json`. Predicates passed to
+`read_columnar` are then used to skip row groups which cannot match, so
+that only the rows of the relevant row groups are read.
+"""
+from __future__ import division, print_function, absolute_import
+__all__ = ['write_columnar', 'read_columnar']
+import os
+import json
+import numpy as np
+import pandas as pd
+
+
+# distinct values are stored for row groups of string and categorical
+# columns with at most this number of distinct values
+maxDistinctValues = 256
+
+predicateOps = ('==', '!=', '<', '<=', '>', '>=', 'in', 'not in')
+
+
+def _column_arrays(series):
+    """Return a dictionary of arrays and a json serializable description
+    of the `pd.Series` `series`
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        desc = dict(kind='categorical',
+                    categories=list(series.cat.categories))
+        arrays = dict(data=series.cat.codes.values)
+    elif series.dtype.kind in 'biufcmM':
+        desc = dict(kind='numeric')
+        arrays = dict(data=np.asarray(series.values))
+    else:
+        # strings: store as fixed width unicode and a mask for missing values
+        mask = series.isnull().values
+        desc = dict(kind='string', masked=bool(mask.any()))
+        arrays = dict(data=np.asarray(series.astype(object).where(~mask, ''),
+                                      dtype=str))
+        if desc['masked']:
+            arrays['mask'] = mask
+    return arrays, desc
+
+
+def _row_groups(num, keys, rowGroupSize):
+    """Return the offsets of row groups of `num` rows sorted by `keys`,
+    starting a row group when the key changes or after `rowGroupSize` rows"""
+    starts = [0]
+    if keys is not None and num > 0:
+        starts = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+        starts = np.concatenate([[0], starts]).tolist()
+    if rowGroupSize is not None:
+        ends = starts[1:] + [num]
+        starts = list(s for start, end in zip(starts, ends)
+                      for s in range(start, end, rowGroupSize)) or [0]
+    return starts + [num]
+
+
+def _group_stats(arrays, coldesc, offsets):
+    """Return a json serializable dictionary of statistics of the rows of
+    each row group of a column, used to skip row groups"""
+    data = arrays['data']
+    starts = np.asarray(offsets[:-1], dtype=np.intp)
+    if len(data) == 0:
+        return None
+    if coldesc['kind'] == 'numeric':
+        if data.dtype.kind not in 'biuf':
+            return None
+        if data.dtype.kind == 'b':
+            data = data.astype(np.int8)
+        # null values never satisfy a predicate, so they are ignored
+        with np.errstate(invalid='ignore'):
+            vmin = np.fmin.reduceat(data, starts)
+            vmax = np.fmax.reduceat(data, starts)
+        return dict(min=vmin.tolist(), max=vmax.tolist())
+
+    if coldesc['kind'] == 'categorical':
+        codes, labels = data, coldesc['categories']
+    else:
+        labels, codes = np.unique(data, return_inverse=True)
+        if coldesc['masked']:
+            codes = np.where(arrays['mask'], -1, codes)
+        labels = labels.tolist()
+    if len(labels) > maxDistinctValues:
+        return None
+    values = []
+    for start, end in zip(offsets[:-1], offsets[1:]):
+        present = np.unique(codes[start:end])
+        values.append(list(labels[c] for c in present if c >= 0))
+    return dict(values=values)
+
+
+def write_columnar(df, dirname, columns=None, meta=None, partitionBy=None,
+                   rowGroupSize=None):
+    """Write the `pd.DataFrame` `df` to the directory `dirname`
+
+    Parameters
+    ----------
+    df : `pd.DataFrame`
+        dataframe to write out. The index is written as well.
+    dirname : string
+        absolute path to a directory which is created if it does not exist
+    columns : sequence of strings, defaults to `None`
+        if not `None`, only write these columns of `df`
+    meta : dict, defaults to `None`
+        json serializable dictionary of additional information, which can
+        be obtained from `read_columnar(dirname, return_meta=True)`
+    partitionBy : string, defaults to `None`
+        if not `None`, name of a column (or the index) of `df` by whose
+        values the rows are stored in row groups, eg. 'propID' or 'night'
+    rowGroupSize : int, defaults to `None`
+        if not `None`, maximal number of rows in a row group
+
+    .. note:: Row groups are only used if `partitionBy` or `rowGroupSize`
+        is not `None`. The rows of a partitioned dataframe are stored
+        sorted by the values of `partitionBy`, and returned in the original
+        order by `read_columnar`.
+    """
+    if columns is None:
+        columns = list(df.columns)
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+
+    desc = dict(columns=list(columns), index=df.index.name, descriptions=[],
+                meta=meta)
+    series = [pd.Series(df.index.values, name=df.index.name)]
+    series += list(df[col] for col in columns)
+
+    order, keys = None, None
+    if partitionBy is not None:
+        pos = 0 if partitionBy == df.index.name else \
+            list(columns).index(partitionBy) + 1
+        keys = series[pos]
+        if isinstance(keys.dtype, pd.CategoricalDtype):
+            keys = keys.cat.codes
+        keys = np.asarray(keys.values)
+        order = np.argsort(keys, kind='mergesort')
+        keys = keys[order]
+        if np.all(order[1:] > order[:-1]):
+            order = None
+    if partitionBy is not None or rowGroupSize is not None:
+        offsets = _row_groups(len(df), keys, rowGroupSize)
+        desc['rowGroups'] = dict(partitionBy=partitionBy, offsets=offsets,
+                                 ordered=order is None, stats=[])
+        if order is not None:
+            np.save(os.path.join(dirname, 'order.npy'), order,
+                    allow_pickle=False)
+
+    for i, ser in enumerate(series):
+        arrays, coldesc = _column_arrays(ser)
+        if order is not None:
+            arrays = dict((key, arr[order]) for key, arr in arrays.items())
+        for key in arrays:
+            np.save(os.path.join(dirname, '{0}.{1}.npy'.format(i, key)),
+                    arrays[key], allow_pickle=False)
+        desc['descriptions'].append(coldesc)
+        if 'rowGroups' in desc:
+            desc['rowGroups']['stats'].append(
+                _group_stats(arrays, coldesc, desc['rowGroups']['offsets']))
+
+    with open(os.path.join(dirname, 'meta.json'), 'w') as fh:
+        json.dump(desc, fh)
+
+
+def _may_match(stats, op, value):
+    """Return a boolean array which is `False` for row groups with the
+    statistics `stats` that cannot have rows satisfying the predicate"""
+    if stats is None:
+        return True
+    if 'values' in stats:
+        present = stats['values']
+        if op in ('==', 'in'):
+            values = set([value]) if op == '==' else set(value)
+            return np.array(list(len(values.intersection(p)) > 0
+                                 for p in present))
+        if op in ('!=', 'not in'):
+            values = set([value]) if op == '!=' else set(value)
+            return np.array(list(len(set(p) - values) > 0 for p in present))
+        return True
+
+    vmin = np.array(stats['min'], dtype=float)
+    vmax = np.array(stats['max'], dtype=float)
+    with np.errstate(invalid='ignore'):
+        if op == '==':
+            return (vmin <= value) & (vmax >= value)
+        if op == 'in':
+            value = np.sort(np.asarray(value, dtype=float))
+            if len(value) == 0:
+                return np.zeros(len(vmin), dtype=bool)
+            # a value in the group range exists if the first value
+            # >= vmin is <= vmax
+            first = np.searchsorted(value, vmin)
+            return (first < len(value)) & \
+                (value[np.minimum(first, len(value) - 1)] <= vmax)
+        if op == '<':
+            return vmin < value
+        if op == '<=':
+            return vmin <= value
+        if op == '>':
+            return vmax > value
+        if op == '>=':
+            return vmax >= value
+    return True
+
+
+def _evaluate(values, op, value):
+    """Return a boolean mask of `values` satisfying the predicate"""
+    if op == '==':
+        return values == value
+    if op == '!=':
+        return values != value
+    if op == 'in':
+        return np.isin(values, list(value))
+    if op == 'not in':
+        return ~np.isin(values, list(value))
+    with np.errstate(invalid='ignore'):
+        if op == '<':
+            return values < value
+        if op == '<=':
+            return values <= value
+        if op == '>':
+            return values > value
+        return values >= value
+
+
+def read_columnar(dirname, columns=None, mmap_mode=None, return_meta=False,
+                  predicates=None):
+    """Read a `pd.DataFrame` written by `write_columnar`
+
+    Parameters
+    ----------
+    dirname : string
+        absolute path to the directory
+    columns : sequence of strings, defaults to `None`
+        if not `None`, only read these columns
+    mmap_mode : {None|'r'|'c'}, defaults to `None`
+        passed on to `np.load`. If not `None`, numeric columns of the
+        dataframe are memory mapped rather than read into memory, unless
+        rows are selected by `predicates` or stored in row groups in a
+        different order.
+    return_meta : Bool, defaults to `False`
+        if `True`, also return the dictionary `meta` passed to
+        `write_columnar`
+    predicates : sequence of tuples, defaults to `None`
+        if not `None`, only rows satisfying all of the predicates are
+        returned. Each predicate is a tuple (`column`, `op`, `value`)
+        where `column` is the name of a column or the index, `op` is one of
+        {'=='|'!='|'<'|'<='|'>'|'>='|'in'|'not in'} and `value` a scalar or
+        a sequence for 'in' and 'not in', eg. `('propID', 'in', [364, 366])`.
+        Row groups whose statistics show they have no such rows are not
+        read.
+
+    Returns
+    -------
+    `pd.DataFrame`, or a tuple of `pd.DataFrame` and dict if `return_meta`
+    """
+    with open(os.path.join(dirname, 'meta.json')) as fh:
+        desc = json.load(fh)
+
+    allcolumns = desc['columns']
+    if columns is None:
+        columns = allcolumns
+    rowGroups = desc.get('rowGroups')
+
+    def position(col):
+        if col == desc['index']:
+            return 0
+        if col not in allcolumns:
+            raise ValueError('column {} not in table'.format(col))
+        return allcolumns.index(col) + 1
+
+    def load(i, key, mode=mmap_mode):
+        fname = os.path.join(dirname, '{0}.{1}.npy'.format(i, key))
+        return np.load(fname, mmap_mode=mode, allow_pickle=False)
+
+    # integer positions of rows to read in the stored order, or `None` for
+    # all the rows, and the permutation restoring the original order
+    rows, perm = None, None
+    if predicates:
+        for col, op, value in predicates:
+            if op not in predicateOps:
+                raise ValueError('predicate op {0} not in {1}'.format(
+                    op, predicateOps))
+        offsets = np.array(rowGroups['offsets'] if rowGroups is not None
+                           else [0, len(load(0, 'data', 'r'))])
+        selected = np.ones(len(offsets) - 1, dtype=bool)
+        if rowGroups is not None:
+            for col, op, value in predicates:
+                selected &= _may_match(rowGroups['stats'][position(col)],
+                                       op, value)
+        starts, ends = offsets[:-1][selected], offsets[1:][selected]
+        rows = np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)]
+                              + [np.zeros(0, dtype=np.intp)])
+
+        # evaluate the predicates on the rows of the selected row groups
+        mask = np.ones(len(rows), dtype=bool)
+        for col, op, value in predicates:
+            i = position(col)
+            values = load(i, 'data', 'r')[rows]
+            coldesc = desc['descriptions'][i]
+            if coldesc['kind'] == 'categorical':
+                values = np.asarray(pd.Categorical.from_codes(
+                    values, coldesc['categories']).astype(object))
+            mask &= _evaluate(values, op, value)
+        rows = rows[mask]
+
+    if rowGroups is not None and not rowGroups['ordered']:
+        order = np.load(os.path.join(dirname, 'order.npy'), mmap_mode='r')
+        if rows is None:
+            rows = np.arange(len(order))
+        perm = np.argsort(order[rows], kind='mergesort')
+
+    def column(i):
+        coldesc = desc['descriptions'][i]
+        if rows is None:
+            data = load(i, 'data')
+        else:
+            # gather in the stored order and then restore the original order
+            data = load(i, 'data', 'r')[rows]
+            if perm is not None:
+                data = data[perm]
+        if coldesc['kind'] == 'categorical':
+            return pd.Categorical.from_codes(data, coldesc['categories'])
+        elif coldesc['kind'] == 'string':
+            data = data.astype(object)
+            if coldesc['masked']:
+                mask = load(i, 'mask', 'r')
+                mask = mask if rows is None else mask[rows]
+                if perm is not None:
+                    mask = mask[perm]
+                data[mask] = np.nan
+            return data
+        return data
+
+    index = pd.Index(column(0), name=desc['index'])
+    data = dict((col, column(allcolumns.index(col) + 1)) for col in columns)
+    df = pd.DataFrame(data, index=index, columns=list(columns), copy=False)
+    if return_meta:
+        return df, desc['meta']
+    return df
@@ -0,0 +1,306 @@
+"""
+Module to count the visits covering HEALPix pixels over the sky. The centers
+of the pixels are cached for each pixelization, the pixels are restricted to
+those near the pointings with a coarse pixelization, and the counts of
+blocks of pixels are computed in parallel threads.
+"""
+from __future__ import division, print_function, absolute_import
+__all__ = ['pixelCenters', 'footprintPixels', 'visitCounts',
+           'hierarchicalCounts']
+import time
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import numpy as np
+import healpy as hp
+
+try:
+    from functools import lru_cache
+except ImportError:
+    lru_cache = None
+
+
+def _pixelCenters(nside, nest=True):
+    ra, dec = hp.pix2ang(nside, np.arange(hp.nside2npix(nside)), nest=nest,
+                         lonlat=True)
+    ra.setflags(write=False)
+    dec.setflags(write=False)
+    return ra, dec
+
+if lru_cache is not None:
+    _pixelCenters = lru_cache(maxsize=8)(_pixelCenters)
+
+
+def pixelCenters(nside, nest=True):
+    """
+    Return read-only arrays of the ra and dec in degrees of the centers of
+    all the pixels of the HEALPix pixelization `nside`, which are cached for
+    the last few values of (`nside`, `nest`).
+
+    Parameters
+    ----------
+    nside : int
+        `NSIDE` of the pixelization
+    nest : Bool, defaults to `True`
+        if `True` use the `nest` ordering, else `ring`
+    """
+    return _pixelCenters(int(nside), bool(nest))
+
+
+def footprintPixels(ra, dec, radius, nside, nest=True, coarseNside=64):
+    """
+    Return the sorted ids of the pixels of the pixelization `nside` whose
+    centers may be within `radius` of any of the positions `ra`, `dec`. All
+    the other pixels are further away from all the positions.
+
+    Parameters
+    ----------
+    ra : `np.ndarray`, degrees
+        ra of the positions, eg. of pointings
+    dec : `np.ndarray`, degrees
+        dec of the positions
+    radius : float, degrees
+        radius around the positions
+    nside : int
+        `NSIDE` of the pixelization
+    nest : Bool, defaults to `True`
+        if `True` use the `nest` ordering, else `ring`
+    coarseNside : int, defaults to 64
+        `NSIDE` of the coarse pixelization used to find the pixels. If larger
+        than `nside`, `nside` is used.
+
+    Raises
+    ------
+    ValueError
+        if `nside` or `coarseNside` are not valid `NSIDE` of the `nest`
+        ordering, ie. powers of 2, in which case the pixels of `nside`
+        cannot be found from their coarse parents.
+
+    .. note:: The coarse pixels within `radius` and the size of a coarse
+        pixel of those holding a position are found with
+        `healpy.query_disc`, and all their children are returned.
+    """
+    for n in (nside, coarseNside):
+        if not hp.isnsideok(n, nest=True):
+            raise ValueError('nside and coarseNside must be powers of 2, not '
+                             '{0} and {1}'.format(nside, coarseNside))
+    coarseNside = min(coarseNside, nside)
+    # the ratio of powers of 2 is a power of 2, so that each coarse pixel
+    # has numChildren children in the nest ordering
+    occupied = np.unique(hp.ang2pix(coarseNside, ra, dec, nest=True,
+                                    lonlat=True))
+    cra, cdec = hp.pix2ang(coarseNside, occupied, nest=True, lonlat=True)
+    vecs = hp.ang2vec(cra, cdec, lonlat=True)
+    disc = np.radians(radius) + hp.max_pixrad(coarseNside) + 1.0e-9
+    coarse = list(hp.query_disc(coarseNside, vec, disc, inclusive=True,
+                                nest=True) for vec in vecs)
+    coarse = np.unique(np.concatenate(coarse)) if len(coarse) > 0 \
+        else np.zeros(0, dtype=np.int64)
+
+    # children of the coarse pixels in the nest ordering
+    numChildren = (nside // coarseNside) ** 2
+    pixels = (coarse[:, np.newaxis] * numChildren +
+              np.arange(numChildren)).ravel()
+    if not nest:
+        pixels = np.sort(hp.nest2ring(nside, pixels))
+    return pixels
+
+
+def _blockCounts(job):
+    """Return the counts of pointings of the `PointingTree` of `job` within
+    each of the radii of the positions in the block"""
+    tree, X, radii, workers = job
+    # counting queries of each radius are faster than a single query of
+    # the neighbours within the largest radius
+    return np.column_stack(list(tree.query_radius(X, r, count_only=True,
+                                                  workers=workers)
+                                for r in radii))
+
+
+def _counts(pointingTree, X, radii, blockSize=65536, workers=None):
+    """Return an array of the counts of pointings of `pointingTree` within
+    each of `radii` (radians) of the positions `X` (dec, ra in radians),
+    with a column for each radius, computed for blocks of `blockSize`
+    positions in `workers` threads"""
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    jobs = list((pointingTree, X[start:start + blockSize], radii,
+                 1 if workers > 1 else None)
+                for start in range(0, len(X), blockSize))
+    if workers > 1 and len(jobs) > 1:
+        # both tree backends release the GIL in queries
+        pool = ThreadPool(processes=min(workers, len(jobs)))
+        try:
+            counts = pool.map(_blockCounts, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        counts = list(_blockCounts(job) for job in jobs)
+    if len(counts) == 0:
+        return np.zeros((0, len(radii)), dtype=np.intp)
+    return np.concatenate(counts)
+
+
+def visitCounts(pointingTree, nside=256, nest=True, radii=1.75,
+                footprintOnly=True, coarseNside=64, blockSize=65536,
+                workers=None):
+    """
+    Return the number of pointings in a `PointingTree` whose centers are
+    within each of several radii of the centers of HEALPix pixels.
+
+    Parameters
+    ----------
+    pointingTree : `PointingTree`
+        tree of the pointings
+    nside : int, defaults to 256
+        `NSIDE` of the pixelization
+    nest : Bool, defaults to `True`
+        if `True` use the `nest` ordering, else `ring`
+    radii : float or sequence of floats, degrees, defaults to 1.75
+        radii of the field of view, the counts for all the radii are
+        computed in a single pass over the pixels
+    footprintOnly : Bool, defaults to `True`
+        if `True`, only pixels near the pointings are returned (see
+        `footprintPixels`), and pixels left out have no pointings.
+        Otherwise, all pixels are returned.
+    coarseNside : int, defaults to 64
+        `NSIDE` of the coarse pixelization used by `footprintPixels`
+    blockSize : int, defaults to 65536
+        number of pixels queried together
+    workers : int, defaults to `None`
+        number of threads counting blocks of pixels, if `None` the number of
+        cpus
+
+    Returns
+    -------
+    tuple of the array of pixel ids, and the array of counts for each
+    pixel, with a second axis for the radii if `radii` is a sequence.
+    """
+    tstart = time.time()
+    scalar = np.ndim(radii) == 0
+    radii = np.radians(np.atleast_1d(radii).astype(np.float64))
+    ra, dec = pixelCenters(nside, nest)
+    if footprintOnly:
+        pra, pdec = pointingTree.raDec
+        hids = footprintPixels(pra, pdec, np.degrees(radii.max()), nside,
+                               nest=nest, coarseNside=coarseNside)
+        ra = ra[hids]
+        dec = dec[hids]
+    else:
+        hids = np.arange(len(ra))
+
+    X = np.column_stack((np.radians(dec), np.radians(ra)))
+    counts = _counts(pointingTree, X, radii, blockSize, workers)
+    print('counted visits of {0} pixels in {1:.1f} s'.format(
+        len(hids), time.time() - tstart))
+    if scalar:
+        counts = counts[:, 0]
+    return hids, counts
+
+
+def hierarchicalCounts(pointingTree, nside=256, nest=True, radius=1.75,
+                       minVisits=1, maxVisits=None, countsRequired=True,
+                       coarseNside=8, blockSize=65536, workers=None):
+    """
+    Return the number of pointings of a `PointingTree` within `radius` of
+    the centers of the HEALPix pixels of `nside` which have between
+    `minVisits` and `maxVisits` pointings, the same as the pixels and counts
+    of `visitCounts`, while counting only a fraction of the pixels.
+
+    Pixels are counted from the resolution `coarseNside` up to `nside`. The
+    counts of all the pixels inside a pixel of center `c` and maximum radius
+    `rho` are between the counts within `radius - rho` and `radius + rho` of
+    `c`. If these are equal, all the pixels inside have this count.
+    Pixels whose bounds are outside [`minVisits`, `maxVisits`] are dropped,
+    and the others are divided into their four children for the next
+    resolution, until the pixels of `nside` are counted.
+
+    Parameters
+    ----------
+    pointingTree : `PointingTree`
+        tree of the pointings
+    nside : int, defaults to 256
+        `NSIDE` of the pixelization
+    nest : Bool, defaults to `True`
+        if `True` use the `nest` ordering, else `ring`
+    radius : float, degrees, defaults to 1.75
+        radius of the field of view
+    minVisits : int, defaults to 1
+        minimum number of pointings of the pixels returned
+    maxVisits : int, defaults to `None`
+        maximum number of pointings of the pixels returned, if `None` there
+        is no maximum
+    countsRequired : Bool, defaults to `True`
+        if `False`, pixels inside a coarse pixel whose bounds are both
+        between `minVisits` and `maxVisits` are not counted and have the
+        count -1, which is faster when only the pixels are needed
+    coarseNside : int, defaults to 8
+        `NSIDE` of the coarsest resolution
+    blockSize : int, defaults to 65536
+        number of pixels queried together
+    workers : int, defaults to `None`
+        number of threads counting blocks of pixels, if `None` the number of
+        cpus
+
+    Returns
+    -------
+    tuple of the sorted array of pixel ids and the array of counts
+    """
+    tstart = time.time()
+    r = np.radians(radius)
+    if maxVisits is None:
+        maxVisits = np.inf
+    level = min(coarseNside, nside)
+    pixels = np.arange(hp.nside2npix(level))
+    hids = []
+    counts = []
+    numQueried = 0
+    while level < nside:
+        # descendant centers are within rho of the center, with a margin as
+        # pixel edges are not great circles
+        rho = 1.05 * hp.max_pixrad(level) + 1.0e-9
+        ra, dec = hp.pix2ang(level, pixels, nest=True, lonlat=True)
+        X = np.column_stack((np.radians(dec), np.radians(ra)))
+        upper = _counts(pointingTree, X, [r + rho], blockSize, workers)[:, 0]
+        lower = np.zeros_like(upper)
+        possible = (upper >= minVisits)
+        if r > rho:
+            lower[possible] = _counts(pointingTree, X[possible], [r - rho],
+                                      blockSize, workers)[:, 0]
+        numQueried += len(pixels)
+
+        possible &= (lower <= maxVisits)
+        uniform = possible & (lower == upper)
+        done = uniform.copy()
+        if not countsRequired:
+            done |= possible & (lower >= minVisits) & (upper <= maxVisits)
+
+        numDescendants = (nside // level) ** 2
+        descendants = (pixels[done][:, np.newaxis] * numDescendants +
+                       np.arange(numDescendants)).ravel()
+        hids.append(descendants)
+        counts.append(np.repeat(np.where(uniform[done], lower[done], -1),
+                                numDescendants))
+
+        pixels = (pixels[possible & ~done][:, np.newaxis] * 4 +
+                  np.arange(4)).ravel()
+        level *= 2
+
+    ra, dec = hp.pix2ang(nside, pixels, nest=True, lonlat=True)
+    X = np.column_stack((np.radians(dec), np.radians(ra)))
+    hids.append(pixels)
+    counts.append(_counts(pointingTree, X, [r], blockSize, workers)[:, 0])
+    numQueried += len(pixels)
+
+    hids = np.concatenate(hids)
+    counts = np.concatenate(counts)
+    keep = (counts == -1) | ((counts >= minVisits) & (counts <= maxVisits))
+    hids = hids[keep]
+    counts = counts[keep]
+    if not nest:
+        hids = hp.nest2ring(nside, hids)
+    order = np.argsort(hids)
+    print('found {0} of {1} pixels with queries of {2} pixels in {3:.1f} s'
+          .format(len(hids), hp.nside2npix(nside), numQueried,
+                  time.time() - tstart))
+    return hids[order], counts[order]
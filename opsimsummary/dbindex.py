@@ -0,0 +1,218 @@
+"""
+Module to build indexes on the columns of the summary table of OpSim
+databases used to select visits (the proposal ID, `night` and the MJD), which
+OpSim outputs do not have. Indexes are built either in the database, or in a
+sidecar copy of the database next to it, which is then used in place of the
+database by `OpSimOutput` loaders. `benchmark_indexes` reports the time taken
+by the queries of the loaders with and without the indexes.
+"""
+from __future__ import division, print_function, absolute_import
+__all__ = ['build_indexes', 'summary_indexes', 'sidecar_dbname',
+           'indexed_dbname', 'benchmark_indexes']
+import os
+import time
+import sqlite3
+import pandas as pd
+
+try:
+    from urllib.request import pathname2url
+except ImportError:
+    from urllib import pathname2url
+
+
+def _fetchall(con, sql):
+    """Return the rows of the query `sql` on a `sqlite3.Connection` or a
+    `sqlalchemy` engine"""
+    if isinstance(con, sqlite3.Connection):
+        return con.execute(sql).fetchall()
+    with con.connect() as conn:
+        return list(tuple(row) for row in conn.exec_driver_sql(sql))
+
+
+def _index_columns(opsimVars):
+    """names of the columns of the summary table which are indexed"""
+    return [opsimVars['propIDNameInSummary'], 'night', opsimVars['expMJD']]
+
+
+def sidecar_dbname(dbname):
+    """Return the path to the sidecar copy of the database `dbname` with
+    indexes, eg. `minion_1016_sqlite_indexed.db`"""
+    root, ext = os.path.splitext(dbname)
+    return root + '_indexed' + ext
+
+
+def indexed_dbname(dbname):
+    """Return the path to the sidecar copy of the database `dbname` if it
+    exists and was written after the database was last modified, or else
+    `dbname`"""
+    sidecar = sidecar_dbname(dbname)
+    if os.path.exists(dbname) and os.path.exists(sidecar) and \
+            os.path.getmtime(sidecar) >= os.path.getmtime(dbname):
+        return sidecar
+    return dbname
+
+
+def summary_indexes(con, tableName):
+    """
+    Return a dictionary whose keys are names of the columns of the table
+    `tableName` which are the first column of an index, and values the
+    names of the indexes.
+
+    Parameters
+    ----------
+    con : `sqlite3.Connection` or `sqlalchemy` engine
+        connection to the database
+    tableName : string
+        name of the table
+    """
+    indexes = dict()
+    for row in _fetchall(con, 'PRAGMA index_list("{}")'.format(tableName)):
+        name = row[1]
+        info = _fetchall(con, 'PRAGMA index_info("{}")'.format(name))
+        first = list(r[2] for r in info if r[0] == 0)
+        if len(first) > 0 and first[0] not in indexes:
+            indexes[first[0]] = name
+    return indexes
+
+
+def build_indexes(dbname, opsimversion='lsstv3', sidecar=False):
+    """
+    Build indexes on the proposal ID, `night` and MJD columns of the summary
+    table of the OpSim database `dbname`, and the statistics used by SQLite
+    to choose them.
+
+    Parameters
+    ----------
+    dbname : string
+        absolute path to the OpSim database
+    opsimversion : {'lsstv3'|'lsstv4'|'sstf'}, defaults to 'lsstv3'
+        version of OpSim
+    sidecar : Bool or string, defaults to `False`
+        if `False`, build the indexes in the database. Otherwise build them
+        in a copy of the database at the path `sidecar`, or if `True`, at
+        `sidecar_dbname(dbname)` where the loaders of `OpSimOutput` find it.
+
+    Returns
+    -------
+    path to the database with the indexes
+    """
+    from .opsim_out import OpSimOutput
+    opsimVars = OpSimOutput.get_opsimVariablesForVersion(opsimversion)
+    tableName = opsimVars['summaryTableName']
+
+    target = dbname
+    if sidecar:
+        target = sidecar_dbname(dbname) if sidecar is True else sidecar
+        uri = 'file:{}?mode=ro'.format(pathname2url(os.path.abspath(dbname)))
+        src = sqlite3.connect(uri, uri=True)
+        dst = sqlite3.connect(target)
+        try:
+            src.backup(dst)
+        finally:
+            src.close()
+            dst.close()
+
+    con = sqlite3.connect(target)
+    try:
+        existing = summary_indexes(con, tableName)
+        for col in _index_columns(opsimVars):
+            if col in existing:
+                continue
+            con.execute('CREATE INDEX "opsimsummary_{0}_{1}" ON "{0}" ("{1}")'
+                        .format(tableName, col))
+        con.execute('ANALYZE "{}"'.format(tableName))
+        con.commit()
+    finally:
+        con.close()
+    return target
+
+
+def benchmark_indexes(dbname, opsimversion='lsstv3', repeat=3, numNights=30):
+    """
+    Return the time taken by the queries used to read subsets of visits
+    from the OpSim database `dbname` with indexes, with and without using
+    the indexes.
+
+    Parameters
+    ----------
+    dbname : string
+        absolute path to an OpSim database with indexes
+    opsimversion : {'lsstv3'|'lsstv4'|'sstf'}, defaults to 'lsstv3'
+        version of OpSim
+    repeat : int, defaults to 3
+        number of times each query is run, the shortest time is reported
+    numNights : int, defaults to 30
+        number of nights (or days) in the queries of ranges of nights and
+        MJD
+
+    Returns
+    -------
+    `pd.DataFrame` with the columns `query`, `numRows`, `scanSeconds`,
+    `indexSeconds`, `speedup` and `loaderUsesIndex`, which is `False` if
+    the loaders avoid the index for the query because it selects a large
+    fraction of the table.
+    """
+    from .opsim_out import OpSimOutput
+    opsimVars = OpSimOutput.get_opsimVariablesForVersion(opsimversion)
+    tableName = opsimVars['summaryTableName']
+    tableNames = (tableName, 'Proposal')
+    con = OpSimOutput._get_connection(dbname, backend='sqlite3')
+    indexes = summary_indexes(con, tableName)
+    missing = list(col for col in _index_columns(opsimVars)
+                   if col not in indexes)
+    if len(missing) > 0:
+        raise ValueError('database {0} has no indexes on {1}, see '
+                         '`build_indexes`'.format(dbname, missing))
+
+    def best_time(sql):
+        times = []
+        for i in range(repeat):
+            tstart = time.time()
+            rows = con.execute(sql).fetchall()
+            times.append(time.time() - tstart)
+        return min(times), len(rows)
+
+    queries = []
+    for subset in ('ddf', 'wfd', 'combined'):
+        propDict, propIDs, proposals = OpSimOutput._get_propIDs(
+            tableNames, con, opsimversion, subset)
+        dedup = OpSimOutput._dedupInSQL(subset, opsimversion)
+        columns = OpSimOutput._get_table_columns(con, tableName)
+        for notIndexed in (True, False):
+            sql = OpSimOutput._summary_query(opsimVars, propIDs, subset,
+                                             columns=columns,
+                                             dedupPropIDDict=propDict
+                                             if dedup else None,
+                                             notIndexed=notIndexed)
+            if notIndexed:
+                queries.append(dict(query='subset ' + subset, scan=sql))
+            else:
+                queries[-1]['index'] = sql
+        queries[-1]['loaderUsesIndex'] = not OpSimOutput._useTableScan(
+            con, opsimVars, propIDs, subset)
+
+    night, mjd = con.execute('SELECT MIN(night), MIN("{0}") FROM "{1}"'.format(
+        opsimVars['expMJD'], tableName)).fetchone()
+    for name, col, start in (('night range', 'night', night),
+                             ('mjd range', opsimVars['expMJD'], mjd)):
+        sql = 'SELECT * FROM "{0}"{1} WHERE "{2}" >= {3} AND "{2}" < {4}'
+        queries.append(dict(query=name,
+                            scan=sql.format(tableName, ' NOT INDEXED', col,
+                                            start, start + numNights),
+                            index=sql.format(tableName, '', col, start,
+                                             start + numNights),
+                            loaderUsesIndex=True))
+
+    results = []
+    for q in queries:
+        scanSeconds, numRows = best_time(q['scan'])
+        indexSeconds, _ = best_time(q['index'])
+        results.append(dict(query=q['query'], numRows=numRows,
+                            scanSeconds=scanSeconds,
+                            indexSeconds=indexSeconds,
+                            speedup=scanSeconds / indexSeconds,
+                            loaderUsesIndex=q['loaderUsesIndex']))
+    con.close()
+    return pd.DataFrame(results, columns=['query', 'numRows', 'scanSeconds',
+                                          'indexSeconds', 'speedup',
+                                          'loaderUsesIndex'])
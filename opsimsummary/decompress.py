@@ -0,0 +1,226 @@
+"""
+Module to read OpSim databases archived as compressed files (eg.
+`minion_1016_sqlite.db.gz` or `.db.xz`). SQLite can only open uncompressed
+files, so a compressed database is decompressed once into a local cache of
+uncompressed copies named by the hash of their contents, and the copy is
+reused on later reads. The least recently used copies are removed when the
+cache grows beyond a maximum size.
+"""
+from __future__ import division, print_function, absolute_import
+__all__ = ['DecompressionCache', 'compression_format']
+import os
+import re
+import bz2
+import gzip
+import time
+import hashlib
+import tempfile
+from .dbindex import sidecar_dbname
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+
+# leading bytes of files in each compression format
+_MAGIC = (('gzip', b'\x1f\x8b'), ('xz', b'\xfd7zXZ\x00'), ('bz2', b'BZh'))
+_ENTRY = re.compile(r'^[0-9a-f]{64}\.db$')
+
+
+def compression_format(filename):
+    """Return the compression format of the file `filename`, one of
+    {'gzip'|'xz'|'bz2'}, or `None` if it is not compressed (or does not
+    exist)"""
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, 'rb') as fh:
+        head = fh.read(6)
+    for fmt, magic in _MAGIC:
+        if head.startswith(magic):
+            return fmt
+    return None
+
+
+def _open_compressed(filename, fmt):
+    """Return a file object reading the decompressed contents of
+    `filename`"""
+    if fmt == 'gzip':
+        return gzip.open(filename, 'rb')
+    elif fmt == 'bz2':
+        return bz2.BZ2File(filename, 'rb')
+    elif fmt == 'xz':
+        if lzma is None:
+            raise ImportError('lzma is required to read {}'.format(filename))
+        return lzma.open(filename, 'rb')
+    raise ValueError('compression format {} not recognized'.format(fmt))
+
+
+class DecompressionCache(object):
+    """
+    Directory of uncompressed copies of compressed OpSim databases, named
+    by the sha256 hash of their contents, eg. `<hash>.db`. A compressed file
+    is identified by its absolute path, size and modification time, so that
+    it is only read again if it changes.
+
+    Parameters
+    ----------
+    cache_dir : string, defaults to `None`
+        absolute path to the directory of the cache, created if it does not
+        exist. If `None`, the environment variable
+        `OPSIMSUMMARY_DECOMPRESSION_CACHE` or else
+        `DecompressionCache.defaultDir`.
+    max_bytes : int, defaults to `None`
+        maximum total size of the copies in the cache in bytes, beyond which
+        the least recently used copies are removed. If `None`,
+        `DecompressionCache.defaultMaxBytes`.
+
+    .. note:: A copy larger than `max_bytes` is kept until another copy is
+        added. Copies are written to a temporary file and then renamed, so
+        that several processes may use the cache.
+    """
+    defaultDir = os.path.join(os.path.expanduser('~'), '.cache',
+                              'opsimsummary', 'databases')
+    defaultMaxBytes = 50 * 2**30
+    chunkSize = 2**24
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        if cache_dir is None:
+            cache_dir = os.environ.get('OPSIMSUMMARY_DECOMPRESSION_CACHE',
+                                       self.defaultDir)
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        self.max_bytes = self.defaultMaxBytes if max_bytes is None \
+            else max_bytes
+        self._idsdir = os.path.join(self.cache_dir, 'ids')
+        if not os.path.exists(self._idsdir):
+            os.makedirs(self._idsdir)
+
+    @staticmethod
+    def _identity(filename):
+        """Return a hash of the absolute path, size and modification time
+        of the file `filename`"""
+        stat = os.stat(filename)
+        mtime = stat.st_mtime_ns if hasattr(stat, 'st_mtime_ns') \
+            else stat.st_mtime
+        ident = '{0}|{1}|{2}'.format(os.path.abspath(filename), stat.st_size,
+                                     mtime)
+        return hashlib.sha1(ident.encode('utf-8')).hexdigest()
+
+    def path(self, digest):
+        """absolute path to the copy with the hash of contents `digest`"""
+        return os.path.join(self.cache_dir, digest + '.db')
+
+    def entries(self):
+        """Return a list of tuples of the path, size in bytes (including
+        the sidecar copy with indexes, see `build_indexes`) and last access
+        time of the copies in the cache, least recently used first"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not _ENTRY.match(name):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            size = stat.st_size
+            sidecar = sidecar_dbname(path)
+            if os.path.exists(sidecar):
+                size += os.path.getsize(sidecar)
+            entries.append((path, size, stat.st_atime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def size(self):
+        """total size of the copies in the cache in bytes"""
+        return sum(size for _, size, _ in self.entries())
+
+    @staticmethod
+    def _touch(path):
+        """Record the use of the copy `path` in its access time, keeping its
+        modification time"""
+        os.utime(path, (time.time(), os.stat(path).st_mtime))
+
+    def get(self, filename):
+        """
+        Return the path to an uncompressed copy of the database `filename`,
+        decompressing it into the cache if there is no copy, or `filename`
+        itself if it is not compressed.
+        """
+        fmt = compression_format(filename)
+        if fmt is None:
+            return filename
+        idfile = os.path.join(self._idsdir, self._identity(filename))
+        if os.path.exists(idfile):
+            with open(idfile) as fh:
+                path = self.path(fh.read().strip())
+            if os.path.exists(path):
+                self._touch(path)
+                return path
+
+        tstart = time.time()
+        path = self._decompress(filename, fmt)
+        print('decompressed {0} to {1} in {2:.1f} s'.format(
+            filename, path, time.time() - tstart))
+        self._write_atomic(idfile, os.path.basename(path)[:-len('.db')])
+        self.evict(keep=path)
+        return path
+
+    def _write_atomic(self, filename, text):
+        """write `text` to `filename` through a temporary file"""
+        fd, tmpname = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp')
+        with os.fdopen(fd, 'w') as fh:
+            fh.write(text)
+        os.rename(tmpname, filename)
+
+    def _decompress(self, filename, fmt):
+        """Stream the decompressed contents of `filename` to a temporary
+        file hashing them, and move it to its place in the cache"""
+        h = hashlib.sha256()
+        fd, tmpname = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp')
+        try:
+            with _open_compressed(filename, fmt) as src, \
+                    os.fdopen(fd, 'wb') as dst:
+                while True:
+                    chunk = src.read(self.chunkSize)
+                    if not chunk:
+                        break
+                    h.update(chunk)
+                    dst.write(chunk)
+            path = self.path(h.hexdigest())
+            if os.path.exists(path):
+                # the same contents were decompressed from another file
+                os.remove(tmpname)
+            else:
+                os.rename(tmpname, path)
+        except Exception:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+            raise
+        self._touch(path)
+        return path
+
+    def evict(self, keep=None):
+        """Remove the least recently used copies, and their sidecar copies
+        with indexes, until the size of the cache is at most `max_bytes`,
+        never removing the copy `keep`"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            print('removing least recently used {}'.format(path))
+            for name in (path, sidecar_dbname(path)):
+                if os.path.exists(name):
+                    os.remove(name)
+            total -= size
+
+    def clear(self):
+        """Remove all copies in the cache"""
+        for path, _, _ in self.entries():
+            for name in (path, sidecar_dbname(path)):
+                if os.path.exists(name):
+                    os.remove(name)
+        for name in os.listdir(self._idsdir):
+            os.remove(os.path.join(self._idsdir, name))
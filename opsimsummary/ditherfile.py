@@ -0,0 +1,211 @@
+"""
+Module providing a compact binary format for dithered pointings of OpSim
+visits, and joins of these pointings to summary tables. A dither file has a
+fixed header followed by the `obsHistID` values sorted in increasing order as
+64 bit integers, and the dithered right ascensions and declinations as 64 bit
+floats, so that each array can be memory mapped. Since the `obsHistID` values
+are sorted, dithers are attached to visits with `np.searchsorted` rather than
+a hash join on a `pd.Index`.
+"""
+from __future__ import division, print_function, absolute_import
+__all__ = ['DitherTable', 'is_ditherfile']
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+
+
+_MAGIC = b'OSSDITH1'
+# magic, number of visits, reserved
+_HEADER = np.dtype([('magic', 'S8'), ('numVisits', '<u8'),
+                    ('reserved', '<u8', (2,))])
+
+# column names of the dither files provided by DESC
+descColumns = dict(observationId='obsHistID',
+                   descDitheredRA='ditheredRA',
+                   descDitheredDec='ditheredDec')
+
+
+def is_ditherfile(filename):
+    """Return `True` if `filename` is a binary dither file written by
+    `DitherTable.write`"""
+    with open(filename, 'rb') as fh:
+        return fh.read(len(_MAGIC)) == _MAGIC
+
+
+class DitherTable(object):
+    """
+    Dithered pointings of visits sorted by `obsHistID`.
+
+    Parameters
+    ----------
+    obsHistID : `np.ndarray` of integers
+        visit IDs in strictly increasing order
+    ditheredRA : `np.ndarray` of floats
+        dithered right ascensions of the visits
+    ditheredDec : `np.ndarray` of floats
+        dithered declinations of the visits
+
+    Notes
+    -----
+    The coordinates are stored as they are provided, and must be in the
+    unit used for the summary table of the OpSim version they are joined
+    to.
+    """
+    def __init__(self, obsHistID, ditheredRA, ditheredDec):
+        if not len(obsHistID) == len(ditheredRA) == len(ditheredDec):
+            raise ValueError('obsHistID, ditheredRA and ditheredDec must '
+                             'have the same length')
+        if len(obsHistID) > 1 and not np.all(obsHistID[1:] > obsHistID[:-1]):
+            raise ValueError('obsHistID must be unique and sorted, use '
+                             '`DitherTable.fromArrays`')
+        self.obsHistID = obsHistID
+        self.ditheredRA = ditheredRA
+        self.ditheredDec = ditheredDec
+
+    def __len__(self):
+        return len(self.obsHistID)
+
+    @classmethod
+    def fromArrays(cls, obsHistID, ditheredRA, ditheredDec):
+        """
+        Instantiate the class from unsorted arrays of `obsHistID` and
+        dithered coordinates, raising a `ValueError` if `obsHistID` values
+        are repeated.
+        """
+        obsHistID = np.asarray(obsHistID, dtype=np.int64)
+        order = np.argsort(obsHistID, kind='mergesort')
+        obsHistID = obsHistID[order]
+        if len(obsHistID) > 1 and np.any(obsHistID[1:] == obsHistID[:-1]):
+            raise ValueError('obsHistID values of dithers are not unique')
+        return cls(obsHistID,
+                   np.asarray(ditheredRA, dtype=np.float64)[order],
+                   np.asarray(ditheredDec, dtype=np.float64)[order])
+
+    @classmethod
+    def fromDataFrame(cls, df):
+        """
+        Instantiate the class from a `pd.DataFrame` with index `obsHistID`
+        and columns `ditheredRA` and `ditheredDec`, like the `dithercolumns`
+        of `OpSimOutput.fromOpSimDB`.
+        """
+        if df.index.name != 'obsHistID':
+            raise ValueError('index of dithers must be obsHistID')
+        return cls.fromArrays(df.index.values, df.ditheredRA.values,
+                              df.ditheredDec.values)
+
+    @classmethod
+    def fromDESCCSV(cls, filename):
+        """
+        Instantiate the class from a csv file of dithers in the format
+        provided by DESC (eg. `descDithers_minion_1016.csv`) with columns
+        `observationId`, `descDitheredRA` and `descDitheredDec`.
+        """
+        df = pd.read_csv(filename, usecols=list(descColumns.keys()),
+                         dtype=dict(observationId=np.int64,
+                                    descDitheredRA=np.float64,
+                                    descDitheredDec=np.float64))
+        return cls.fromArrays(df.observationId.values,
+                              df.descDitheredRA.values,
+                              df.descDitheredDec.values)
+
+    @classmethod
+    def read(cls, filename, mmap=True):
+        """
+        Read a dither file written by `DitherTable.write`.
+
+        Parameters
+        ----------
+        filename : string
+            path to the dither file
+        mmap : Bool, defaults to `True`
+            if `True`, the arrays are memory mapped read-only rather than
+            read into memory
+        """
+        header = np.fromfile(filename, dtype=_HEADER, count=1)
+        if len(header) == 0 or header['magic'][0] != _MAGIC:
+            raise ValueError('{} is not a dither file'.format(filename))
+        num = int(header['numVisits'][0])
+        expected = _HEADER.itemsize + 24 * num
+        if os.path.getsize(filename) != expected:
+            raise ValueError('dither file {0} has size {1}, expected {2}'.format(
+                filename, os.path.getsize(filename), expected))
+
+        arrays = []
+        for i, dtype in enumerate(('<i8', '<f8', '<f8')):
+            offset = _HEADER.itemsize + 8 * num * i
+            if num == 0:
+                arrays.append(np.zeros(0, dtype=dtype))
+            elif mmap:
+                arrays.append(np.memmap(filename, dtype=dtype, mode='r',
+                                        offset=offset, shape=(num,)))
+            else:
+                arrays.append(np.fromfile(filename, dtype=dtype, count=num,
+                                          offset=offset))
+        # sorting was checked when writing
+        table = cls.__new__(cls)
+        table.obsHistID, table.ditheredRA, table.ditheredDec = arrays
+        return table
+
+    @classmethod
+    def fromFile(cls, filename):
+        """Instantiate the class from a binary dither file, or else from a
+        DESC csv file"""
+        if is_ditherfile(filename):
+            return cls.read(filename)
+        return cls.fromDESCCSV(filename)
+
+    def write(self, filename):
+        """Write the table to the binary dither file `filename`"""
+        header = np.zeros(1, dtype=_HEADER)
+        header['magic'] = _MAGIC
+        header['numVisits'] = len(self)
+        with open(filename, 'wb') as fh:
+            header.tofile(fh)
+            np.asarray(self.obsHistID, dtype='<i8').tofile(fh)
+            np.asarray(self.ditheredRA, dtype='<f8').tofile(fh)
+            np.asarray(self.ditheredDec, dtype='<f8').tofile(fh)
+
+    def toDataFrame(self):
+        """Return a `pd.DataFrame` of the dithers with index `obsHistID`"""
+        return pd.DataFrame(dict(ditheredRA=np.asarray(self.ditheredRA),
+                                 ditheredDec=np.asarray(self.ditheredDec)),
+                            index=pd.Index(np.asarray(self.obsHistID),
+                                           name='obsHistID'),
+                            columns=['ditheredRA', 'ditheredDec'])
+
+    def fingerprint(self):
+        """Return a hash of the contents of the table"""
+        h = hashlib.sha1()
+        for arr in (self.obsHistID, self.ditheredRA, self.ditheredDec):
+            h.update(np.ascontiguousarray(arr).tobytes())
+        return h.hexdigest()
+
+    def positions(self, obsHistID):
+        """
+        Return the positions in the table of the visits `obsHistID`, and a
+        boolean array which is `False` for visits not in the table, whose
+        positions are meaningless.
+        """
+        obsHistID = np.asarray(obsHistID)
+        if len(self) == 0:
+            return (np.zeros(len(obsHistID), dtype=np.intp),
+                    np.zeros(len(obsHistID), dtype=bool))
+        pos = np.searchsorted(self.obsHistID, obsHistID)
+        np.minimum(pos, len(self) - 1, out=pos)
+        found = self.obsHistID[pos] == obsHistID
+        return pos, found
+
+    def join(self, obsHistID):
+        """
+        Return the dithered right ascensions and declinations of the visits
+        `obsHistID`, raising a `ValueError` if the table does not have
+        dithers for all the visits.
+        """
+        pos, found = self.positions(obsHistID)
+        if not found.all():
+            missing = np.asarray(obsHistID)[~found]
+            raise ValueError('dithers missing for {0} of {1} visits, eg. '
+                             'obsHistID {2}'.format(len(missing), len(found),
+                                                    missing[:5].tolist()))
+        return self.ditheredRA[pos], self.ditheredDec[pos]
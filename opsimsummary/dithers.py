@@ -0,0 +1,282 @@
+"""
+Module to generate dithered pointings from the field pointings of OpSim
+visits. Offsets are applied as rotations on the sphere, so that the angular
+distance of a dithered pointing from the field pointing is the requested
+offset at all declinations. Random offsets are obtained from a hash of a
+seed and the visit, night or field and night, so that the dithers of a visit
+do not depend on which other visits are read in with it, and are the same
+when a summary is read in chunks or subsets.
+"""
+from __future__ import division, print_function, absolute_import
+__all__ = ['DitherEngine', 'spherical_offsets', 'hex_pattern',
+           'spiral_pattern']
+import numpy as np
+
+
+def spherical_offsets(ra, dec, radius, angle):
+    """
+    Return the coordinates of points at an angular distance `radius` from
+    (`ra`, `dec`) along the position angle `angle` measured from north
+    through east. All angles are in radians.
+
+    Parameters
+    ----------
+    ra : `np.ndarray` of floats
+        right ascension
+    dec : `np.ndarray` of floats
+        declination
+    radius : `np.ndarray` of floats
+        angular distance of the offset
+    angle : `np.ndarray` of floats
+        position angle of the offset
+
+    Returns
+    -------
+    tuple of `np.ndarray` of ra in [0, 2 pi) and dec, with the broadcast
+    shape of the inputs
+    """
+    ra, dec, radius, angle = np.broadcast_arrays(
+        *(np.asarray(x, dtype=np.float64) for x in (ra, dec, radius, angle)))
+    shape = ra.shape
+    ra, dec, radius, angle = (np.atleast_1d(x) for x in (ra, dec, radius,
+                                                         angle))
+
+    # The operations are done in place to limit temporary arrays
+    sindec, cosdec = np.sin(dec), np.cos(dec)
+    sinr, cosr = np.sin(radius), np.cos(radius)
+    sinr *= cosdec
+
+    # sin(dec2) = sin(dec) cos(r) + cos(dec) sin(r) cos(angle)
+    sindec2 = np.cos(angle)
+    sindec2 *= sinr
+    sindec2 += sindec * cosr
+    np.clip(sindec2, -1., 1., out=sindec2)
+
+    # tan(dra) = sin(angle) sin(r) cos(dec) / (cos(r) - sin(dec) sin(dec2))
+    y = np.sin(angle)
+    y *= sinr
+    sindec *= sindec2
+    cosr -= sindec
+    dra = np.arctan2(y, cosr, out=y)
+    dra += ra
+    np.mod(dra, 2.0 * np.pi, out=dra)
+    return dra.reshape(shape), np.arcsin(sindec2, out=sindec2).reshape(shape)
+
+
+def hex_pattern(numRings=3):
+    """
+    Return the radii and position angles of the vertices of a hexagonal
+    lattice with `numRings` rings around the centre, within a hexagon of
+    unit circumradius, ordered by ring.
+
+    Returns
+    -------
+    tuple of `np.ndarray` of radii in [0, 1] and angles in radians
+    """
+    q, r = np.meshgrid(np.arange(-numRings, numRings + 1),
+                       np.arange(-numRings, numRings + 1))
+    q, r = q.ravel(), r.ravel()
+    ring = np.maximum(np.maximum(np.abs(q), np.abs(r)), np.abs(q + r))
+    keep = ring <= numRings
+    q, r, ring = q[keep], r[keep], ring[keep]
+    x = (q + 0.5 * r) / numRings
+    y = np.sqrt(3.) / 2. * r / numRings
+    radius = np.hypot(x, y)
+    angle = np.mod(np.arctan2(x, y), 2.0 * np.pi)
+    order = np.lexsort((angle, ring))
+    return radius[order], angle[order]
+
+
+def spiral_pattern(numPoints=60):
+    """
+    Return the radii and position angles of `numPoints` points on a Fermat
+    spiral with the golden angle between consecutive points, which cover
+    the unit disc uniformly.
+
+    Returns
+    -------
+    tuple of `np.ndarray` of radii in [0, 1] and angles in radians
+    """
+    k = np.arange(numPoints)
+    radius = np.sqrt((k + 0.5) / numPoints)
+    angle = np.mod(k * np.pi * (3. - np.sqrt(5.)), 2.0 * np.pi)
+    return radius, angle
+
+
+def _splitmix64(x):
+    """vectorized splitmix64 hash of an array of unsigned 64 bit integers"""
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def _as_uint64(values):
+    """view integers or floats as unsigned 64 bit integers"""
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        return np.ascontiguousarray(values, dtype=np.float64).view(np.uint64)
+    return values.astype(np.int64).view(np.uint64)
+
+
+class DitherEngine(object):
+    """
+    Generate dithered pointings with a pattern of offsets applied on a
+    timescale.
+
+    Parameters
+    ----------
+    method : string, defaults to 'RandomPerVisit'
+        name of the pattern {'Random'|'Hex'|'Spiral'} followed by the
+        timescale {'PerVisit'|'PerNight'|'PerFieldPerNight'} on which the
+        offset changes, see `DitherEngine.methods()`. For 'Random', offsets
+        are distributed uniformly over a disc. For 'Hex' and 'Spiral' the
+        offsets are the points of `hex_pattern` and `spiral_pattern` in
+        turn, indexed by the `obsHistID` for 'PerVisit', the night for
+        'PerNight', and the night plus an offset for each field for
+        'PerFieldPerNight'.
+    wfdRadius : float, defaults to 1.75
+        maximal offset in degrees for visits not in DDF proposals, about
+        the radius of the LSST focal plane
+    ddfRadius : float, defaults to 0.2
+        maximal offset in degrees for visits in DDF proposals, about the
+        size of a chip
+    ddfPropIDs : integer or sequence of integers, defaults to ()
+        proposal IDs of the DDF proposals
+    seed : int, defaults to 1
+        seed determining the random offsets
+    numHexRings : int, defaults to 3
+        number of rings of the hexagonal pattern
+    numSpiralPoints : int, defaults to 60
+        number of points of the spiral pattern
+    """
+    patterns = ('Random', 'Hex', 'Spiral')
+    timescales = ('PerVisit', 'PerNight', 'PerFieldPerNight')
+
+    def __init__(self, method='RandomPerVisit', wfdRadius=1.75,
+                 ddfRadius=0.2, ddfPropIDs=(), seed=1, numHexRings=3,
+                 numSpiralPoints=60):
+        if method not in self.methods():
+            raise ValueError('method {0} not in {1}'.format(method,
+                                                            self.methods()))
+        self.method = method
+        self.pattern = list(p for p in self.patterns
+                            if method.startswith(p))[0]
+        self.timescale = method[len(self.pattern):]
+        self.wfdRadius = wfdRadius
+        self.ddfRadius = ddfRadius
+        self.ddfPropIDs = ddfPropIDs
+        self.seed = seed
+        self.numHexRings = numHexRings
+        self.numSpiralPoints = numSpiralPoints
+
+    @classmethod
+    def methods(cls):
+        """names of the methods of dithering"""
+        return list(p + t for p in cls.patterns for t in cls.timescales)
+
+    def _keys(self, obsHistID, night, fieldRA, fieldDec):
+        """Return unsigned 64 bit integers identifying the offset of each
+        visit on the timescale"""
+        with np.errstate(over='ignore'):
+            if self.timescale == 'PerVisit':
+                return _as_uint64(obsHistID)
+            nights = _as_uint64(night)
+            if self.timescale == 'PerNight':
+                return nights
+            fields = _splitmix64(_as_uint64(fieldRA)) ^ \
+                _splitmix64(_as_uint64(fieldDec) + np.uint64(1))
+            return _splitmix64(fields) ^ nights
+
+    def _uniform(self, keys, stream):
+        """Return uniform random numbers in [0, 1) determined by `keys`, the
+        seed and the integer `stream`"""
+        with np.errstate(over='ignore'):
+            state = _splitmix64(np.array([(self.seed * 2 + stream) % 2 ** 64],
+                                         dtype=np.uint64))
+            bits = _splitmix64(_splitmix64(keys) ^ state)
+        return (bits >> np.uint64(11)) * (1.0 / 2 ** 53)
+
+    def offsets(self, obsHistID, night, fieldRA, fieldDec):
+        """
+        Return the offsets of the visits as a fraction of the maximal
+        offset and a position angle in radians.
+
+        Parameters
+        ----------
+        obsHistID : `np.ndarray` of integers
+            visit IDs
+        night : `np.ndarray` of integers
+            nights of the visits
+        fieldRA : `np.ndarray` of floats
+            field right ascensions, used to identify fields
+        fieldDec : `np.ndarray` of floats
+            field declinations, used to identify fields
+        """
+        if self.pattern == 'Random':
+            keys = self._keys(obsHistID, night, fieldRA, fieldDec)
+            # uniform over the area of the disc
+            radius = np.sqrt(self._uniform(keys, 0))
+            angle = 2.0 * np.pi * self._uniform(keys, 1)
+            return radius, angle
+
+        if self.pattern == 'Hex':
+            radii, angles = hex_pattern(self.numHexRings)
+        else:
+            radii, angles = spiral_pattern(self.numSpiralPoints)
+        numPoints = np.uint64(len(radii))
+        if self.timescale == 'PerVisit':
+            idx = _as_uint64(obsHistID) % numPoints
+        elif self.timescale == 'PerNight':
+            idx = _as_uint64(night) % numPoints
+        else:
+            with np.errstate(over='ignore'):
+                keys = self._keys(obsHistID, np.zeros(len(night), np.int64),
+                                  fieldRA, fieldDec)
+                idx = (keys % numPoints + _as_uint64(night) % numPoints) \
+                    % numPoints
+        idx = idx.astype(np.intp)
+        return radii[idx], angles[idx]
+
+    def dither(self, fieldRA, fieldDec, obsHistID, night, propID,
+               angleUnit='radians'):
+        """
+        Return the dithered right ascensions and declinations of visits.
+
+        Parameters
+        ----------
+        fieldRA : `np.ndarray` of floats
+            field right ascensions
+        fieldDec : `np.ndarray` of floats
+            field declinations
+        obsHistID : `np.ndarray` of integers
+            visit IDs
+        night : `np.ndarray` of integers
+            nights of the visits
+        propID : `np.ndarray` of integers
+            proposal IDs of the visits, used to find DDF visits
+        angleUnit : {'radians'|'degrees'}, defaults to 'radians'
+            unit of the field coordinates and of the dithered coordinates
+            returned
+
+        Returns
+        -------
+        tuple of `np.ndarray` of dithered right ascensions and declinations
+        """
+        if angleUnit not in ('degrees', 'radians'):
+            raise ValueError('angleUnit {} not recognized'.format(angleUnit))
+        fieldRA = np.asarray(fieldRA, dtype=np.float64)
+        fieldDec = np.asarray(fieldDec, dtype=np.float64)
+        if angleUnit == 'degrees':
+            fieldRA, fieldDec = np.radians(fieldRA), np.radians(fieldDec)
+        # fields are identified from coordinates in radians, so that the
+        # offsets do not depend on the unit
+        fraction, angle = self.offsets(obsHistID, night, fieldRA, fieldDec)
+        maxRadius = np.where(np.isin(propID, self.ddfPropIDs),
+                             np.radians(self.ddfRadius),
+                             np.radians(self.wfdRadius))
+        ra, dec = spherical_offsets(fieldRA, fieldDec, fraction * maxRadius,
+                                    angle)
+        if angleUnit == 'degrees':
+            return np.degrees(ra), np.degrees(dec)
+        return ra, dec
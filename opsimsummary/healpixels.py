@@ -0,0 +1,261 @@
+"""
+Module with an inverted index of OpSim visits on HEALPix pixels, ie. the
+visits whose field of view covers each pixel. The index is stored as
+compressed sparse row (CSR) arrays, so that the visits of a pixel are a
+slice of an array, in time order.
+"""
+from __future__ import division, print_function, absolute_import
+__all__ = ['HealPixelizedOpSim']
+import time
+import sqlite3
+import numpy as np
+import pandas as pd
+import healpy as hp
+from .opsim_out import OpSimOutput
+from .pixelstats import aggregateVisits, statisticsMaps
+
+
+class HealPixelizedOpSim(object):
+    """
+    Index of the visits of an OpSim output covering each HEALPix pixel.
+
+    Parameters
+    ----------
+    opsimDF : `pd.DataFrame`
+        visits with the index `obsHistID` and at least the columns `raCol`,
+        `decCol` and `timeCol`, eg. `OpSimOutput.summary`
+    raCol : string, defaults to '_ra'
+        column of the ra of the center of the field of view
+    decCol : string, defaults to '_dec'
+        column of the dec of the center of the field of view
+    NSIDE : int, defaults to 256
+        `NSIDE` of the HEALPix pixelization
+    vecColName : string, defaults to `None`
+        not used, accepted for compatibility with earlier versions which
+        stored the unit vectors of the visits in this column
+    fieldRadius : float, degrees, defaults to 1.75
+        radius of the field of view
+    inclusive : Bool, defaults to `True`
+        if `True`, pixels overlapping the field of view, else pixels whose
+        centers are in the field of view, see `healpy.query_disc`
+    nest : Bool, defaults to `True`
+        if `True` use the `nest` ordering of pixels, else `ring`
+    angleUnit : {'radians'|'degrees'}, defaults to 'radians'
+        unit of `raCol` and `decCol`
+    timeCol : string, defaults to 'expMJD'
+        column used to order the visits in time
+
+    Attributes
+    ----------
+    opsimdf : `pd.DataFrame`
+        the visits in `opsimDF` sorted by `timeCol`. The index refers to the
+        rows of `opsimdf`.
+    hids : `np.ndarray` of int
+        sorted ids of the pixels covered by at least one visit
+    indptr : `np.ndarray` of int
+        the visits covering the pixel `hids[i]` are in the rows
+        `rows[indptr[i]:indptr[i+1]]`
+    rows : `np.ndarray` of int
+        row offsets in `opsimdf` of the visits, in time order for each pixel
+
+    .. note:: Visits at the same position, such as repeated visits of a
+        field, share the result of a single `healpy.query_disc`.
+    """
+    def __init__(self, opsimDF, raCol='_ra', decCol='_dec', NSIDE=256,
+                 vecColName=None, fieldRadius=1.75, inclusive=True,
+                 nest=True, angleUnit='radians', timeCol='expMJD'):
+        if angleUnit not in ('radians', 'degrees'):
+            raise ValueError('angleUnit must be radians or degrees, not '
+                             '{}'.format(angleUnit))
+        for col in (raCol, decCol, timeCol):
+            if col not in opsimDF.columns:
+                raise ValueError('column {} not in opsimDF'.format(col))
+
+        self.raCol = raCol
+        self.decCol = decCol
+        self.nside = NSIDE
+        self.fieldRadius = fieldRadius
+        self.inclusive = inclusive
+        self.nest = nest
+        self.angleUnit = angleUnit
+        self.timeCol = timeCol
+
+        order = np.argsort(opsimDF[timeCol].values, kind='stable')
+        self.opsimdf = opsimDF.iloc[order]
+        self.hids, self.indptr, self.rows = self._build()
+
+    @classmethod
+    def fromOpSimDB(cls, opSimDBpath, subset='combined', propIDs=None,
+                    NSIDE=256, raCol='_ra', decCol='_dec', vecColName=None,
+                    fieldRadius=1.75, opsimversion='lsstv3', inclusive=True,
+                    nest=True, **kwargs):
+        """
+        Instantiate from an OpSim database, read with
+        `OpSimOutput.fromOpSimDB`
+
+        Parameters
+        ----------
+        opSimDBpath : string
+            absolute path to the OpSim database
+        subset : string, defaults to 'combined'
+            subset of visits, see `OpSimOutput.fromOpSimDB`
+        propIDs : sequence of integers, defaults to `None`
+            proposal IDs of the visits, which override `subset` if not `None`
+        NSIDE : int, defaults to 256
+            `NSIDE` of the HEALPix pixelization
+        raCol : string, defaults to '_ra'
+            column of the summary with the ra of the visits
+        decCol : string, defaults to '_dec'
+            column of the summary with the dec of the visits
+        vecColName : string, defaults to `None`
+            not used
+        fieldRadius : float, degrees, defaults to 1.75
+            radius of the field of view
+        opsimversion : {'lsstv3'|'sstf'|'lsstv4'}, defaults to 'lsstv3'
+            version of OpSim
+        kwargs :
+            other parameters of `OpSimOutput.fromOpSimDB`
+        """
+        opsout = OpSimOutput.fromOpSimDB(opSimDBpath, subset=subset,
+                                         opsimversion=opsimversion,
+                                         user_propIDs=propIDs, **kwargs)
+        # `_ra` and `_dec` are in radians for all versions
+        if raCol in ('_ra', '_dec'):
+            angleUnit = 'radians'
+        else:
+            angleUnit = opsout.opsimVars['angleUnit']
+        return cls(opsout.summary, raCol=raCol, decCol=decCol, NSIDE=NSIDE,
+                   vecColName=vecColName, fieldRadius=fieldRadius,
+                   inclusive=inclusive, nest=nest, angleUnit=angleUnit)
+
+    def _build(self):
+        """Compute the pixels in the field of view of each visit, and
+        return the CSR arrays `hids`, `indptr`, `rows`"""
+        tstart = time.time()
+        ra = self.opsimdf[self.raCol].values
+        dec = self.opsimdf[self.decCol].values
+        if self.angleUnit == 'radians':
+            ra = np.degrees(ra)
+            dec = np.degrees(dec)
+
+        # pixels of each distinct field center
+        posns, posid = np.unique(np.column_stack((ra, dec)), axis=0,
+                                 return_inverse=True)
+        posid = np.ravel(posid)
+        vecs = hp.ang2vec(posns[:, 0], posns[:, 1], lonlat=True)
+        radius = np.radians(self.fieldRadius)
+        pixels = list(hp.query_disc(self.nside, vec, radius,
+                                    inclusive=self.inclusive, nest=self.nest)
+                      for vec in vecs)
+        lengths = np.fromiter((len(pix) for pix in pixels), dtype=np.int64,
+                              count=len(pixels))
+        pixels = np.concatenate(pixels + [np.zeros(0, dtype=np.int64)])
+        posptr = np.concatenate(([0], np.cumsum(lengths)))
+
+        # (pixel, row) pairs of all visits, in row order
+        numpix = lengths[posid]
+        rows = np.repeat(np.arange(len(posid), dtype=np.int64), numpix)
+        starts = np.repeat(posptr[:-1][posid] - np.cumsum(numpix) + numpix,
+                           numpix)
+        pairpix = pixels[starts + np.arange(len(rows))]
+
+        # a stable sort by pixel keeps rows, and thus time, ordered
+        order = np.argsort(pairpix, kind='stable')
+        pairpix = pairpix[order]
+        rows = rows[order]
+        hids, counts = np.unique(pairpix, return_counts=True)
+        indptr = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        print('indexed {0} visits on {1} pixels in {2:.1f} s'.format(
+            len(rows), len(hids), time.time() - tstart))
+        return hids, indptr, rows
+
+    def _slice(self, tileID):
+        """Return the slice of `rows` for the pixel `tileID`"""
+        i = np.searchsorted(self.hids, tileID)
+        if i == len(self.hids) or self.hids[i] != tileID:
+            return slice(0, 0)
+        return slice(self.indptr[i], self.indptr[i + 1])
+
+    def rowsForTile(self, tileID):
+        """Return the row offsets in `opsimdf` of the visits covering the
+        pixel `tileID` in time order"""
+        return self.rows[self._slice(tileID)]
+
+    def obsHistIdsForTile(self, tileID):
+        """Return the `obsHistID` of the visits covering the pixel `tileID`
+        in time order"""
+        return self.opsimdf.index.values[self.rowsForTile(tileID)]
+
+    def visitsForTile(self, tileID):
+        """Return a `pd.DataFrame` of the visits covering the pixel
+        `tileID` in time order"""
+        return self.opsimdf.iloc[self.rowsForTile(tileID)]
+
+    @property
+    def numVisits(self):
+        """`pd.Series` of the number of visits covering each pixel, indexed
+        by the pixel id `hid`"""
+        return pd.Series(np.diff(self.indptr), index=pd.Index(self.hids,
+                                                              name='hid'),
+                         name='numVisits')
+
+    def statistics(self, reducers=None, maps=False, filterCol='filter'):
+        """
+        Return statistics of the visits covering each pixel in each filter,
+        see `aggregateVisits` in `opsimsummary.pixelstats`.
+
+        Parameters
+        ----------
+        reducers : dict, defaults to `None`
+            statistics computed, if `None` those of `defaultReducers`
+        maps : Bool, defaults to `False`
+            if `True`, return dense healpix maps of each statistic in each
+            filter instead of a table, see `statisticsMaps`
+        filterCol : string, defaults to 'filter'
+            column of the filter of the visits
+        """
+        stats = aggregateVisits(self.opsimdf, self.hids, self.indptr,
+                                self.rows, reducers=reducers,
+                                filterCol=filterCol)
+        if maps:
+            return statisticsMaps(stats, self.nside)
+        return stats
+
+    def writeToDB(self, dbName, verbose=False, indexed=True,
+                  chunkSize=1000000):
+        """
+        Write the pixel ids and `obsHistID` of the visits covering them to
+        the table `simlib` with the columns `ipix` and `obsHistId` of the
+        sqlite database `dbName`, in order of pixel and time.
+
+        Parameters
+        ----------
+        dbName : string
+            absolute path to the database
+        verbose : Bool, defaults to `False`
+            if `True`, print progress
+        indexed : Bool, defaults to `True`
+            if `True`, create an index on `ipix`
+        chunkSize : int, defaults to 1000000
+            number of rows inserted together
+        """
+        ipix = np.repeat(self.hids, np.diff(self.indptr))
+        obsHistIds = self.opsimdf.index.values[self.rows]
+        con = sqlite3.connect(dbName)
+        try:
+            con.execute('CREATE TABLE simlib (ipix int, obsHistId int)')
+            for start in range(0, len(ipix), chunkSize):
+                stop = start + chunkSize
+                con.executemany('INSERT INTO simlib VALUES (?, ?)',
+                                zip(ipix[start:stop].tolist(),
+                                    obsHistIds[start:stop].tolist()))
+                if verbose:
+                    print('inserted {0} of {1} rows'.format(
+                        min(stop, len(ipix)), len(ipix)))
+            if indexed:
+                con.execute('CREATE INDEX ipix_ind ON simlib (ipix)')
+                if verbose:
+                    print('created index on ipix')
+            con.commit()
+        finally:
+            con.close()
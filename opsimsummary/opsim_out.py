@@ -10,12 +10,37 @@ In brief, we will use two tables from the OpSim output:
 """
 from __future__ import division, print_function, unicode_literals
 __all__ = ['OpSimOutput']
-import sys
-import traceback
+import os
+import json
+import functools
+import sqlite3
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import numpy as np
 import pandas as pd
 from sqlalchemy import create_engine
 import collections
+from .cache import SummaryCache
+from .columnar import write_columnar, read_columnar
+from .validation import PointingValidator
+from .dithers import DitherEngine
+from .ditherfile import DitherTable
+from .dbindex import indexed_dbname, summary_indexes, _fetchall
+from .decompress import DecompressionCache, compression_format
+from .pipeline import (NormalizationPipeline, FilterNull, RenameColumns,
+                       DropDuplicateVisits, SetIndex, JoinColumns, JoinDithers,
+                       ComputeColumns, ZeroDDFDithers, RadianCoordinates,
+                       propID_priority, unique_visit_rows)
+
+try:
+    from urllib.request import pathname2url
+except ImportError:
+    from urllib import pathname2url
+
+try:
+    from collections.abc import Iterable
+except ImportError:
+    from collections import Iterable
 
 
 class OpSimOutput(object):
@@ -46,10 +71,33 @@ class OpSimOutput(object):
         opsimversion='lsstv3'. For opsimversion='sstf' or 'lsstv4', this
         will be set to False despite inputs, since this is already done, and
         cannot be done with the inputs.
+    memorySaved : int
+        number of bytes saved by using `dtype_profile='compact'`, 0 otherwise
     """
+    # Columns stored in smaller types with `dtype_profile='compact'`. The
+    # seeing, sky brightness and depth used for simlibs (`FWHMeff`,
+    # `finSeeing`, `filtSkyBrightness`, `fiveSigmaDepth`) are kept as 64 bit
+    # floats, since rounding the derived simlib quantities changes otherwise.
+    compactIntColumns = ('obsHistID', 'night', 'propID')
+    compactFloatColumns = ('FWHMgeom', 'rawSeeing', 'seeingFwhm500',
+                           'seeingFwhmGeom', 'vSkyBright', 'darkBright',
+                           'moonBright')
+    # Fraction of the rows of the summary table above which the subsets are
+    # read by scanning the table rather than using an index on the proposal
+    # ID, see `_useTableScan`
+    maxIndexedFraction = 0.3
+
+    # callable returning an `OpSimOutput` with the summary for lazy
+    # instances, see `fromOpSimDB(lazy=True)`
+    _summaryLoader = None
+    # database and sql query of statistics of lazy instances
+    _statsSource = None
+    _filterStats = None
+
     def __init__(self, summary, propIDDict=None, proposalTable=None,
                  subset=None, propIDs=None, zeroDDFDithers=True,
-                 opsimversion='lsstv3'):
+                 opsimversion='lsstv3', dtype_profile=None,
+                 validation='fast'):
         """
         Constructor for the `OpSimOutput` class
 
@@ -90,6 +138,23 @@ class OpSimOutput(object):
             Strategy Task Force available at the following
              [website](http://altsched.rothchild.me:8080),
             and `lsstv4` refers to outputs available from  OpSim version 4.
+        dtype_profile: {None|'compact'}, defaults to `None`
+            if 'compact', `obsHistID`, `night` and `propID` are stored as
+            32 bit integers, seeing and sky brightness columns not used for
+            simlibs as 32 bit floats, and `filter` as a categorical with `y`
+            replaced by `Y` as in SNANA, while `expMJD`, angles and the
+            columns used for simlibs are kept as 64 bit floats, so that
+            simlibs are unchanged. If `None`, the types are those from the
+            database.
+        validation: {'off'|'fast'|'full'}, defaults to 'fast'
+            level of validation of the pointings, see
+            `PointingValidator`. A failure raises `ValidationError`, and
+            the time taken by each check is recorded in the attribute
+            `validationTimings`.
+
+        The time taken by each stage of normalizing the summary (see
+        `OpSimOutput.normalizationPipeline`) is recorded in the attribute
+        `normalizationTimings`.
         """
         self.opsimversion = opsimversion
         self.allowed_subsets = self.get_allowed_subsets()
@@ -102,49 +167,165 @@ class OpSimOutput(object):
             ss = 'Warning: Input is zeroDDFDithers = True. But opsimversion is'
             ss += '{} for which this must be False. Setting to False and proceeding\n'.format(opsimversion)
             print(ss)
+        self.zeroDDFDithers = zeroDDFDithers
 
-        # Check `summary` does not have `nan`s
-        if not self.validate_pointings(summary, opsimVars=None):
-            print('summary table has nans, exiting\n')
-            sys.exit(1)
-
-        if zeroDDFDithers:
-            ddfPropID = self.propIDDict['ddf']
-            ddfidx = summary.query('propID == @ddfPropID').index
-            summary.loc[ddfidx, 'ditheredRA'] = summary.loc[ddfidx, 'fieldRA']
-            summary.loc[ddfidx, 'ditheredDec'] = summary.loc[ddfidx, 'fieldDec']
         self._opsimvars = None
 
         # Have a clear unambiguous ra, dec in radians following LSST convention
         # These are the columns `_ra`, `_dec` which should have the dithered
-        # values in radians
-
-        # If degrees do transformation to radians
+        # values in radians, after setting dithers in DDF to zero if required
+        stages = []
+        if zeroDDFDithers:
+            stages.append(ZeroDDFDithers(self.propIDDict['ddf']))
+        stages.append(RadianCoordinates(self.opsimVars['angleUnit']))
         if self.opsimVars['angleUnit'] == 'degrees':
-            summary.loc[:, '_ra'] = np.radians(summary['ditheredRA'])
-            summary.loc[:, '_dec'] = np.radians(summary['ditheredDec'])
             print('Changing units for {0} from {1}'.format(opsimversion, 'degrees'))
-
-        # If already in radians, make a copy
-        elif self.opsimVars['angleUnit'] == 'radians':
-            print('Keeping units for {0} from {1}'.format(opsimversion, 'radians'))
-            summary.loc[:, '_ra'] = summary['ditheredRA']
-            summary.loc[:, '_dec'] = summary['ditheredDec']
-
         else:
-            raise ValueError('angle unit of ra and dec Columns not recognized\n')
-
+            print('Keeping units for {0} from {1}'.format(opsimversion, 'radians'))
+        pipeline = NormalizationPipeline(stages)
+        pipeline.run(summary, inplace=True)
+        self.normalizationTimings = pipeline.timings
 
         # Validate the format of the pointings to expectations given the version
         # of the OpSim output
-        if self.validate_pointings(summary, self.opsimVars):
-            self.summary = summary
-        else:
-            raise AssertionError('Pointings are not in required format')
+        validator = PointingValidator(validation)
+        self.validationTimings = validator.validate(summary, checkAngles=True)
+        self.summary = summary
+
+        self.memorySaved = 0
+        if dtype_profile == 'compact':
+            self.summary, self.memorySaved = self.compact_summary(summary)
+            print('compact dtypes reduced memory used by summary by {:.1f} MB'
+                  .format(self.memorySaved / 1.0e6))
+        elif dtype_profile is not None:
+            raise ValueError('dtype_profile {} not recognized'
+                             .format(dtype_profile))
 
         # Set the attribute `_propID`
         self._propID = propIDs
 
+    @property
+    def summary(self):
+        """
+        `pd.DataFrame` of the visits, with index `obsHistID`. For instances
+        from `fromOpSimDB(lazy=True)` this is read from the database on
+        first access.
+        """
+        if self._summaryLoader is not None:
+            loader = self._summaryLoader
+            self._summaryLoader = None
+            loaded = loader()
+            for name, val in loaded.__dict__.items():
+                if name not in ('proposalTable', 'propIDDict'):
+                    setattr(self, name, val)
+        return self._summary
+
+    @summary.setter
+    def summary(self, value):
+        self._summary = value
+
+    @property
+    def isLoaded(self):
+        """`False` if the summary of a lazy instance has not been read"""
+        return self._summaryLoader is None
+
+    @property
+    def filterStatistics(self):
+        """
+        `pd.DataFrame` indexed by filter with the number of visits
+        `numVisits` and the first and last MJD `minMJD`, `maxMJD` of visits
+        in each filter. If the summary has not been read, this is obtained
+        from an aggregate sql query on the database, unless visits are
+        selected by position, in which case the summary is read.
+        """
+        if self.isLoaded or self._statsSource is None:
+            grouped = self.summary.groupby('filter', observed=True).expMJD
+            stats = pd.DataFrame(dict(numVisits=grouped.size(),
+                                      minMJD=grouped.min(),
+                                      maxMJD=grouped.max()),
+                                 columns=['numVisits', 'minMJD', 'maxMJD'])
+            stats.index = stats.index.astype(object)
+            return stats
+        if self._filterStats is None:
+            dbname, backend, sql_query = self._statsSource
+            engine = self._get_connection(dbname, backend=backend)
+            stats = pd.read_sql_query(sql_query, con=engine)
+            self._filterStats = stats.set_index('filter')
+        return self._filterStats
+
+    @property
+    def filterCounts(self):
+        """`pd.Series` of the number of visits in each filter"""
+        return self.filterStatistics.numVisits
+
+    @property
+    def numVisits(self):
+        """number of visits in the summary"""
+        return int(self.filterStatistics.numVisits.sum())
+
+    @property
+    def mjdRange(self):
+        """tuple of the first and last MJD of visits in the summary"""
+        stats = self.filterStatistics
+        return stats.minMJD.min(), stats.maxMJD.max()
+
+    @staticmethod
+    def compact_summary(summary):
+        """
+        Return a copy of `summary` where the columns in
+        `OpSimOutput.compactIntColumns` (and the index if it is `obsHistID`)
+        are 32 bit integers, the columns in `OpSimOutput.compactFloatColumns`
+        are 32 bit floats and `filter` is a categorical with the SNANA `Y`
+        filter name. Integer columns whose values do not fit in 32 bits are
+        left unchanged.
+
+        Parameters
+        ----------
+        summary : `pd.DataFrame`
+            summary table of pointings
+
+        Returns
+        -------
+        tuple of `pd.DataFrame` and the number of bytes saved
+        """
+        before = summary.memory_usage(deep=True).sum()
+        info32 = np.iinfo(np.int32)
+
+        def fits32(values):
+            return len(values) == 0 or (values.min() >= info32.min and
+                                        values.max() <= info32.max)
+
+        newcols = dict()
+        for col in summary.columns:
+            values = summary[col].values
+            if col in OpSimOutput.compactIntColumns and \
+                    values.dtype.kind in 'iu' and fits32(values):
+                newcols[col] = values.astype(np.int32)
+            elif col in OpSimOutput.compactFloatColumns and \
+                    values.dtype.kind == 'f':
+                newcols[col] = values.astype(np.float32)
+            elif col == 'filter' and \
+                    not isinstance(summary[col].dtype, pd.CategoricalDtype):
+                # SNANA denotes the y filter by Y
+                cats = pd.Categorical(values)
+                newcats = list('Y' if 'y' in cat else cat
+                               for cat in cats.categories)
+                if len(set(newcats)) == len(newcats):
+                    cats = cats.rename_categories(newcats)
+                else:
+                    cats = pd.Categorical(list('Y' if 'y' in val else val
+                                               for val in values))
+                newcols[col] = cats
+        df = summary.assign(**newcols)
+
+        index = df.index
+        if index.name in OpSimOutput.compactIntColumns and \
+                index.dtype.kind in 'iu' and fits32(index.values):
+            df.index = pd.Index(index.values.astype(np.int32), name=index.name)
+
+        after = df.memory_usage(deep=True).sum()
+        return df, int(before - after)
+
     @staticmethod
     def get_opsimVariablesForVersion(opsimversion='lsstv3'):
         """Static method to returns a dictionary for the opsim version where the keys
@@ -253,33 +434,12 @@ class OpSimOutput(object):
 
         Returns
         -------
-        Bool (True|False) But exits on False.
+        Bool True, but raises `ValidationError` if a check fails.
         """
-        try:
-            if opsimVars is not None:
-                assert '_ra' in summary.columns
-                assert '_dec' in summary.columns
-
-                assert np.fabs(summary['_ra'].max()) <= 2.0 * np.pi
-                assert np.fabs(summary['_dec'].min()) >= -1.0 * np.pi
-
-            if check_anycols:
-                assert summary.isnull().values.any() == False
-            else:
-                # We only check the fiveSigmaDepth column
-                assert 'fiveSigmaDepth' in summary.columns.values
-
-                assert all(summary['fiveSigmaDepth'].isnull().values == False)
-        except AssertionError:
-            _, _, tb = sys.exc_info()
-            traceback.print_tb(tb) # Fixed format
-            tb_info = traceback.extract_tb(tb)
-            filename, line, func, text = tb_info[-1]
-
-            print ('pointings are not in required format')
-            print(summary.head()) 
-            print('An error occurred on line {} in statement {}'.format(line, text))
-            sys.exit(1)
+        level = 'full' if check_anycols else 'fast'
+        PointingValidator(level).validate(summary,
+                                          checkAngles=opsimVars is not None,
+                                          checkDepth=not check_anycols)
         return True
 
 
@@ -290,7 +450,8 @@ class OpSimOutput(object):
                           ddfId=5,
                           rng=np.random.RandomState(1),
                           wfd_ditherscale=1.75,
-                          ddf_ditherscale=0.2):
+                          ddf_ditherscale=0.2,
+                          seed=1):
         """
         Use a `method` prescription to obtain dithered values of pointings
         starting from a fixed pointing.
@@ -298,66 +459,105 @@ class OpSimOutput(object):
         Parameters
         ----------
         summary : `pd.DataFrame`
-           indexed by `obsHistID` and having the columns `fieldRA`, `fieldDec`
+           indexed by `obsHistID` and having the columns `fieldRA`,
+           `fieldDec`, `propID`, and `night` for methods of `DitherEngine`
         opsimversion : string, defaults to `lsstv3`
            version of the OpSim producing the database.
         method : string
-           {'default|FlatSky'} only implemented
+           'default' uses the field pointings, 'FlatSky' random offsets in a
+           flat sky approximation, and any of `DitherEngine.methods()`
+           random or patterned offsets on the sphere.
+        ddfId : integer or sequence of integers
+           proposal IDs of DDF proposals
         rng : randomState
-        kwargs : 
+           random state used by the 'FlatSky' method
+        wfd_ditherscale : float, defaults to 1.75
+           offset in degrees of all visits for 'FlatSky', and maximal offset
+           of visits not in DDF proposals for methods of `DitherEngine`
+        ddf_ditherscale : float, defaults to 0.2
+           maximal offset in degrees of visits in DDF proposals for methods
+           of `DitherEngine`, not used by 'FlatSky'
+        seed : int, defaults to 1
+           seed for the random offsets of methods of `DitherEngine`
         """
-        # start off with a fieldRA, fieldDec, propID
-        df = summary[['fieldRA', 'fieldDec', 'propID']]
-
-
         OpSimVars = OpSimOutput.get_opsimVariablesForVersion(opsimversion)
         angleUnit = OpSimVars['angleUnit']
 
+        if method in DitherEngine.methods():
+            engine = DitherEngine(method, wfdRadius=wfd_ditherscale,
+                                  ddfRadius=ddf_ditherscale, ddfPropIDs=ddfId,
+                                  seed=seed)
+            ra, dec = engine.dither(summary['fieldRA'].values,
+                                    summary['fieldDec'].values,
+                                    obsHistID=summary.index.values,
+                                    night=summary['night'].values,
+                                    propID=summary['propID'].values,
+                                    angleUnit=angleUnit)
+            return pd.DataFrame(dict(ditheredRA=ra, ditheredDec=dec),
+                                index=summary.index,
+                                columns=['ditheredRA', 'ditheredDec'])
+
+        # start off with a fieldRA, fieldDec, propID
+        df = summary[['fieldRA', 'fieldDec', 'propID']]
+
         if method == 'default':
            # Simply write the fieldRA to ditheredRA
-           df.rename(columns=dict(fieldRA='ditheredRA',
-                                  fieldDec='ditheredDec'),
-                     inplace=True)
+           df = df.rename(columns=dict(fieldRA='ditheredRA',
+                                       fieldDec='ditheredDec'))
 
         elif method == 'FlatSky':
-            # Choose chip size, random directional DDF dithers 
-            # Choose focal plane radius size, random directional dithers elsewhere
-            # Very roughly these scales are 1.75 deg, and 0.2 deg
-
-            df.loc[:, 'factor'] = wfd_ditherscale
-            df.query('propID == @ddfId').loc[:, 'factor'] = ddf_ditherscale
+            # Random directional dithers of `wfd_ditherscale` for all
+            # visits, methods of `DitherEngine` use `ddf_ditherscale` in DDF
+            factor = np.full(len(df), wfd_ditherscale, dtype=np.float64)
 
             if angleUnit == 'degrees':
                 pass
             elif angleUnit == 'radians':
-                df.loc[:, 'factor'] = df.factor.apply(np.radians)
+                factor = np.radians(factor)
             else:
                 raise NotImplementedError("Don't recognize angleUnit")
 
             # Random directions
-            df.loc[:, 'random_angs'] = rng.uniform(high=2.0*np.pi,
-                                                   size=len(df))
+            random_angs = rng.uniform(high=2.0*np.pi, size=len(df))
 
             # Use the flat sky approximation
-            df.loc[:, 'ditheredRA'] = df['fieldRA'] + \
-                df['factor'] * np.cos(df['random_angs'])
-            df.loc[:, 'ditheredDec'] = df['fieldDec'] + \
-                df['factor'] * np.sin(df['random_angs'])
+            df = pd.DataFrame(dict(ditheredRA=df['fieldRA'].values +
+                                   factor * np.cos(random_angs),
+                                   ditheredDec=df['fieldDec'].values +
+                                   factor * np.sin(random_angs)),
+                              index=df.index,
+                              columns=['ditheredRA', 'ditheredDec'])
         else:
             raise NotImplementedError('method {} has not been implemented yet\n'.format(method))
 
+        ditheredRA = df['ditheredRA'].values.copy()
         if angleUnit == 'degrees':
-            assert all(df.ditheredRA.values < 370.0)
+            assert all(ditheredRA < 370.0)
             maxval = 360.
         elif angleUnit == 'radians':
             maxval  = 2.0 * np.pi
-            assert all(df.ditheredRA.values < maxval + 0.2)
+            assert all(ditheredRA < maxval + 0.2)
 
-        mask = df.ditheredRA.values > maxval
-        df.ditheredRA[mask] = df.ditheredRA[mask] - maxval
+        mask = ditheredRA > maxval
+        ditheredRA[mask] = ditheredRA[mask] - maxval
+        df = df.assign(ditheredRA=ditheredRA)
 
         return df[['ditheredRA', 'ditheredDec']]
 
+    @staticmethod
+    def _addsDithers(columns, add_dithers, dithercolumns=None,
+                     replace_dithers=False):
+        """Return `True` if the dithers of the summary are added by
+        `normalizationPipeline` rather than read from the summary table with
+        the columns `columns`. Dithers are added if the table has none, and
+        dithers created by `get_dithercolumns` (if `dithercolumns` is `None`)
+        only replace those of the table if `replace_dithers`."""
+        if 'ditheredra' not in list(x.lower() for x in columns):
+            return True
+        if add_dithers and dithercolumns is None and not replace_dithers:
+            return False
+        return add_dithers
+
     @classmethod
     def fromOpSimDB(cls, dbname,
                     subset='combined',
@@ -368,6 +568,20 @@ class OpSimOutput(object):
                     add_dithers=False,
                     tableNames=('Summary', 'Proposal'),
                     filterNull=False,
+                    columns=None,
+                    backend='sqlalchemy',
+                    cache_dir=None,
+                    dtype_profile=None,
+                    validation='fast',
+                    lazy=False,
+                    mjd_range=None,
+                    night_range=None,
+                    filters=None,
+                    ra_range=None,
+                    dec_range=None,
+                    where=None,
+                    read_workers=1,
+                    read_pool='process',
                     **kwargs):
         """
         Convenience method to instantitate the `OpSimOutput` class directly
@@ -378,7 +592,8 @@ class OpSimOutput(object):
         Parameters
         ----------
         dbname : string
-            absolute path to database
+            absolute path to database, which may be compressed with gzip,
+            xz or bz2, see `DecompressionCache`
         subset : string, optional, defaults to 'combined'
             one of {'_all', 'unique_all', 'wfd', 'ddf', 'combined'}
             determines a sequence of propIDs for selecting observations
@@ -388,14 +603,19 @@ class OpSimOutput(object):
         zeroDDFDithers : bool, defaults to True
             if True, set dithers in DDF to 0, by setting ditheredRA,
             ditheredDec to fieldRA, fieldDec
-        dithercolumns: `pd.DataFrame`, defaults to `None`
+        dithercolumns: `pd.DataFrame`, `DitherTable` or string, defaults to `None`
             a pandas dataframe with the columns `ditheredRA`, `ditheredDec` and
             index `obsHistID`, when not `None` this is used to create
             `opsimVars[pointingRA]` and `opsimVars[pointingDec]` deleting the
-            these columns if they existed.
+            these columns if they existed. A `DitherTable`, or the path to
+            a binary dither file or DESC csv file of dithers read with
+            `DitherTable.fromFile`, is joined with `np.searchsorted` and
+            must have dithers for every visit.
         add_dithers : Bool, defaults to `False`
             if `True` add dithers by generate ourselves by invoking
-            `cls.get_dithers` and options through `**kwargs`.
+            `cls.get_dithercolumns` and options through `**kwargs`. Dithered
+            columns in the database are kept unless the option
+            `replace_dithers` is `True`.
             Even if `False`, becomes `True` if `opsimVars['pointingRA']
             is not in the list of `summary[columns]` so that it needs to be
             created, and dithercolumns is `None`.
@@ -406,13 +626,138 @@ class OpSimOutput(object):
         filterNull : Bool, defaults to False
             if True, the summary table should be filtered to rows that do not
             contain `NULL` values in the `fiveSigmaDepth` column.
+        columns : sequence of strings, defaults to `None`
+            if not `None`, names of the columns of the summary table (as used
+            in `OpSimSummary`, eg. `expMJD`, `FWHMeff`, `_ra`) which are
+            required. Only these columns, and the columns needed to drop
+            duplicates, add dithers and validate the pointings are read from
+            the database. If `None`, all the columns are read.
+        backend : {'sqlalchemy'|'sqlite3'}, defaults to 'sqlalchemy'
+            library used to read the database. 'sqlite3' opens the database
+            read-only using the standard library and reads the summary table
+            directly into arrays, which is faster and uses less memory.
+        cache_dir : string, defaults to `None`
+            if not `None`, absolute path to a directory used to cache the
+            normalized summary table. If an entry for the same database
+            file (path, size and modification time) and options exists, the
+            summary is read from the cache, otherwise it is written to the
+            cache after reading the database.
+        dtype_profile : {None|'compact'}, defaults to `None`
+            if 'compact', store the summary in smaller types, see the class
+            constructor.
+        validation : {'off'|'fast'|'full'}, defaults to 'fast'
+            level of validation of the summary table, see the class
+            constructor.
+        lazy : Bool, defaults to `False`
+            if `True`, only read the proposal table, and read the summary
+            table when the attribute `summary` is first used. The
+            properties `numVisits`, `mjdRange`, `filterCounts` and
+            `filterStatistics` are obtained from aggregate sql queries
+            until then.
+        mjd_range : tuple of two floats, defaults to `None`
+            if not `None`, only read visits between these MJDs, inclusive
+        night_range : tuple of two integers, defaults to `None`
+            if not `None`, only read visits between these nights, inclusive
+        filters : sequence of strings, defaults to `None`
+            if not `None`, only read visits in these filters, eg. ['g', 'r']
+        ra_range : tuple of two floats, defaults to `None`
+            if not `None`, only read visits whose pointings have right
+            ascensions in this range in degrees. If the lower value is
+            larger than the upper value, the range wraps around 360
+            degrees, eg. (350., 10.)
+        dec_range : tuple of two floats, defaults to `None`
+            if not `None`, only read visits whose pointings have
+            declinations in this range in degrees
+        where : string, defaults to `None`
+            if not `None`, an sql condition on the columns of the summary
+            table in the database, eg. 'moonAlt < 0', which visits read
+            must satisfy. It is applied to each row before visits shared
+            between proposals are deduplicated, so should only use columns
+            which are the same for all rows of a visit.
+        read_workers : int, defaults to 1
+            if larger than 1, the summary table is split into this number
+            of ranges of rows, read concurrently on separate read-only
+            `sqlite3` connections whatever the `backend`, and duplicate rows
+            of shared visits are dropped after reading.
+        read_pool : {'process'|'thread'}, defaults to 'process'
+            kind of pool used to read ranges of rows if `read_workers > 1`.
+            Only processes decode rows in parallel.
         kwargs: dict
             of options relating to changing the methods of adding dithers.
             keywords are rng of type `np.random.RandomState`, `ddf_ditherscale`,
-            `wfd_ditherscale`, `method`. If not provided, the parameters take
-            default values.
-
+            `wfd_ditherscale`, `method`, `seed`, `replace_dithers`. If not
+            provided, the parameters take default values. `method` may be
+            'default', 'FlatSky' or any of `DitherEngine.methods()`, eg.
+            'RandomPerFieldPerNight' or 'HexPerNight', which dither on the
+            sphere reproducibly for a given `seed`. If `replace_dithers` is
+            `True`, dithers created replace those in the database.
+
+        .. note:: The selections `mjd_range`, `night_range`, `filters`,
+            `ra_range`, `dec_range` and `where` are applied in the sql query,
+            so that only the visits selected are read from the database.
+            Visits selected by position are those whose pointings `_ra`,
+            `_dec` in the summary are in the ranges. These are selected in
+            the sql query from the positions in the database, and again
+            after adding dithers and setting dithers in DDF to zero.
         """
+        if isinstance(dithercolumns, str):
+            dithercolumns = DitherTable.fromFile(dithercolumns)
+
+        if lazy:
+            loader = functools.partial(cls.fromOpSimDB, dbname,
+                                       subset=subset,
+                                       opsimversion=opsimversion,
+                                       zeroDDFDithers=zeroDDFDithers,
+                                       user_propIDs=user_propIDs,
+                                       dithercolumns=dithercolumns,
+                                       add_dithers=add_dithers,
+                                       filterNull=filterNull,
+                                       columns=columns, backend=backend,
+                                       cache_dir=cache_dir,
+                                       dtype_profile=dtype_profile,
+                                       validation=validation,
+                                       mjd_range=mjd_range,
+                                       night_range=night_range,
+                                       filters=filters, ra_range=ra_range,
+                                       dec_range=dec_range, where=where,
+                                       read_workers=read_workers,
+                                       read_pool=read_pool, **kwargs)
+            # statistics of visits selected by position require the summary
+            predicates = cls._summary_predicates(
+                cls.get_opsimVariablesForVersion(opsimversion),
+                mjd_range=mjd_range, night_range=night_range, filters=filters,
+                where=where)
+            return cls._lazyFromOpSimDB(dbname, loader, subset=subset,
+                                        opsimversion=opsimversion,
+                                        zeroDDFDithers=zeroDDFDithers,
+                                        user_propIDs=user_propIDs,
+                                        filterNull=filterNull,
+                                        backend=backend,
+                                        predicates=predicates,
+                                        sqlStats=ra_range is None and
+                                        dec_range is None)
+
+        if cache_dir is not None:
+            return cls._fromSummaryCache(cache_dir, dbname,
+                                         subset=subset,
+                                         opsimversion=opsimversion,
+                                         zeroDDFDithers=zeroDDFDithers,
+                                         user_propIDs=user_propIDs,
+                                         dithercolumns=dithercolumns,
+                                         add_dithers=add_dithers,
+                                         filterNull=filterNull,
+                                         columns=columns,
+                                         backend=backend,
+                                         dtype_profile=dtype_profile,
+                                         validation=validation,
+                                         mjd_range=mjd_range,
+                                         night_range=night_range,
+                                         filters=filters, ra_range=ra_range,
+                                         dec_range=dec_range, where=where,
+                                         read_workers=read_workers,
+                                         read_pool=read_pool,
+                                         **kwargs)
+
         # Because this is in the class method, I am using the staticmethod
         # rather than the property, but note that the property is calculated
         # through this method. So this gives the same thing
@@ -429,178 +774,903 @@ class OpSimOutput(object):
             raise NotImplementedError('subset {} not implemented'.\
                                       format(subset))
 
-        engine = cls._get_sql_engine(dbname)
+        engine = cls._get_connection(dbname, backend=backend)
 
         propDict, propIDs, proposals = cls._get_propIDs(tableNames, engine,
                                                         opsimversion,
                                                         subset,
                                                         user_propIDs=user_propIDs)
-        summary = cls._read_summary_table_raw(engine, opsimVars, propIDs, subset)
+        tableColumns = cls._get_table_columns(engine,
+                                              opsimVars['summaryTableName'])
+        add_dithers = cls._addsDithers(tableColumns, add_dithers,
+                                       dithercolumns=dithercolumns,
+                                       replace_dithers=kwargs.get(
+                                           'replace_dithers', False))
+        if columns is not None:
+            columns = cls.get_summaryColumns(columns, opsimVars, tableColumns,
+                                             add_dithers=add_dithers,
+                                             ditherMethod=kwargs.get('method',
+                                                                     'default'))
+        positionColumns = cls._position_columns(
+            opsimVars, tableColumns,
+            zeroDDFDithers=zeroDDFDithers and opsimversion == 'lsstv3',
+            add_dithers=add_dithers, dithercolumns=dithercolumns,
+            ditherMethod=kwargs.get('method', 'default'))
+        predicates = cls._summary_predicates(opsimVars, mjd_range=mjd_range,
+                                             night_range=night_range,
+                                             filters=filters,
+                                             ra_range=ra_range,
+                                             dec_range=dec_range, where=where,
+                                             positionColumns=positionColumns)
+        # Drop duplicate rows of shared visits in the query if possible
+        dedup = cls._dedupInSQL(subset, opsimversion)
+        if read_workers > 1:
+            # rows of a visit may be in different ranges of rows
+            dedup = False
+            summary = cls._read_summary_partitioned(dbname, opsimVars, propIDs,
+                                                    subset, columns=columns,
+                                                    predicates=predicates,
+                                                    read_workers=read_workers,
+                                                    read_pool=read_pool)
+        else:
+            summary = cls._read_summary_table_raw(engine, opsimVars, propIDs,
+                                                  subset, columns=columns,
+                                                  dedupPropIDDict=propDict
+                                                  if dedup else None,
+                                                  predicates=predicates)
 
         if len(summary) == 0:
             return cls(propIDDict=propDict,
                        summary=summary,
                        zeroDDFDithers=zeroDDFDithers,
                        proposalTable=proposals, subset=subset,
-                       opsimversion=opsimversion)
+                       opsimversion=opsimversion, validation=validation)
+
+        timings = collections.OrderedDict()
+        summary = cls._normalize_summary(summary, propDict, opsimversion,
+                                         subset, filterNull=filterNull,
+                                         dithercolumns=dithercolumns,
+                                         add_dithers=add_dithers,
+                                         deduplicated=dedup, timings=timings,
+                                         **kwargs)
+
+        opsout = cls(propIDDict=propDict,
+                     summary=summary,
+                     zeroDDFDithers=zeroDDFDithers,
+                     proposalTable=proposals, subset=subset,
+                     opsimversion=opsimversion,
+                     dtype_profile=dtype_profile,
+                     validation=validation)
+        # stages run in the constructor are timed separately
+        for stage, seconds in opsout.normalizationTimings.items():
+            timings[stage] = timings.get(stage, 0.) + seconds
+        opsout.normalizationTimings = timings
+        opsout._select_sky(ra_range, dec_range)
+        return opsout
+
+    def _select_sky(self, ra_range=None, dec_range=None):
+        """Keep the visits of the summary whose pointings `_ra`, `_dec` are
+        in the ranges `ra_range`, `dec_range` in degrees. The sql query
+        only selects visits whose positions in the database are in these
+        ranges, which may differ from the pointings after dithers are
+        added or set to zero in DDF."""
+        if ra_range is None and dec_range is None:
+            return
+        summary = self.summary
+        mask = self._sky_mask(summary['_ra'].values, summary['_dec'].values,
+                              ra_range=ra_range, dec_range=dec_range)
+        if not mask.all():
+            self.summary = summary[mask]
 
-        # filter read in summary table
+    @classmethod
+    def _lazyFromOpSimDB(cls, dbname, loader, subset='combined',
+                         opsimversion='lsstv3', zeroDDFDithers=True,
+                         user_propIDs=None, filterNull=False,
+                         backend='sqlalchemy', predicates=None,
+                         sqlStats=True):
+        """
+        Return an instance whose summary is obtained by calling `loader`
+        on first access, reading only the proposal table of the database
+        `dbname`. `predicates` are the sql conditions selecting visits from
+        `_summary_predicates`. If `sqlStats` is `False`, the statistics of
+        visits are obtained from the summary rather than an sql query.
+        Other parameters are the same as in `fromOpSimDB`.
+        """
+        opsimVars = cls.get_opsimVariablesForVersion(opsimversion)
+        tableNames = (opsimVars['summaryTableName'], 'Proposal')
+        subset = subset.lower()
+        if subset not in cls.get_allowed_subsets():
+            raise NotImplementedError('subset {} not implemented'.\
+                                      format(subset))
+        engine = cls._get_connection(dbname, backend=backend)
+        propDict, propIDs, proposals = cls._get_propIDs(tableNames, engine,
+                                                        opsimversion,
+                                                        subset,
+                                                        user_propIDs=user_propIDs)
+
+        opsout = cls.__new__(cls)
+        opsout.opsimversion = opsimversion
+        opsout.allowed_subsets = cls.get_allowed_subsets()
+        opsout.subset = subset
+        opsout.propIDDict = propDict
+        opsout.proposalTable = proposals
+        opsout.zeroDDFDithers = zeroDDFDithers and opsimversion == 'lsstv3'
+        opsout._opsimvars = None
+        opsout._propID = None
+        opsout._summary = None
+        opsout._summaryLoader = loader
+        if not sqlStats:
+            return opsout
+        notIndexed = cls._useTableScan(engine, opsimVars, propIDs, subset,
+                                       predicates=predicates)
+        opsout._statsSource = (dbname, backend,
+                               cls._filter_stats_query(opsimVars, propIDs,
+                                                       subset, opsimversion,
+                                                       filterNull=filterNull,
+                                                       notIndexed=notIndexed,
+                                                       predicates=predicates))
+        return opsout
+
+    @classmethod
+    def _filter_stats_query(cls, opsimVars, propIDs, subset, opsimversion,
+                            filterNull=False, notIndexed=False,
+                            predicates=None):
+        """Return the sql query of the number of visits and the first and
+        last MJD of visits in each filter, counting visits shared between
+        proposals once unless the subset is `_all` or the version is
+        `sstf`, as in `fromOpSimDB`. `notIndexed` and `predicates` are used
+        as in `_summary_query`.
+        """
+        obsHistID = opsimVars['obsHistID']
+        expMJD = opsimVars['expMJD']
+        query = cls._summary_query(opsimVars, propIDs, subset,
+                                   columns=(obsHistID, 'filter', expMJD,
+                                            'fiveSigmaDepth'),
+                                   notIndexed=notIndexed,
+                                   predicates=predicates)
+        if subset == '_all' or opsimversion == 'sstf':
+            count = 'COUNT(*)'
+        else:
+            count = 'COUNT(DISTINCT "{}")'.format(obsHistID)
+        where = ' WHERE fiveSigmaDepth IS NOT NULL' if filterNull else ''
+        return 'SELECT "filter", {0} AS numVisits, MIN("{1}") AS minMJD, '\
+            'MAX("{1}") AS maxMJD FROM ({2}){3} GROUP BY "filter" '\
+            'ORDER BY "filter"'.format(count, expMJD, query, where)
+
+    @classmethod
+    def _fromSummaryCache(cls, cache_dir, dbname, subset='combined',
+                          opsimversion='lsstv3', backend='sqlalchemy',
+                          validation='fast', mmap_mode=None, read_workers=1,
+                          read_pool='process', **options):
+        """
+        Instantiate the class from the `SummaryCache` in `cache_dir` if it
+        has an entry for the database `dbname` and the options, or else
+        from the database using `fromOpSimDB` and store the result in the
+        cache. Parameters are the same as `fromOpSimDB`, except `mmap_mode`
+        which is used to memory map the numeric columns of a summary read
+        from the cache, see `SummaryCache.load`. As `backend`, the way the
+        database is read (`read_workers`, `read_pool`) is not part of the
+        key of the cache.
+        """
+        subset = subset.lower()
+        cache = SummaryCache(cache_dir)
+        key = cache.key(dbname, subset=subset, opsimversion=opsimversion,
+                        **options)
+        if key in cache:
+            print('reading summary from cache {}'.format(cache.path(key)))
+            summary, proposals, meta = cache.load(key, mmap_mode=mmap_mode)
+            propDict = dict()
+            for name, val in meta['propIDDict'].items():
+                propDict[name] = np.asarray(val) if isinstance(val, list) \
+                    else val
+            # dithers in DDF have already been set to zero if required, and
+            # the types are those of the stored summary
+            opsout = cls(propIDDict=propDict, summary=summary,
+                         zeroDDFDithers=False, proposalTable=proposals,
+                         subset=subset, propIDs=options.get('user_propIDs'),
+                         opsimversion=opsimversion, validation=validation)
+            # entries written before the setting was stored have it in
+            # their key
+            opsout.zeroDDFDithers = meta.get(
+                'zeroDDFDithers',
+                options.get('zeroDDFDithers', True) and
+                opsimversion == 'lsstv3')
+            return opsout
+
+        opsout = cls.fromOpSimDB(dbname, subset=subset,
+                                 opsimversion=opsimversion, backend=backend,
+                                 validation=validation,
+                                 read_workers=read_workers,
+                                 read_pool=read_pool, **options)
+        propDict = dict()
+        for name, val in opsout.propIDDict.items():
+            propDict[name] = np.asarray(val).tolist()
+        print('writing summary to cache {}'.format(cache.path(key)))
+        cache.store(key, opsout.summary, opsout.proposalTable,
+                    meta=dict(propIDDict=propDict, dbname=dbname,
+                              opsimversion=opsimversion, subset=subset,
+                              zeroDDFDithers=opsout.zeroDDFDithers))
+        return opsout
+
+    @classmethod
+    def _normalize_summary(cls, summary, propDict, opsimversion, subset,
+                           filterNull=False, dithercolumns=None,
+                           add_dithers=False, deduplicated=False,
+                           timings=None, **kwargs):
+        """
+        Normalize a summary table read in from the OpSim database by
+        filtering null values, using standard column names, dropping
+        duplicates, setting the index to `obsHistID` and adding dithers,
+        using the stages of `OpSimOutput.normalizationPipeline`. The
+        parameters have the same meaning as in `fromOpSimDB`, except
+        `deduplicated` which should be `True` if duplicates have already
+        been dropped in the sql query, and `timings` which if not `None` is
+        a dictionary updated with the time taken by each stage.
+
+        Returns
+        -------
+        `pd.DataFrame` suitable for use as `summary` in the constructor
+        """
         print('We have filterNull set to', filterNull)
+        pipeline = cls.normalizationPipeline(summary.columns, propDict,
+                                             opsimversion, subset,
+                                             filterNull=filterNull,
+                                             dithercolumns=dithercolumns,
+                                             add_dithers=add_dithers,
+                                             deduplicated=deduplicated,
+                                             **kwargs)
+        summary = pipeline.run(summary)
+        if timings is not None:
+            timings.update(pipeline.timings)
+        return summary
+
+    @classmethod
+    def normalizationPipeline(cls, columns, propDict, opsimversion, subset,
+                              filterNull=False, dithercolumns=None,
+                              add_dithers=False, deduplicated=False,
+                              **kwargs):
+        """
+        Return the `NormalizationPipeline` turning a summary table with the
+        columns `columns` read in from the OpSim database into a summary
+        table for the constructor. The stages are
+
+        - `FilterNull` of `fiveSigmaDepth` if `filterNull`
+        - `RenameColumns` to the standard names of `get_summaryRenameDict`
+        - `DropDuplicateVisits` unless the subset is `_all` or the version
+          is `sstf`
+        - `SetIndex` to `obsHistID`
+        - `JoinDithers` of `dithercolumns` if it is a `DitherTable`,
+          `JoinColumns` of `dithercolumns`, or `ComputeColumns` of dithers
+          from `get_dithercolumns` with options `kwargs`, if `add_dithers`
+          or the database does not have dithered columns. Dithered columns
+          in the database are only replaced by those of `get_dithercolumns`
+          if the option `replace_dithers` is `True`.
+
+        The rows and columns are only gathered once after all the stages.
+        The constructor then sets dithers in DDF to zero and computes `_ra`
+        and `_dec`. The parameters have the same meaning as in
+        `fromOpSimDB` and `_normalize_summary`.
+        """
+        opsimVars = cls.get_opsimVariablesForVersion(opsimversion)
+
+        stages = []
         if filterNull:
             print('With given option, filtering the raw summary table of NaNs')
-            num_orig = len(summary)
-            summary = summary[np.isfinite(summary['fiveSigmaDepth'])]
-            print('This option reduced the number of rows from {0} to {1}'.format(num_orig, len(summary)))
+            stages.append(FilterNull('fiveSigmaDepth'))
 
-        print('checking that summary table read in\n')
-        if cls.validate_pointings(summary, opsimVars=None):
-            print('Reading in raw tables successful')
+        # Standardize names of summary table columns
+        stages.append(RenameColumns(cls.get_summaryRenameDict(opsimVars)))
 
+        # Drop duplicates unless this is to write out the entire OpSim. In
+        # `sstf` versions visits are not duplicated.
+        if deduplicated:
+            stages.append(DropDuplicateVisits(propDict, deduplicated=True))
+        elif subset != '_all' and opsimversion != 'sstf':
+            stages.append(DropDuplicateVisits(propDict))
 
-        # Standardize names of summary table columns
+        # Set Standard Index
+        stages.append(SetIndex('obsHistID'))
+
+        # In `lsstv3` minion like baselines, the pointingRA are `ditheredRA` etc.
+        # In `sstf` versions, the pointing coordinates are `fieldRA` etc.
+        # in `lsstv4`, the pointing coordinates are unsupplied but `ditheredRA` etc.
+        # eg. has to be done in `lsstv4` and `sstf` unless supplied
+        add_dithers = cls._addsDithers(columns, add_dithers,
+                                       dithercolumns=dithercolumns,
+                                       replace_dithers=kwargs.get(
+                                           'replace_dithers', False))
+
+        if add_dithers and isinstance(dithercolumns, DitherTable):
+            print('Joining dithers sorted by obsHistID\n')
+            stages.append(JoinDithers(dithercolumns, name='dithers'))
+        elif add_dithers and dithercolumns is not None:
+            print('Trying to join input dithercolumns\n')
+            # If provided with dithers in a dataFrame, use them
+            # Check that dithercolumns are available in input
+            assert 'ditheredRA' in dithercolumns.columns
+            assert 'ditheredDec' in dithercolumns.columns
+            assert 'obsHistID' == dithercolumns.index.name
+            assert dithercolumns.index.is_unique
+
+            # Assumption : I have the dither columns in a `pd.DataFrame`
+            # with minimal columns `ditheredRA` and `ditheredDec` and
+            # index name `obsHistID` which indexes the visits in the
+            # Summary Table. If the column names already exist in the
+            # table they are replaced.
+            stages.append(JoinColumns(dithercolumns,
+                                      replace=('ditheredRA', 'ditheredDec'),
+                                      name='dithers'))
+        elif add_dithers:
+            print('creating dither columns \n')
+
+            # No dither column provided. Methods of `DitherEngine` offset
+            # WFD visits by up to the field of view and DDF visits by up to
+            # a chip, while 'default' and 'FlatSky' keep their defaults.
+            ditherdict = dict(method='default',
+                              ddfID=propDict['ddf'],
+                              ddf_ditherscale=1.75,
+                              wfd_ditherscale=0.2,
+                              rng=np.random.RandomState(1),
+                              seed=1)
+            if kwargs.get('method') in DitherEngine.methods():
+                ditherdict.update(ddf_ditherscale=0.2, wfd_ditherscale=1.75)
+            if kwargs:
+                for key in kwargs:
+                    ditherdict[key] = kwargs[key]
+
+            def dithers(frame):
+                return cls.get_dithercolumns(frame,
+                                             opsimversion=opsimversion,
+                                             method=ditherdict['method'],
+                                             ddfId=ditherdict['ddfID'],
+                                             ddf_ditherscale=ditherdict['ddf_ditherscale'],
+                                             wfd_ditherscale=ditherdict['wfd_ditherscale'],
+                                             rng=ditherdict['rng'],
+                                             seed=ditherdict['seed'])
+
+            inputs = ('fieldRA', 'fieldDec', 'propID')
+            if ditherdict['method'] in DitherEngine.methods():
+                inputs += ('night',)
+            # Dithers in the database are only read if they are replaced
+            stages.append(ComputeColumns(dithers, inputs=inputs,
+                                         outputs=('ditheredRA', 'ditheredDec'),
+                                         replace=('ditheredRA', 'ditheredDec'),
+                                         name='dithers'))
+
+        return NormalizationPipeline(stages)
+
+    @staticmethod
+    def get_summaryRenameDict(opsimVars):
+        """Return a dictionary whose keys are names of columns in the summary
+        table of the OpSim database, and values are the standard names of
+        the same quantities used in `OpSimSummary`.
+
+        Parameters
+        ----------
+        opsimVars : dict
+            dictionary for the OpSim version obtained from
+            `OpSimOutput.get_opsimVariablesForVersion(opsimversion)`
+        """
         replacedict = dict()
         replacedict[opsimVars['obsHistID']] = 'obsHistID'
         replacedict[opsimVars['propIDNameInSummary']] = 'propID'
         replacedict[opsimVars['expMJD']] = 'expMJD'
         replacedict[opsimVars['FWHMeff']] = 'FWHMeff'
         replacedict[opsimVars['filtSkyBrightness']] = 'filtSkyBrightness'
-        summary = summary.rename(columns=replacedict)
+        return replacedict
+
+    @staticmethod
+    def get_summaryColumns(columns, opsimVars, tableColumns,
+                           add_dithers=False, ditherMethod='default'):
+        """Return the list of columns of the summary table in the OpSim
+        database that need to be read to provide the columns `columns` of
+        `OpSimOutput.summary`. Columns required to drop duplicates
+        (`obsHistID`, `propID`, `expMJD`), validate the pointings
+        (`fiveSigmaDepth`), and obtain the pointings (`fieldRA`, `fieldDec`,
+        the dithered columns if they are used, and `night` if dithers are
+        created by a method of `DitherEngine`) are always added.
 
-        if cls.validate_pointings(summary, opsimVars=None):
-            print('replacing names works')
+        Parameters
+        ----------
+        columns : sequence of strings
+            names of columns used in `OpSimSummary`. `_ra` and `_dec` are
+            translated to the pointing columns.
+        opsimVars : dict
+            dictionary for the OpSim version obtained from
+            `OpSimOutput.get_opsimVariablesForVersion(opsimversion)`
+        tableColumns : sequence of strings
+            names of the columns in the summary table of the database
+        add_dithers : Bool, defaults to `False`
+            if `True`, dithered columns in the database are not required as
+            they will be replaced.
+        ditherMethod : string, defaults to 'default'
+            method used to create dithers, see `get_dithercolumns`
 
-        # Drop Duplicates
-        if subset != '_all':
-            # Drop duplicates unless this is to write out the entire OpSim
-            summary = cls.dropDuplicates(summary, propDict, opsimversion)
+        Returns
+        -------
+        list of column names in the database, in the order of `tableColumns`
+        """
+        canonical = dict((val, key) for (key, val) in
+                         OpSimOutput.get_summaryRenameDict(opsimVars).items())
+        required = ['obsHistID', 'propID', 'expMJD', 'fiveSigmaDepth',
+                    'fieldRA', 'fieldDec']
+        if not add_dithers:
+            required += ['ditheredRA', 'ditheredDec']
+        if (add_dithers or opsimVars['pointingRA'] not in tableColumns) \
+                and ditherMethod in DitherEngine.methods():
+            required += ['night']
+
+        aliases = dict(_ra='ditheredRA', _dec='ditheredDec')
+        wanted = set()
+        for col in list(columns) + required:
+            col = aliases.get(col, col)
+            dbcol = canonical.get(col, col)
+            if dbcol in tableColumns:
+                wanted.add(dbcol)
+            elif col in ('ditheredRA', 'ditheredDec'):
+                # These are created from `fieldRA`, `fieldDec` if absent
+                continue
+            else:
+                raise ValueError('column {0} (as {1}) not in the summary table'
+                                 .format(col, dbcol))
+        return list(col for col in tableColumns if col in wanted)
 
-        # Set Standard Index
-        summary.set_index('obsHistID', inplace=True)
+    @staticmethod
+    def _get_table_columns(engine, tableName):
+        """Return the list of column names in the table `tableName`"""
+        sql_query = 'SELECT * FROM {} LIMIT 0'.format(tableName)
+        return list(pd.read_sql_query(sql_query, con=engine).columns)
 
-        if cls.validate_pointings(summary, opsimVars=None):
-            print('dropping duplicates works')
+    @staticmethod
+    def _summary_query(opsimVars, propIDs, subset, columns=None,
+                       orderBy=None, dedupPropIDDict=None, notIndexed=False,
+                       predicates=None):
+        """Return the sql query selecting the observations in `subset` from
+        the summary table of the OpSim database.
 
-        # At this stage the summary table is read in,
-        # and the standard index is set
+        Parameters
+        ----------
+        opsimVars : dict
+            dictionary for the OpSim version obtained from
+            `OpSimOutput.get_opsimVariablesForVersion(opsimversion)`
+        propIDs : sequence of integers
+            proposal IDs used for subsets other than `_all`, `unique_all`
+        subset : string
+            one of {'_all', 'unique_all', 'wfd', 'ddf', 'combined'}
+        columns : sequence of strings, defaults to `None`
+            names of columns in the database to select. If `None`, all
+            columns are selected.
+        orderBy : sequence of strings, defaults to `None`
+            names of columns in the database to order the results by
+        dedupPropIDDict : dict, defaults to `None`
+            if not `None`, the dictionary of `ddf` and `wfd` proposal IDs
+            used to select a single row for each visit shared between
+            proposals, preferring DDF rows to WFD rows to other rows, as in
+            `OpSimOutput.dropDuplicates`. In this case `columns` may not be
+            `None` and the rows are ordered by the MJD unless `orderBy` is
+            given. This uses window functions requiring SQLite >= 3.25.
+        notIndexed : Bool, defaults to `False`
+            if `True`, tell SQLite to scan the table rather than use an
+            index to select the proposals, see `_useTableScan`
+        predicates : sequence of strings, defaults to `None`
+            sql conditions on the rows of the summary table which are
+            selected, see `_summary_predicates`. Duplicates are dropped
+            after these conditions are applied.
+        """
+        summaryTableName = opsimVars['summaryTableName']
+        if notIndexed:
+            summaryTableName += ' NOT INDEXED'
 
-        # In `lsstv3` minion like baselines, the pointingRA are `ditheredRA` etc.
-        # In `sstf` versions, the pointing coordinates are `fieldRA` etc.
-        # in `lsstv4`, the pointing coordinates are unsupplied but `ditheredRA` etc.
+        if columns is None:
+            colString = '*'
+        else:
+            colString = ', '.join('"{}"'.format(col) for col in columns)
 
-        if 'ditheredra' not in list(x.lower() for x in summary.columns):
-            # eg. has to be done in `lsstv4` and `sstf` unless supplied
-            add_dithers = True
-
-        if add_dithers:
-            if dithercolumns is not None:
-                print('Trying to join input dithercolumns\n')
-                # If provided with dithers in a dataFrame, use them
-                # Check that dithercolumns are available in input
-                assert 'ditheredRA' in dithercolumns.columns
-                assert 'ditheredDec' in dithercolumns.columns
-                assert 'obsHistID' == dithercolumns.index.name
-
-                # if the column names already exist in the table remove them
-                if 'ditheredra' in list(x.lower() for x in summary.columns):
-                    del summary['ditheredRA']
-                    del summary['ditheredDec']
-
-                # Assumption : I have the dither columns in a `pd.DataFrame`
-                # with minimal columns `ditheredRA` and `ditheredDec` and
-                # index name `obsHistID` which indexes the visits in the
-                # Summary Table
-
-                summary = summary.join(dithercolumns)
-
-            elif add_dithers:
-                print('creating dither columns \n')
-
-                # No dither column provided
-                ditherdict = dict(method='default',
-                                  ddfID=propDict['ddf'],
-                                  ddf_ditherscale=1.75,
-                                  wfd_ditherscale=0.2,
-                                  rng=np.random.RandomState(1))
-                method = 'default'
-
-                ddfID = propDict['ddf']
-                ddf_ditherscale = 1.75
-                wfd_ditherscale = 0.2
-                rng = np.random.RandomState(1)
-
-                if kwargs:
-                    for key in kwargs:
-                        ditherdict[key] = kwargs[key]
-
-                dithercolumns = cls.get_dithercolumns(summary[['fieldRA',
-                                                               'fieldDec',
-                                                               'propID']],
-                                                      opsimversion=opsimversion,
-                                                      method=ditherdict['method'],
-                                                      ddfId=ditherdict['ddfID'],
-                                                      ddf_ditherscale=ditherdict['ddf_ditherscale'],
-                                                      wfd_ditherscale=ditherdict['wfd_ditherscale'],
-                                                      rng=rng)
-
-                print(dithercolumns.ditheredRA.max())
-                #print('max ra values are {}.'format(dithercolumns.ditheredRA.max()))
-                if cls.validate_pointings(dithercolumns, opsimVars=None, check_anycols=True):
-                    print('dithercolumns good!')
-                    # print('max ra values are {}.'format(dithercolumns.ditheredRA.max()))
-                try:
-                    summary = summary.join(dithercolumns)
-                    print(len(summary), len(dithercolumns))
-                    if cls.validate_pointings(summary, opsimVars=None):
-                        print('join good!')
-                except:
-                    pass
-            else:
-                raise NotImplementedError('What did you do ?????')
+        # Note OpSim version 4 has different names for the same variable
+        # in the Proposal Table and Summary Table.
+        propIDNameInSummary = opsimVars['propIDNameInSummary']
+        conditions = []
+        if subset in ('ddf', 'wfd', 'combined'):
+            # obtain propIDs in strings for sql queries
+            pidString = ', '.join(list(str(pid) for pid in propIDs))
+            conditions.append('{0} in ({1})'.format(propIDNameInSummary,
+                                                    pidString))
+        elif subset not in ('_all', 'unique_all'):
+            raise NotImplementedError()
+        if predicates is not None:
+            conditions += list(predicates)
+        where = ''
+        if len(conditions) > 0:
+            where = ' WHERE ' + ' AND '.join(conditions)
+
+        if dedupPropIDDict is None:
+            sql_query = 'SELECT {0} FROM {1}'.format(colString,
+                                                     summaryTableName) + where
+            # rows are in the order of the table whether or not an index is
+            # used to select them
+            if orderBy is None and len(where) > 0:
+                orderBy = ('rowid',)
         else:
-            # let pass without further action
-            pass
+            if columns is None:
+                raise ValueError('columns must be provided to drop duplicates')
+            def pidList(key):
+                return ', '.join(str(int(pid)) for pid in
+                                 np.atleast_1d(dedupPropIDDict[key]))
+            priority = 'CASE WHEN {0} IN ({1}) THEN 0 '\
+                'WHEN {0} IN ({2}) THEN 1 ELSE 2 END'.format(
+                    propIDNameInSummary, pidList('ddf'), pidList('wfd'))
+            obsHistID = opsimVars['obsHistID']
+            sql_query = 'SELECT {0} FROM (SELECT {0}, ROW_NUMBER() OVER '\
+                '(PARTITION BY {1} ORDER BY {2}, rowid) AS _visitRank '\
+                'FROM {3}{4}) WHERE _visitRank = 1'.format(
+                    colString, obsHistID, priority, summaryTableName, where)
+            if orderBy is None:
+                orderBy = (opsimVars['expMJD'], obsHistID)
+
+        if orderBy is not None:
+            sql_query += ' ORDER BY ' + ', '.join(orderBy)
+        return sql_query
+
+    @staticmethod
+    def _summary_predicates(opsimVars, mjd_range=None, night_range=None,
+                            filters=None, ra_range=None, dec_range=None,
+                            where=None, positionColumns=None):
+        """
+        Return a list of sql conditions selecting visits of the summary table
+        in ranges of time and position, and in some filters, using the
+        names of the columns in the OpSim database.
+
+        Parameters
+        ----------
+        opsimVars : dict
+            dictionary for the OpSim version obtained from
+            `OpSimOutput.get_opsimVariablesForVersion(opsimversion)`
+        mjd_range : tuple of two floats, defaults to `None`
+            first and last MJD of the visits, inclusive
+        night_range : tuple of two integers, defaults to `None`
+            first and last night of the visits, inclusive
+        filters : sequence of strings, defaults to `None`
+            filters of the visits, eg. ['g', 'r']
+        ra_range : tuple of two floats, defaults to `None`
+            lower and upper right ascension of the pointings in degrees,
+            inclusive. If the lower value is larger than the upper value,
+            the range wraps around 360 degrees, eg. (350., 10.)
+        dec_range : tuple of two floats, defaults to `None`
+            lower and upper declination of the pointings in degrees,
+            inclusive
+        where : string, defaults to `None`
+            sql condition on the columns of the summary table in the
+            database, eg. 'moonAlt < 0'
+        positionColumns : sequence of tuples of two strings, defaults to `None`
+            names of the columns of right ascension and declination in the
+            database used for `ra_range` and `dec_range`. Visits are
+            selected if any pair of columns is in the ranges, and the
+            ranges are not used if this is empty. If `None`,
+            `opsimVars['pointingRA']` and `opsimVars['pointingDec']` are
+            used.
+        """
+        conditions = []
+
+        def between(col, bounds, name):
+            lower, upper = bounds
+            if lower > upper:
+                raise ValueError('{0} {1} must be increasing'.format(name,
+                                                                     bounds))
+            return '("{0}" >= {1!r} AND "{0}" <= {2!r})'.format(col, lower,
+                                                                upper)
+
+        if mjd_range is not None:
+            conditions.append(between(opsimVars['expMJD'],
+                                      tuple(float(x) for x in mjd_range),
+                                      'mjd_range'))
+        if night_range is not None:
+            conditions.append(between('night',
+                                      tuple(int(x) for x in night_range),
+                                      'night_range'))
+        if filters is not None:
+            filters = list(filters)
+            if len(filters) == 0:
+                raise ValueError('filters must not be empty')
+            conditions.append('"filter" IN ({})'.format(', '.join(
+                "'{}'".format(str(band).replace("'", "''"))
+                for band in filters)))
+
+        # positions are given in degrees, and stored in `angleUnit`
+        toDBUnit = np.radians if opsimVars['angleUnit'] == 'radians' \
+            else float
+        raBounds, decBounds = OpSimOutput._sky_bounds(ra_range, dec_range)
+        if positionColumns is None:
+            positionColumns = [(opsimVars['pointingRA'],
+                                opsimVars['pointingDec'])]
+        positions = []
+        for raCol, decCol in positionColumns:
+            position = list('("{0}" >= {1!r} AND "{0}" <= {2!r})'.format(
+                raCol, float(toDBUnit(lower)), float(toDBUnit(upper)))
+                for lower, upper in raBounds)
+            position = ['(' + ' OR '.join(position) + ')'] \
+                if len(position) > 0 else []
+            if decBounds is not None:
+                position.append(between(decCol,
+                                        tuple(float(toDBUnit(x))
+                                              for x in decBounds),
+                                        'dec_range'))
+            if len(position) > 0:
+                positions.append(' AND '.join(position))
+        if len(positions) > 0:
+            conditions.append('(' + ' OR '.join(positions) + ')')
+
+        if where is not None:
+            conditions.append('({})'.format(where))
+        return conditions
 
- 
-        if cls.validate_pointings(summary, opsimVars=None):
-            print('joining dithers works')
+    @staticmethod
+    def _sky_bounds(ra_range, dec_range):
+        """
+        Return a list of intervals of right ascension in [0, 360] degrees
+        whose union is `ra_range`, which is empty if all right ascensions
+        are in `ra_range`, and `dec_range` or `None`, checking that the
+        ranges are valid.
+        """
+        raBounds = []
+        if ra_range is not None:
+            lower, upper = (float(x) for x in ra_range)
+            # a range of 360 degrees or more selects all right ascensions
+            if upper - lower < 360.:
+                lower, upper = lower % 360., upper % 360.
+                if lower <= upper:
+                    raBounds = [(lower, upper)]
+                else:
+                    raBounds = [(lower, 360.), (0., upper)]
+        if dec_range is not None:
+            dec_range = tuple(float(x) for x in dec_range)
+            if dec_range[0] > dec_range[1]:
+                raise ValueError('dec_range {} must be increasing'.format(
+                    dec_range))
+        return raBounds, dec_range
 
-        return cls(propIDDict=propDict,
-                   summary=summary,
-                   zeroDDFDithers=zeroDDFDithers,
-                   proposalTable=proposals, subset=subset,
-                   opsimversion=opsimversion)
+    @staticmethod
+    def _sky_mask(ra, dec, ra_range=None, dec_range=None):
+        """
+        Return a boolean array which is `True` for the pointings `ra`, `dec`
+        in radians in the ranges `ra_range`, `dec_range` in degrees, see
+        `_summary_predicates`.
+        """
+        raBounds, decBounds = OpSimOutput._sky_bounds(ra_range, dec_range)
+        ra = np.degrees(ra) % 360.
+        mask = np.ones(len(ra), dtype=bool)
+        if len(raBounds) > 0:
+            mask = np.zeros(len(ra), dtype=bool)
+            for lower, upper in raBounds:
+                mask |= (ra >= lower) & (ra <= upper)
+        if decBounds is not None:
+            dec = np.degrees(dec)
+            mask &= (dec >= decBounds[0]) & (dec <= decBounds[1])
+        return mask
 
     @staticmethod
-    def _read_summary_table_raw(engine, opsimVars, propIDs, subset):
+    def _position_columns(opsimVars, tableColumns, zeroDDFDithers=True,
+                          add_dithers=False, dithercolumns=None,
+                          ditherMethod='default'):
+        """
+        Return the pairs of columns of the summary table in the database
+        whose positions include the pointings of visits after normalizing
+        the summary, for `_summary_predicates`. This is empty if the
+        pointings are added from `dithercolumns` or random dithers.
+        `zeroDDFDithers` should be `True` if the dithers of DDF visits are
+        set to the field positions by the constructor.
+        """
+        tableColumns = set(tableColumns)
+        if add_dithers or 'ditheredRA' not in tableColumns:
+            # dithers are created by `get_dithercolumns`
+            if dithercolumns is None and ditherMethod == 'default':
+                return [('fieldRA', 'fieldDec')]
+            return []
+        positions = [('ditheredRA', 'ditheredDec')]
+        # dithers of DDF visits are later set to the field positions
+        if zeroDDFDithers:
+            positions.append(('fieldRA', 'fieldDec'))
+        return positions
 
-        # Do the actual sql queries or table reads for observations
+    @staticmethod
+    def _useTableScan(engine, opsimVars, propIDs, subset, predicates=None):
+        """Return `True` if the summary table has an index on the proposal
+        ID, but the proposals of `subset` have more than a fraction
+        `OpSimOutput.maxIndexedFraction` of the rows, so that scanning the
+        table is faster than using the index. With `predicates`, SQLite
+        chooses between the indexes on the columns of the predicates.
+        """
+        if subset not in ('ddf', 'wfd', 'combined') or predicates:
+            return False
         summaryTableName = opsimVars['summaryTableName']
+        propIDName = opsimVars['propIDNameInSummary']
+        if propIDName not in summary_indexes(engine, summaryTableName):
+            return False
+        # counts use the index and are fast
+        total = _fetchall(engine, 'SELECT COUNT(*) FROM "{}"'.format(
+            summaryTableName))[0][0]
+        selected = _fetchall(engine, 'SELECT COUNT(*) FROM "{0}" WHERE "{1}" '
+                             'IN ({2})'.format(summaryTableName, propIDName,
+                                               ', '.join(str(int(pid))
+                                                         for pid in propIDs))
+                             )[0][0]
+        return selected > OpSimOutput.maxIndexedFraction * total
 
+    @staticmethod
+    def _read_summary_table_raw(engine, opsimVars, propIDs, subset,
+                                columns=None, dedupPropIDDict=None,
+                                predicates=None):
 
-        # Note OpSim version 4 has different names for the same variable
-        # in the Proposal Table and Summary Table.
-        propIDNameInSummary = opsimVars['propIDNameInSummary']
-        if subset in ('_all', 'unique_all'):
+        # Do the actual sql queries or table reads for observations
+        summaryTableName = opsimVars['summaryTableName']
+        use_sqlite3 = isinstance(engine, sqlite3.Connection)
+
+        if subset in ('_all', 'unique_all') and columns is None \
+                and not use_sqlite3 and not predicates:
             # In this case read everything (ie. table read)
             summary = pd.read_sql_table(summaryTableName, con=engine)
+        else:
+            if dedupPropIDDict is not None and columns is None:
+                columns = OpSimOutput._get_table_columns(engine,
+                                                         summaryTableName)
+            notIndexed = OpSimOutput._useTableScan(engine, opsimVars, propIDs,
+                                                   subset,
+                                                   predicates=predicates)
+            sql_query = OpSimOutput._summary_query(opsimVars, propIDs, subset,
+                                                   columns=columns,
+                                                   dedupPropIDDict=dedupPropIDDict,
+                                                   notIndexed=notIndexed,
+                                                   predicates=predicates)
+            print(sql_query)
+            if use_sqlite3:
+                summary = OpSimOutput._read_sqlite3_query(engine, sql_query)
+            else:
+                summary = pd.read_sql_query(sql_query, con=engine)
+        return summary
 
-        elif subset in ('ddf', 'wfd', 'combined'):
-            print('Not doing all observations here ')
-            # In this case use sql queries rather than reading the whole table
-            # obtain propIDs in strings for sql queries
-            pidString = ', '.join(list(str(pid) for pid in propIDs))
-            print(pidString, subset)
-            sql_query = 'SELECT * FROM {0} WHERE {1}'.format(summaryTableName,
-                                                             propIDNameInSummary
-                                                            )
-            sql_query += ' in ({})'.format(pidString)
+    @classmethod
+    def iter_summary(cls, dbname,
+                     chunksize=500000,
+                     subset='combined',
+                     opsimversion='lsstv3',
+                     zeroDDFDithers=True,
+                     user_propIDs=None,
+                     dithercolumns=None,
+                     add_dithers=False,
+                     filterNull=False,
+                     columns=None,
+                     backend='sqlalchemy',
+                     dtype_profile=None,
+                     validation='fast',
+                     mjd_range=None,
+                     night_range=None,
+                     filters=None,
+                     ra_range=None,
+                     dec_range=None,
+                     where=None,
+                     **kwargs):
+        """
+        Generator of chunks of the summary table of an OpSim database, where
+        each chunk is normalized in the same way as `OpSimOutput.summary`
+        obtained from `fromOpSimDB`, so that the entire table is never held
+        in memory.
 
-            # If propIDs were passed to the method, this would be used
-            print(sql_query)
-            summary = pd.read_sql_query(sql_query, con=engine)
+        Parameters
+        ----------
+        dbname : string
+            absolute path to database
+        chunksize : int, defaults to 500000
+            number of rows of the summary table read in at a time. Chunks
+            yielded may be smaller after dropping duplicates and filtering.
+        subset, opsimversion, zeroDDFDithers, user_propIDs, dithercolumns,
+        add_dithers, filterNull, columns, backend, dtype_profile, validation,
+        mjd_range, night_range, filters, ra_range, dec_range, where, kwargs :
+            same as in `OpSimOutput.fromOpSimDB`
+
+        Returns
+        -------
+        generator of `pd.DataFrame` with the same format as
+        `OpSimOutput.summary`
+
+        .. note:: The rows are read in order of `obsHistID`, and all rows
+            with the same `obsHistID` are kept in the same chunk so that
+            duplicates are dropped correctly. Each chunk is sorted by
+            `expMJD`. If dithers are generated, a single random state
+            (`kwargs['rng']`) is used across chunks.
+        """
+        opsimVars = cls.get_opsimVariablesForVersion(opsimversion)
+        tableNames = (opsimVars['summaryTableName'], 'Proposal')
+
+        subset = subset.lower()
+        if subset not in cls.get_allowed_subsets():
+            raise NotImplementedError('subset {} not implemented'.\
+                                      format(subset))
+
+        engine = cls._get_connection(dbname, backend=backend)
+        propDict, propIDs, proposals = cls._get_propIDs(tableNames, engine,
+                                                        opsimversion,
+                                                        subset,
+                                                        user_propIDs=user_propIDs)
+        tableColumns = cls._get_table_columns(engine,
+                                              opsimVars['summaryTableName'])
+        add_dithers = cls._addsDithers(tableColumns, add_dithers,
+                                       dithercolumns=dithercolumns,
+                                       replace_dithers=kwargs.get(
+                                           'replace_dithers', False))
+        if columns is not None:
+            columns = cls.get_summaryColumns(columns, opsimVars, tableColumns,
+                                             add_dithers=add_dithers,
+                                             ditherMethod=kwargs.get('method',
+                                                                     'default'))
+
+        if isinstance(dithercolumns, str):
+            dithercolumns = DitherTable.fromFile(dithercolumns)
+
+        # Use a single random state for the dithers of all chunks
+        if 'rng' not in kwargs:
+            kwargs['rng'] = np.random.RandomState(1)
+
+        obsHistIDCol = opsimVars['obsHistID']
+        positionColumns = cls._position_columns(
+            opsimVars, tableColumns,
+            zeroDDFDithers=zeroDDFDithers and opsimversion == 'lsstv3',
+            add_dithers=add_dithers, dithercolumns=dithercolumns,
+            ditherMethod=kwargs.get('method', 'default'))
+        predicates = cls._summary_predicates(opsimVars, mjd_range=mjd_range,
+                                             night_range=night_range,
+                                             filters=filters,
+                                             ra_range=ra_range,
+                                             dec_range=dec_range, where=where,
+                                             positionColumns=positionColumns)
+        sql_query = cls._summary_query(opsimVars, propIDs, subset,
+                                       columns=columns,
+                                       orderBy=(obsHistIDCol, 'rowid'),
+                                       notIndexed=cls._useTableScan(
+                                           engine, opsimVars, propIDs,
+                                           subset, predicates=predicates),
+                                       predicates=predicates)
+        print(sql_query)
+
+        def normalized(chunk):
+            summary = cls._normalize_summary(chunk, propDict, opsimversion,
+                                             subset, filterNull=filterNull,
+                                             dithercolumns=dithercolumns,
+                                             add_dithers=add_dithers,
+                                             **kwargs)
+            opsout = cls(propIDDict=propDict, summary=summary,
+                         zeroDDFDithers=zeroDDFDithers,
+                         proposalTable=proposals, subset=subset,
+                         opsimversion=opsimversion,
+                         dtype_profile=dtype_profile,
+                         validation=validation)
+            opsout._select_sky(ra_range, dec_range)
+            return opsout.summary
+
+        # Rows with the last `obsHistID` of a chunk may continue in the
+        # next chunk, so these are carried over
+        if backend == 'sqlite3':
+            chunks = cls._read_sqlite3_query(engine, sql_query,
+                                             chunksize=chunksize)
         else:
-            raise NotImplementedError()
-        return summary
+            chunks = pd.read_sql_query(sql_query, con=engine,
+                                       chunksize=chunksize)
+        carry = None
+        for chunk in chunks:
+            # an empty result is read as a single empty chunk
+            if len(chunk) == 0:
+                continue
+            if carry is not None:
+                chunk = pd.concat([carry, chunk], ignore_index=True)
+            obsHistIDs = chunk[obsHistIDCol].values
+            tail = obsHistIDs == obsHistIDs[-1]
+            if tail.all():
+                carry = chunk
+                continue
+            carry = chunk[tail]
+            chunk = chunk[~tail]
+            yield normalized(chunk)
+
+        if carry is not None and len(carry) > 0:
+            yield normalized(carry)
 
     @staticmethod
     def _get_propIDs(tableNames, engine, opsimversion, subset,
@@ -627,7 +1697,11 @@ class OpSimOutput(object):
         """
         # Read the proposal table to find out which propID corresponds to
         # the subsets requested
-        proposals = pd.read_sql_table(tableNames[1], con=engine)
+        if isinstance(engine, sqlite3.Connection):
+            proposals = pd.read_sql_query('SELECT * FROM {}'.format(tableNames[1]),
+                                          con=engine)
+        else:
+            proposals = pd.read_sql_table(tableNames[1], con=engine)
         propDict = OpSimOutput.get_propIDDict(proposals, opsimversion=opsimversion)
 
         # Seq of propIDs consistent with subset
@@ -647,6 +1721,252 @@ class OpSimOutput(object):
         engine = create_engine(dbname, echo=False)
         return engine
 
+    @staticmethod
+    def _get_connection(dbname, backend='sqlalchemy'):
+        """Return a connection to the OpSim database `dbname` for the
+        `backend`. For `backend='sqlalchemy'` this is a `sqlalchemy` engine,
+        while for `backend='sqlite3'` this is a read-only `sqlite3.Connection`
+        with memory mapping and a large page cache.
+
+        A database compressed with gzip, xz or bz2 (eg.
+        `minion_1016_sqlite.db.gz`) is read from its uncompressed copy in
+        the `DecompressionCache`, decompressing it on first use. If a
+        sidecar copy of the database with indexes made by `build_indexes`
+        is up to date, it is used instead.
+
+        Parameters
+        ----------
+        dbname : string
+            absolute path to the database
+        backend : {'sqlalchemy'|'sqlite3'}, defaults to 'sqlalchemy'
+            library used to read the database
+        """
+        if dbname.startswith('sqlite:///'):
+            dbname = dbname[len('sqlite:///'):]
+        # connecting to a missing database would create an empty one
+        if not os.path.exists(dbname):
+            raise IOError('database {} does not exist'.format(dbname))
+        if compression_format(dbname) is not None:
+            dbname = DecompressionCache().get(dbname)
+        # Use a sidecar copy of the database with indexes if there is one
+        indexed = indexed_dbname(dbname)
+        if indexed != dbname:
+            print(' using indexed copy {0} of {1}'.format(indexed, dbname))
+            dbname = indexed
+
+        if backend == 'sqlalchemy':
+            return OpSimOutput._get_sql_engine(dbname)
+        elif backend != 'sqlite3':
+            raise ValueError('backend {} not recognized'.format(backend))
+        uri = 'file:{}?mode=ro'.format(pathname2url(os.path.abspath(dbname)))
+        print(' reading from database {}'.format(uri))
+        con = sqlite3.connect(uri, uri=True)
+        # Map up to 1 GB of the file and keep 256 MB of pages in the cache
+        con.execute('PRAGMA mmap_size = {}'.format(2**30))
+        con.execute('PRAGMA cache_size = {}'.format(-2**18))
+        con.execute('PRAGMA query_only = 1')
+        return con
+
+    @staticmethod
+    def _fill_arrays(cursor, numRows, arraysize=50000):
+        """Read up to `numRows` rows from an executed `sqlite3.Cursor`
+        into preallocated `np.ndarray` one for each column of the result,
+        and return them as a list along with the number of rows read. The
+        type of the array for each column is inferred from the values read:
+        integers (float64 if there are `NULL` values), floats or objects.
+        """
+        numCols = len(cursor.description)
+        arrays = [None] * numCols
+        i = 0
+        while i < numRows:
+            rows = cursor.fetchmany(min(arraysize, numRows - i))
+            if not rows:
+                break
+            n = len(rows)
+            for j, col in enumerate(zip(*rows)):
+                if arrays[j] is None:
+                    first = next((val for val in col if val is not None),
+                                 None)
+                    if first is None or isinstance(first, float):
+                        dtype = np.float64
+                    elif isinstance(first, int):
+                        dtype = np.int64
+                    else:
+                        dtype = object
+                    arrays[j] = np.empty(numRows, dtype=dtype)
+                arr = arrays[j]
+                if arr.dtype == np.int64:
+                    # floats or NULL values may appear in integer columns
+                    values = np.array(col)
+                    if values.dtype.kind not in 'iu':
+                        try:
+                            values = np.array(col, dtype=np.float64)
+                            arr = arr.astype(np.float64)
+                        except (TypeError, ValueError):
+                            arr = arr.astype(object)
+                            values = col
+                    arr[i: i + n] = values
+                else:
+                    try:
+                        arr[i: i + n] = col
+                    except (TypeError, ValueError):
+                        arr = arr.astype(object)
+                        arr[i: i + n] = col
+                arrays[j] = arr
+            i += n
+        arrays = list(np.empty(0) if arr is None else arr[:i]
+                      for arr in arrays)
+        return arrays, i
+
+    @staticmethod
+    def _read_sqlite3_query(con, sql_query, chunksize=None):
+        """Read the results of `sql_query` using the `sqlite3.Connection`
+        `con` into a `pd.DataFrame`, filling arrays of each column directly
+        from the cursor. If `chunksize` is not `None`, return a generator of
+        `pd.DataFrame` with at most `chunksize` rows instead.
+        """
+        cursor = con.execute(sql_query)
+        names = list(desc[0] for desc in cursor.description)
+
+        def frame(arrays):
+            return pd.DataFrame(dict(zip(names, arrays)), columns=names,
+                                copy=False)
+
+        if chunksize is None:
+            count_query = 'SELECT COUNT(*) FROM ({})'.format(sql_query)
+            numRows = con.execute(count_query).fetchone()[0]
+            arrays, _ = OpSimOutput._fill_arrays(cursor, numRows)
+            return frame(arrays)
+
+        def chunks():
+            while True:
+                arrays, numRows = OpSimOutput._fill_arrays(cursor, chunksize)
+                if numRows == 0:
+                    return
+                yield frame(arrays)
+        return chunks()
+
+    @staticmethod
+    def _rowid_ranges(con, tableName, numParts):
+        """Return a list of at most `numParts` tuples of the first and
+        last (excluded) rowid of ranges of similar numbers of rows of the
+        table `tableName`"""
+        lower, upper = con.execute('SELECT MIN(rowid), MAX(rowid) FROM '
+                                   '"{}"'.format(tableName)).fetchone()
+        if lower is None:
+            return []
+        edges = np.unique(np.linspace(lower, upper + 1, numParts + 1)
+                          .astype(np.int64))
+        return list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+
+    @staticmethod
+    def _read_partition(job):
+        """Read the results of the sql query of `job` on a new read-only
+        connection to the database of `job`, and return the names of the
+        columns and a list of arrays of each column"""
+        dbname, sql_query = job
+        con = OpSimOutput._get_connection(dbname, backend='sqlite3')
+        try:
+            count_query = 'SELECT COUNT(*) FROM ({})'.format(sql_query)
+            numRows = con.execute(count_query).fetchone()[0]
+            cursor = con.execute(sql_query)
+            names = list(desc[0] for desc in cursor.description)
+            arrays, _ = OpSimOutput._fill_arrays(cursor, numRows)
+        finally:
+            con.close()
+        return names, arrays
+
+    @staticmethod
+    def _concatenate_arrays(parts):
+        """Concatenate arrays of each column read from several partitions,
+        using the type of `_fill_arrays` for the values of all partitions"""
+        arrays = []
+        for col in zip(*parts):
+            col = list(arr for arr in col if len(arr) > 0)
+            if len(col) == 0:
+                arrays.append(np.empty(0))
+                continue
+            kinds = set(arr.dtype.kind for arr in col)
+            if 'O' in kinds:
+                dtype = object
+            elif 'f' in kinds:
+                dtype = np.float64
+            else:
+                dtype = col[0].dtype
+            arrays.append(np.concatenate(list(arr.astype(dtype, copy=False)
+                                              for arr in col)))
+        return arrays
+
+    @staticmethod
+    def _read_summary_partitioned(dbname, opsimVars, propIDs, subset,
+                                  columns=None, predicates=None,
+                                  read_workers=2, read_pool='process'):
+        """
+        Read the rows of the summary table of `subset` from the OpSim
+        database `dbname` by splitting the table into `read_workers` ranges
+        of rowid, each read into arrays on its own read-only connection in
+        a pool of processes or threads. The rows are in the order of the
+        table, and duplicate rows of shared visits are not dropped.
+
+        Parameters
+        ----------
+        dbname : string
+            absolute path to the database
+        opsimVars, propIDs, subset, columns, predicates :
+            same as in `_summary_query`
+        read_workers : int, defaults to 2
+            number of ranges of rows read concurrently
+        read_pool : {'process'|'thread'}, defaults to 'process'
+            kind of pool reading the ranges. Decoding rows holds the GIL, so
+            that only processes read rows in parallel, while threads avoid
+            sending the arrays between processes.
+        """
+        if read_pool == 'process':
+            poolClass = multiprocessing.Pool
+        elif read_pool == 'thread':
+            poolClass = ThreadPool
+        else:
+            raise ValueError('read_pool {} not recognized'.format(read_pool))
+        summaryTableName = opsimVars['summaryTableName']
+        con = OpSimOutput._get_connection(dbname, backend='sqlite3')
+        try:
+            ranges = OpSimOutput._rowid_ranges(con, summaryTableName,
+                                               read_workers)
+            if columns is None:
+                columns = OpSimOutput._get_table_columns(con,
+                                                         summaryTableName)
+        finally:
+            con.close()
+        if predicates is None:
+            predicates = []
+        if len(ranges) == 0:
+            ranges = [(0, 0)]
+        # A range of rowid is read from the table b-tree, which is faster
+        # than an index on the proposals for each range
+        jobs = list((dbname, OpSimOutput._summary_query(
+            opsimVars, propIDs, subset, columns=columns, orderBy=('rowid',),
+            notIndexed=True, predicates=list(predicates) +
+            ['rowid >= {0} AND rowid < {1}'.format(lower, upper)]))
+            for lower, upper in ranges)
+        print('reading {0} ranges of rows of {1} in a {2} pool'.format(
+            len(jobs), summaryTableName, read_pool))
+
+        if len(jobs) == 1:
+            results = list(map(OpSimOutput._read_partition, jobs))
+        else:
+            pool = poolClass(processes=min(read_workers, len(jobs)))
+            try:
+                results = pool.map(OpSimOutput._read_partition, jobs,
+                                   chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        names = results[0][0]
+        arrays = OpSimOutput._concatenate_arrays(list(arrays for _, arrays
+                                                      in results))
+        return pd.DataFrame(dict(zip(names, arrays)), columns=names,
+                            copy=False)
+
     @staticmethod
     def dropDuplicates(df, propIDDict, opsimversion):
         """
@@ -660,113 +1980,159 @@ class OpSimOutput(object):
         Returns
         -------
         `pd.DataFrame` with the correct propID and duplicates dropped
+
+        Notes
+        -----
+        Visits shared by several proposals appear once for each proposal.
+        For each `obsHistID`, the row belonging to a DDF proposal is kept if
+        there is one, otherwise the row belonging to a WFD proposal, and
+        otherwise the first row. The rows kept are ordered by `expMJD`.
         """
         if opsimversion == 'sstf':
             return df
 
-        # As duplicates are dropped in order, reorder IDs so that
-        # DDF is lowest, WFD next lowest, everything else as is
-        minPropID = df.propID.min()
-        ddfID = propIDDict['ddf']
-        wfdID = propIDDict['wfd']
-        ddfPropID = minPropID - 1
-        wfdPropID = minPropID - 2
-
-        orig_propID = df.propID.values
-        df['orig_propID'] = orig_propID
-        # if np.__version__ >= 1.13:
-        #    ddfmask = np.isin(df.propID, ddfID)
-        #    wfdmask = np.isin(df.propID, wfdID)
-        # else:
-        ddfmask = np.in1d(df.propID, ddfID)
-        wfdmask = np.in1d(df.propID, wfdID)
-
-        df.loc[ddfmask, 'propID'] = ddfPropID
-        df.loc[wfdmask, 'propID'] = wfdPropID
-
-        # drop duplicates keeping the lowest transformed propIDs so that all
-        # WFD visits remain, DDF visits which were duplicates of WFD visits are
-        # dropped, etc.
-
-        df = df.drop_duplicates(subset='obsHistID', keep='first', inplace=False)
-        #df = df.drop_duplicates(subset='obsHistID',
-        #                                      keep='first')#.set_index('obsHistID')
-
-        # reset the propIDs to values in the OpSim output
-        # ddfmask = df.propID == ddfPropID
-        # wfdmask = df.propID == wfdPropID
-        # df.loc[ddfmask, 'propID'] = ddfID
-        # df.loc[wfdmask, 'propID'] = wfdID
-        del df['propID']
-        df.rename(columns=dict(orig_propID='propID'), inplace=True)
-        df.sort_values(by='expMJD', inplace=True)
-        return df
+        keep = unique_visit_rows(df.obsHistID.values, df.propID.values,
+                                 df.expMJD.values, propIDDict)
 
+        # propID is the last column as in earlier versions
+        columns = list(df.columns)
+        columns.append(columns.pop(columns.index('propID')))
+        colidx = list(df.columns.get_loc(col) for col in columns)
+        return df.iloc[keep, colidx]
 
-    @classmethod
-    def _fromOpSimHDF(cls, hdfName, subset='combined',
-                     tableNames=('Summary', 'Proposal'),
-                     propIDs=None):
+    @staticmethod
+    def propIDPriority(propID, propIDDict):
         """
-        Construct an instance of a subset of the OpSim
-        Output from a serialization in the format of hdf
+        Return an array of priorities for choosing between rows of the same
+        visit: 0 for DDF, 1 for WFD and 2 for other proposals.
 
         Parameters
         ----------
-        hdfName :
-        subset :
-        tableNames :
-        propIDs :
+        propID : `np.ndarray` of integers
+            proposal IDs of rows
+        propIDDict : dict
+            dictionary with keys `ddf` and `wfd` and values the proposal IDs
+            of these proposals
         """
-        raise NotImplementedError('Not quite working at this moment')
-        allowed_subsets = cls.get_allowed_subsets()
-        subset = subset.lower()
-        if subset not in allowed_subsets:
-            raise NotImplementedError('subset {} not implemented'.\
-                      format(subset))
-        # The hdf representation is assumed to be a faithful representation of
-        # the OpSim output
-        summarydf = pd.read_hdf(hdfName, key='Summary')
+        return propID_priority(propID, propIDDict)
 
-        if 'obsHistID' not in summarydf.columns:
-            summarydf.reset_index(inplace=True)
-            if 'obsHistID' not in summarydf.columns:
-                raise NotImplementedError('obsHistID is not in columns')
+    @staticmethod
+    def _dedupInSQL(subset, opsimversion):
+        """Return `True` if duplicate rows of visits shared between
+        proposals should be dropped in the sql query rather than by
+        `dropDuplicates`. This requires window functions, which are
+        available in SQLite from version 3.25.
+        """
+        return subset in ('ddf', 'wfd', 'combined') and \
+            opsimversion != 'sstf' and \
+            sqlite3.sqlite_version_info >= (3, 25, 0)
 
-        try:
-            proposals = pd.read_hdf(hdfName, key='Proposal')
-            print('read in proposal')
-            propDict = cls.get_propIDDict(proposal)
-            print('read in proposal')
-            print(subset, propDict)
-            _propIDs = cls.propIDVals(subset, propDict, proposals)
-        except:
-            print('Proposal not read')
-            pass
-
-        propIDs = cls._overrideSubsetPropID(propIDs, _propIDs)
-
-        if propIDs is not None:
-            if not isinstance(propIDs, list):
-                propIDs = propIDs.tolist()
-            print('propIDs', propIDs, type(propIDs), type(propIDs[0]))
-            print('summarydf cols', summarydf.columns)
-            query_str = 'propID == @propIDs'
-            print('query_str', query_str)
-            print(' Num entries ', len(summarydf))
-            summary = summarydf.query(query_str)
-        else:
-            summary = summarydf
-        if propIDs is None and subset not in ('_all', 'unique_all'):
-            raise ValueError('No sensible propID and subset combination found')
 
-        if subset != '_all':
-            # Usually drop the OpSim duplicates
-            summary.drop_duplicates(subset='obsHistID', inplace=True)
+    @classmethod
+    def fromOpSimColumnar(cls, dirname, subset='combined', user_propIDs=None,
+                          night_range=None, filters=None, columns=None,
+                          zeroDDFDithers=True, dtype_profile=None,
+                          validation='fast'):
+        """
+        Instantiate the class from an OpSim output written out by
+        `writeOpSimColumnar`. Only the row groups which may have visits in
+        the proposals of `subset`, the range of nights and the filters
+        requested are read.
+
+        Parameters
+        ----------
+        dirname : string
+            absolute path to the directory written by `writeOpSimColumnar`
+        subset : string, optional, defaults to 'combined'
+            one of {'_all', 'unique_all', 'wfd', 'ddf', 'combined'}. Unless
+            the output was written with this subset, it must have been
+            written with the subset '_all'.
+        user_propIDs : sequence of integers, defaults to `None`
+            proposal ID values. If not `None`, overrides the use of subset
+        night_range : tuple of two integers, defaults to `None`
+            if not `None`, only read visits with `night` in the inclusive
+            range
+        filters : sequence of strings, defaults to `None`
+            if not `None`, only read visits in these filters, eg. ['g', 'r']
+        columns : sequence of strings, defaults to `None`
+            if not `None`, names of the columns of the summary table which
+            are required. The columns needed to drop duplicates and validate
+            the pointings are read as well.
+        zeroDDFDithers : Bool, defaults to `True`
+            if `True`, set dithers in DDF to 0 unless this was done before
+            the output was written
+        dtype_profile : {None|'compact'}, defaults to `None`
+            see the class constructor
+        validation : {'off'|'fast'|'full'}, defaults to 'fast'
+            see the class constructor
+
+        Returns
+        -------
+        instance of `OpSimOutput`
+
+        .. note:: With the subset '_all', dithers of WFD rows of visits
+            shared with DDF are set to 0 along with the DDF rows. Write out
+            instances with `zeroDDFDithers=False` so that subsets read have
+            the same dithers as from `fromOpSimDB`.
+        """
+        subset = subset.lower()
+        if subset not in cls.get_allowed_subsets():
+            raise NotImplementedError('subset {} not implemented'.\
+                                      format(subset))
+        with open(os.path.join(dirname, 'meta.json')) as fh:
+            meta = json.load(fh)
+        if subset != meta['subset'] and meta['subset'] != '_all':
+            raise ValueError('subset {0} cannot be read from an output '
+                             'written with subset {1}'.format(subset,
+                                                              meta['subset']))
+        opsimversion = meta['opsimversion']
+        propDict = dict()
+        for name, val in meta['propIDDict'].items():
+            propDict[name] = np.asarray(val) if isinstance(val, list) else val
+        proposals = read_columnar(os.path.join(dirname, 'proposals'))
+        proposals = proposals.reset_index(drop=True)
+
+        # Find the propIDs and push down the selections to the row groups
+        predicates = []
+        if user_propIDs is not None:
+            predicates.append(('propID', 'in', list(np.ravel(user_propIDs))))
+        elif subset in ('ddf', 'wfd', 'combined'):
+            propIDs = cls.propIDVals(subset, propDict, proposals)
+            predicates.append(('propID', 'in', propIDs))
+        if night_range is not None:
+            predicates += [('night', '>=', night_range[0]),
+                           ('night', '<=', night_range[1])]
+        if filters is not None:
+            predicates.append(('filter', 'in', list(filters)))
+
+        zeroDDFDithers = zeroDDFDithers and not meta['zeroDDFDithers']
+        if columns is not None:
+            required = ['expMJD', 'propID', 'ditheredRA', 'ditheredDec',
+                        'fiveSigmaDepth']
+            if zeroDDFDithers:
+                required += ['fieldRA', 'fieldDec']
+            columns = list(columns) + list(col for col in required
+                                           if col not in columns)
+            columns = list(col for col in meta['columns'] if col in columns)
+        summary = read_columnar(os.path.join(dirname, 'summary'),
+                                columns=columns, predicates=predicates)
+
+        # Drop duplicates as `fromOpSimDB` does if the output has them,
+        # with `propID` as the last column before `_ra` and `_dec`
+        if meta['subset'] == '_all' and subset != '_all' and \
+                opsimversion != 'sstf':
+            keep = unique_visit_rows(summary.index.values,
+                                     summary.propID.values,
+                                     summary.expMJD.values, propDict)
+            summary = summary[list(col for col in summary.columns
+                                   if col not in ('propID', '_ra', '_dec'))
+                              + ['propID']].take(keep)
 
-        summary.set_index('obsHistID', inplace=True)
         return cls(propIDDict=propDict, summary=summary,
-                   proposalTable=proposals, subset=subset)
+                   zeroDDFDithers=zeroDDFDithers, proposalTable=proposals,
+                   subset=subset, propIDs=user_propIDs,
+                   opsimversion=opsimversion, dtype_profile=dtype_profile,
+                   validation=validation)
 
     @property
     def propIds(self):
@@ -780,15 +2146,162 @@ class OpSimOutput(object):
         elif self.subset is not None and self.propIDDict is not None:
             return self.propIDVals(self.subset, self.propIDDict, self.proposalTable)
 
-    def _writeOpSimHDF(self, hdfName):
+    def subsetView(self, subset='combined', user_propIDs=None,
+                   zeroDDFDithers=None):
         """
-        Serialize the OpSim output to hdf format in a welldefined way
-        The output hdf file has two keys: 'Summary' and 'Proposal'
+        Return an `OpSimOutput` instance for the visits of `subset`, or of
+        the proposals `user_propIDs`, taken from the summary of this
+        instance rather than read from the database again. The visits,
+        their `propID` and pointings are the same as those of `fromOpSimDB`
+        with the same `subset` and `user_propIDs` and the options used to
+        read this instance.
+
+        Parameters
+        ----------
+        subset : string, defaults to 'combined'
+            one of {'_all', 'unique_all', 'wfd', 'ddf', 'combined'}
+        user_propIDs : sequence of integers, defaults to `None`
+            proposal ID values. If not `None`, overrides the use of subset
+        zeroDDFDithers : Bool, defaults to `None`
+            if `True`, set dithers in DDF to 0 as in the constructor. If
+            `None`, the value used for this instance. Dithers which have
+            been set to 0 in this instance cannot be restored.
+
+        Returns
+        -------
+        `OpSimOutput` instance whose summary has the rows of this summary
+        selected
+
+        .. note:: Visits shared between proposals are kept once, in the
+            row of the proposal with the highest priority (see
+            `dropDuplicates`). This is only possible if this instance has
+            the rows of all the visits required with the same priorities:
+            a summary of the subset '_all' can be used for any subset,
+            while other summaries can only be used for subsets whose
+            proposals are those of highest priority in the summary, eg.
+            'ddf' from 'combined', or 'combined' from 'unique_all'. A
+            `ValueError` is raised otherwise.
         """
-        if self.subset != '_all':
-            raise ValueError('Should be Done only for self.subset == _all')
-        self.summary.to_hdf(hdfName, key='Summary', append=False)
-        self.proposalTable.to_hdf(hdfName, key='Proposal', append=False)
+        subset = subset.lower()
+        if subset not in self.get_allowed_subsets():
+            raise NotImplementedError('subset {} not implemented'.\
+                                      format(subset))
+        if zeroDDFDithers is None:
+            zeroDDFDithers = self.zeroDDFDithers
+        elif self.zeroDDFDithers and not zeroDDFDithers:
+            raise ValueError('dithers in DDF have been set to zero')
+        propDict = self.propIDDict
+        allProposals = subset in ('_all', 'unique_all') and user_propIDs is None
+        if allProposals:
+            target = set(self.proposalTable[self.opsimVars['propIDName']]
+                         .values.tolist())
+        elif user_propIDs is not None:
+            target = set(np.asarray(user_propIDs).ravel().tolist())
+        else:
+            target = set(np.asarray(self.propIDVals(subset, propDict, None))
+                         .ravel().tolist())
+        self._checkSubsetView(subset, target)
+
+        summary = self.summary
+        propID = summary['propID'].values
+        rows = np.arange(len(summary)) if allProposals else \
+            np.flatnonzero(np.isin(propID, list(target)))
+        columns = list(col for col in summary.columns
+                       if col not in ('_ra', '_dec'))
+        if self.subset == '_all' and subset != '_all' and \
+                self.opsimversion != 'sstf':
+            keep = unique_visit_rows(np.asarray(summary.index.values)[rows],
+                                     propID[rows],
+                                     summary['expMJD'].values[rows],
+                                     propDict)
+            rows = rows[keep]
+            # propID is the last column after dropping duplicates
+            columns.append(columns.pop(columns.index('propID')))
+        colidx = list(summary.columns.get_loc(col) for col in columns)
+
+        # the pointings of this summary are already validated
+        return self.__class__(summary.iloc[rows, colidx],
+                              propIDDict=propDict,
+                              proposalTable=self.proposalTable,
+                              subset=subset, propIDs=user_propIDs,
+                              zeroDDFDithers=zeroDDFDithers,
+                              opsimversion=self.opsimversion,
+                              validation='off')
+
+    def _checkSubsetView(self, subset, target):
+        """Raise a `ValueError` if the visits of `subset` with the proposals
+        `target` cannot be taken from the summary, see `subsetView`"""
+        propDict = self.propIDDict
+        ddf = set(np.atleast_1d(propDict['ddf']).tolist())
+        if self.subset == '_all':
+            # dithers are set to zero in all the rows of visits in DDF
+            if self.zeroDDFDithers and not ddf <= target:
+                raise ValueError('dithers of visits shared with DDF proposals '
+                                 'were set to zero, read the subset _all '
+                                 'with zeroDDFDithers=False to take the '
+                                 'subset {} from it'.format(subset))
+            return
+        if subset == '_all' and self.opsimversion != 'sstf':
+            raise ValueError('subset _all can only be taken from the subset '
+                             '_all')
+
+        if self.subset == 'unique_all' and self._propID is None:
+            source = set(self.proposalTable[self.opsimVars['propIDName']]
+                         .values.tolist())
+        else:
+            source = set(np.asarray(self.propIds).ravel().tolist())
+        missing = target - source
+        if len(missing) > 0:
+            raise ValueError('subset {0} cannot be taken from the subset {1}, '
+                             'which does not have the visits of proposals '
+                             '{2}'.format(subset, self.subset,
+                                          sorted(missing)))
+        others = np.array(sorted(source - target), dtype=np.int64)
+        if self.opsimversion == 'sstf' or len(target) == 0 or \
+                len(others) == 0:
+            return
+        # rows of other proposals with the same or a higher priority may
+        # have been kept in place of rows of the proposals of `subset`
+        priority = propID_priority(np.array(sorted(target), dtype=np.int64),
+                                   propDict).max()
+        conflicts = others[propID_priority(others, propDict) <= priority]
+        if len(conflicts) > 0:
+            raise ValueError('subset {0} cannot be taken from the subset {1}, '
+                             'where visits shared with proposals {2} may only '
+                             'have their rows'.format(subset, self.subset,
+                                                      conflicts.tolist()))
+
+    def writeOpSimColumnar(self, dirname, partitionBy='propID',
+                           rowGroupSize=100000):
+        """
+        Write the summary and proposal tables to the directory `dirname` in
+        the columnar format of `write_columnar`, so that they can be read
+        by `fromOpSimColumnar`. To be able to read any subset, write an
+        instance with the subset '_all' and `zeroDDFDithers=False`.
+
+        Parameters
+        ----------
+        dirname : string
+            absolute path to a directory, created if it does not exist
+        partitionBy : {'propID'|'night'|None}, defaults to 'propID'
+            column by whose values the visits are stored in row groups.
+            'propID' lets subsets of proposals be read efficiently, and
+            'night' ranges of nights.
+        rowGroupSize : int, defaults to 100000
+            maximal number of visits in a row group
+        """
+        propDict = dict()
+        for name, val in self.propIDDict.items():
+            propDict[name] = np.asarray(val).tolist()
+        write_columnar(self.summary, os.path.join(dirname, 'summary'),
+                       partitionBy=partitionBy, rowGroupSize=rowGroupSize)
+        write_columnar(self.proposalTable, os.path.join(dirname, 'proposals'))
+        meta = dict(propIDDict=propDict, subset=self.subset,
+                    opsimversion=self.opsimversion,
+                    zeroDDFDithers=self.zeroDDFDithers,
+                    columns=list(self.summary.columns))
+        with open(os.path.join(dirname, 'meta.json'), 'w') as fh:
+            json.dump(meta, fh)
 
     @staticmethod
     def _overrideSubsetPropID(propIDs, _propIDs):
@@ -858,7 +2371,7 @@ class OpSimOutput(object):
 
         # To support multiple proposals
         for key in pdict:
-            if isinstance(pdict[key], collections.Iterable):
+            if isinstance(pdict[key], Iterable):
                 pdict[key] = pdict[key].values
 
         return pdict
@@ -900,49 +2413,9 @@ class OpSimOutput(object):
         # unroll lists
         l = list()
         for elem in x:
-            if isinstance(elem, collections.Iterable):
+            if isinstance(elem, Iterable):
                 for e in elem:
                     l.append(e)
             else:
                 l.append(elem)
         return l
-
-def OpSimDfFromFile(fname, ftype='hdf', subset='Combined'):
-    """
-    read a serialized form of the OpSim output into `pd.DataFrame`
-    and return a subset of interest
-
-    Parameters
-    ----------
-    fname : string, mandatory
-        absolute path to serialized form of the OpSim database
-    ftype : {'sqliteDB', 'ASCII', 'hdf'}
-        The kind of serialized version being read from.
-            'sqliteDB' : `LSST` project supplied OpSim output format for
-                baseline cadences (eg. enigma_1189, minion_1016, etc.) 
-            'ASCII' : `LSST` project supplied OpSim output format used in
-                older OpSim outputs eg. OpSim v 2.168 output
-            'hdf' : `hdf` files written out by `OpSimSummary`
-    subset : {'Combined', 'DDF', 'WFD' , 'All'}, defaults to 'Combined' 
-        Type of OpSim output desired in the dataframe
-        'Combined' : unique pointings in WFD + DDF 
-        'WFD' : Unique pointings in WFD
-        'DDF' : Unique pointings in DDF Cosmology
-        'All' : Entire Summary Table From OpSim
-    """
-    print('This seems to have changed since first written, fixing not a priority')
-    raise NotImplementedError('This seems to have changed since first written')
-    if ftype == 'sqlite':
-        dbname = 'sqlite:///' + fname
-        engine = create_engine(dbname, echo=False)
-        proposalTable =  pd.read_sql_table('Proposal', con=engine)
-
-        # if subset == 'DDF':
-        #    sql
-
-    elif ftype == 'hdf' :
-        pass
-    elif ftype == 'ASCII':
-        pass
-    else:
-        raise NotImplementedError('ftype {} not implemented'.format(ftype))
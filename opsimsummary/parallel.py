@@ -0,0 +1,158 @@
+"""
+Module to read many OpSim outputs concurrently, eg. to compare cadences of
+several baselines in a single job. Each OpSim database is read and
+normalized by `OpSimOutput.fromOpSimDB` in a pool of processes, which write
+the summaries to a `SummaryCache`. The summaries are then memory mapped from
+the cache rather than sent between processes, so that the time and memory
+taken to collect the results does not grow with the size of the summaries.
+"""
+from __future__ import division, print_function, absolute_import
+__all__ = ['load_many']
+import os
+import sys
+import time
+import shutil
+import tempfile
+import multiprocessing
+import pandas as pd
+from .opsim_out import OpSimOutput
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def _max_rss():
+    """peak resident memory of the process in MB, or `None` if this is not
+    available"""
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kB elsewhere
+    if sys.platform == 'darwin':
+        return maxrss / 1.0e6
+    return maxrss / 1.0e3
+
+
+def _load_run(job):
+    """Read the OpSim database of `job` into the summary cache, and return a
+    dictionary of statistics of the read"""
+    dbname, cache_dir, options = job
+    tstart = time.time()
+    opsout = OpSimOutput._fromSummaryCache(cache_dir, dbname, **options)
+    readSeconds = time.time() - tstart
+    summary = opsout.summary
+    return dict(dbname=dbname, opsimversion=options['opsimversion'],
+                subset=options['subset'], numVisits=len(summary),
+                pid=os.getpid(), readSeconds=readSeconds,
+                normalizeSeconds=sum(opsout.normalizationTimings.values()),
+                summaryMB=summary.memory_usage(deep=True).sum() / 1.0e6,
+                maxRSSMB=_max_rss())
+
+
+def _per_run(value, num, name):
+    """Return a list of `num` values of the parameter `name`, given a
+    single value or a sequence of values"""
+    if isinstance(value, str):
+        return [value] * num
+    value = list(value)
+    if len(value) != num:
+        raise ValueError('{0} must be a string or a sequence of the same '
+                         'length as dbpaths'.format(name))
+    return value
+
+
+def load_many(dbpaths, opsimversion='lsstv3', subset='combined',
+              max_workers=None, cache_dir=None, mmap_mode='r', **kwargs):
+    """
+    Read many OpSim databases concurrently in a pool of processes.
+
+    Parameters
+    ----------
+    dbpaths : sequence of strings
+        absolute paths to the OpSim databases
+    opsimversion : string or sequence of strings, defaults to 'lsstv3'
+        version of OpSim of all the databases, or of each database, see
+        `OpSimOutput.fromOpSimDB`
+    subset : string or sequence of strings, defaults to 'combined'
+        subset read from all the databases, or from each database
+    max_workers : int, defaults to `None`
+        number of processes used. If `None`, the number of cpus. If 1, the
+        databases are read one after another in this process.
+    cache_dir : string, defaults to `None`
+        absolute path to the directory of the `SummaryCache` used to hold
+        the summaries. Databases with an entry for the same options are
+        not read again. If `None`, a temporary directory is used and
+        removed once the summaries are memory mapped.
+    mmap_mode : {None|'r'|'c'}, defaults to 'r'
+        if not `None`, the numeric columns of the summaries are memory
+        mapped from the cache, see `read_columnar`
+    kwargs :
+        other parameters of `OpSimOutput.fromOpSimDB` used for all the
+        databases, eg. `filterNull`, `columns`, `dtype_profile`
+
+    Returns
+    -------
+    tuple of a list of `OpSimOutput` instances in the order of `dbpaths`,
+    and a `pd.DataFrame` of statistics of each read with the columns
+    `dbname`, `opsimversion`, `subset`, `numVisits`, `pid` (of the process
+    reading the database), `readSeconds` (time taken to read and normalize
+    the database and write it to the cache), `normalizeSeconds`,
+    `summaryMB` (memory used by the summary), `maxRSSMB` (peak resident
+    memory of the process reading the database, `None` if the database is
+    read in this process), and `mapSeconds` (time taken to memory map the
+    summary from the cache).
+
+    .. note:: With more than one worker, each database is read in a new
+        process, so that `maxRSSMB` is the peak memory of a single read.
+        Databases read in this process, if `max_workers` is 1 or there is a
+        single database, have no `maxRSSMB`, since the peak memory of this
+        process includes earlier reads. With a temporary `cache_dir`,
+        the cache files are removed while memory mapped, which is only
+        possible on POSIX systems, and are otherwise left in the temporary
+        directory.
+    """
+    dbpaths = list(dbpaths)
+    num = len(dbpaths)
+    versions = _per_run(opsimversion, num, 'opsimversion')
+    subsets = _per_run(subset, num, 'subset')
+
+    tmpdir = None
+    if cache_dir is None:
+        tmpdir = cache_dir = tempfile.mkdtemp(prefix='opsimsummary_load_')
+    jobs = list((dbname, cache_dir,
+                 dict(kwargs, opsimversion=version, subset=sub.lower()))
+                for dbname, version, sub in zip(dbpaths, versions, subsets))
+
+    if max_workers is None:
+        max_workers = multiprocessing.cpu_count()
+    max_workers = min(max_workers, num)
+    try:
+        if max_workers <= 1:
+            stats = list(_load_run(job) for job in jobs)
+            # the peak memory of this process is not that of a single read
+            for runstats in stats:
+                runstats['maxRSSMB'] = None
+        else:
+            # a new process for each database releases its memory
+            pool = multiprocessing.Pool(processes=max_workers,
+                                        maxtasksperchild=1)
+            try:
+                stats = pool.map(_load_run, jobs, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+
+        outputs = []
+        for (dbname, _, options), runstats in zip(jobs, stats):
+            tstart = time.time()
+            outputs.append(OpSimOutput._fromSummaryCache(cache_dir, dbname,
+                                                         mmap_mode=mmap_mode,
+                                                         **options))
+            runstats['mapSeconds'] = time.time() - tstart
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    return outputs, pd.DataFrame(stats)
@@ -0,0 +1,412 @@
+"""
+Module providing a pipeline of stages used to normalize summary tables read
+from OpSim databases into the form of `OpSimOutput.summary`. Stages act on a
+`PipelineState` holding the columns of the table and a pending selection of
+rows, so that filtering and dropping duplicates only compute row indices, and
+each column is gathered a single time when the pipeline is done. The time
+taken by each stage is recorded.
+"""
+from __future__ import division, print_function, absolute_import
+__all__ = ['NormalizationPipeline', 'PipelineState', 'Stage', 'FilterNull',
+           'RenameColumns', 'DropDuplicateVisits', 'SetIndex', 'JoinColumns',
+           'JoinDithers', 'ComputeColumns', 'ZeroDDFDithers', 'RadianCoordinates']
+import time
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+
+def propID_priority(propID, propIDDict):
+    """
+    Return an array of priorities for choosing between rows of the same
+    visit: 0 for DDF, 1 for WFD and 2 for other proposals.
+
+    Parameters
+    ----------
+    propID : `np.ndarray` of integers
+        proposal IDs of rows
+    propIDDict : dict
+        dictionary with keys `ddf` and `wfd` and values the proposal IDs
+        of these proposals
+    """
+    priority = np.full(len(propID), 2, dtype=np.int8)
+    priority[np.isin(propID, propIDDict['wfd'])] = 1
+    priority[np.isin(propID, propIDDict['ddf'])] = 0
+    return priority
+
+
+def unique_visit_rows(obsHistID, propID, expMJD, propIDDict):
+    """
+    Return the indices of the rows kept for each visit, preferring DDF rows
+    to WFD rows to other rows, and the first row otherwise, ordered by
+    `expMJD`.
+
+    Parameters
+    ----------
+    obsHistID : `np.ndarray` of integers
+        visit IDs of rows
+    propID : `np.ndarray` of integers
+        proposal IDs of rows
+    expMJD : `np.ndarray` of floats
+        MJD of rows
+    propIDDict : dict
+        dictionary with keys `ddf` and `wfd` and values the proposal IDs
+        of these proposals
+    """
+    priority = propID_priority(propID, propIDDict)
+
+    # lexsort is stable, so within the same obsHistID and priority, rows
+    # remain in their original order
+    order = np.lexsort((priority, obsHistID))
+    ids = obsHistID[order]
+    first = np.ones(len(ids), dtype=bool)
+    first[1:] = ids[1:] != ids[:-1]
+    keep = order[first]
+    return keep[np.argsort(expMJD[keep], kind='mergesort')]
+
+
+class PipelineState(object):
+    """
+    Columns of a table with a pending selection of rows.
+
+    Parameters
+    ----------
+    frame : `pd.DataFrame`
+        table whose columns are used without copying
+    """
+    def __init__(self, frame):
+        self.frame = frame
+        # output column names and names of the source columns in `frame`
+        self.sources = OrderedDict((col, col) for col in frame.columns)
+        # values of columns for the selected rows
+        self.values = dict()
+        self.modified = []
+        self.rows = None
+        self.indexColumn = None
+
+    @property
+    def columns(self):
+        """names of the columns, excluding the index"""
+        return list(col for col in self.sources if col != self.indexColumn)
+
+    def __contains__(self, name):
+        return name in self.sources
+
+    def column(self, name):
+        """Return the values of the column `name` for the selected rows"""
+        if name not in self.values:
+            values = self.frame[self.sources[name]].values
+            if self.rows is not None:
+                values = values.take(self.rows)
+            self.values[name] = values
+        return self.values[name]
+
+    def index(self):
+        """Return the index values for the selected rows"""
+        if self.indexColumn is not None:
+            return self.column(self.indexColumn)
+        index = self.frame.index
+        return index if self.rows is None else index.take(self.rows)
+
+    def indexName(self):
+        """name of the index"""
+        if self.indexColumn is not None:
+            return self.indexColumn
+        return self.frame.index.name
+
+    def select(self, rows):
+        """Select the rows `rows` (integer positions) of the current
+        selection"""
+        self.rows = rows if self.rows is None else self.rows.take(rows)
+        for name in self.values:
+            self.values[name] = self.values[name].take(rows)
+
+    def set(self, name, values):
+        """Set the column `name` to `values` for the selected rows, adding
+        it at the end if it does not exist"""
+        if name not in self.sources:
+            self.sources[name] = None
+        self.values[name] = values
+        if name not in self.modified:
+            self.modified.append(name)
+
+    def drop(self, name):
+        """drop the column `name`"""
+        del self.sources[name]
+        self.values.pop(name, None)
+        if name in self.modified:
+            self.modified.remove(name)
+
+    def rename(self, mapping):
+        """rename columns from the keys of `mapping` to its values"""
+        self.sources = OrderedDict((mapping.get(name, name), source)
+                                   for name, source in self.sources.items())
+        self.values = dict((mapping.get(name, name), values)
+                           for name, values in self.values.items())
+        self.modified = list(mapping.get(name, name)
+                             for name in self.modified)
+
+    def moveToEnd(self, name):
+        """move the column `name` to the end"""
+        self.sources.move_to_end(name)
+
+    def toFrame(self):
+        """Return a new `pd.DataFrame` gathering every column once"""
+        columns = self.columns
+        data = OrderedDict((name, self.column(name)) for name in columns)
+        index = pd.Index(self.index(), name=self.indexName())
+        return pd.DataFrame(data, index=index, columns=columns, copy=False)
+
+    def assignTo(self, frame):
+        """Assign the columns that have been set to the `pd.DataFrame`
+        `frame`, which must have the same rows"""
+        for name in self.modified:
+            frame[name] = self.values[name]
+        return frame
+
+
+class Stage(object):
+    """
+    Base class for stages of a `NormalizationPipeline`. Subclasses
+    implement `apply` modifying a `PipelineState`.
+    """
+    name = 'stage'
+
+    def apply(self, state):
+        raise NotImplementedError('must be implemented in subclasses')
+
+
+class FilterNull(Stage):
+    """Select rows where the column `column` is finite"""
+    name = 'filterNull'
+
+    def __init__(self, column='fiveSigmaDepth'):
+        self.column = column
+
+    def apply(self, state):
+        mask = np.isfinite(state.column(self.column))
+        print('This option reduced the number of rows from {0} to {1}'.format(
+            len(mask), mask.sum()))
+        if not mask.all():
+            state.select(np.flatnonzero(mask))
+
+
+class RenameColumns(Stage):
+    """Rename columns from the keys to the values of `mapping`"""
+    name = 'rename'
+
+    def __init__(self, mapping):
+        self.mapping = mapping
+
+    def apply(self, state):
+        state.rename(self.mapping)
+
+
+class DropDuplicateVisits(Stage):
+    """
+    Keep a single row for each `obsHistID`, preferring DDF to WFD to other
+    proposals, ordered by `expMJD`, as in `OpSimOutput.dropDuplicates`. If
+    `deduplicated`, the rows have already been selected in the database
+    query. In both cases, `propID` is moved to the last column.
+    """
+    name = 'dropDuplicates'
+
+    def __init__(self, propIDDict, deduplicated=False):
+        self.propIDDict = propIDDict
+        self.deduplicated = deduplicated
+
+    def apply(self, state):
+        if not self.deduplicated:
+            keep = unique_visit_rows(state.column('obsHistID'),
+                                     state.column('propID'),
+                                     state.column('expMJD'),
+                                     self.propIDDict)
+            state.select(keep)
+        state.moveToEnd('propID')
+
+
+class SetIndex(Stage):
+    """Use the column `column` as the index"""
+    name = 'setIndex'
+
+    def __init__(self, column='obsHistID'):
+        self.column = column
+
+    def apply(self, state):
+        state.indexColumn = self.column
+
+
+class JoinColumns(Stage):
+    """
+    Add the columns of `frame` for the rows with the same index values,
+    replacing the columns `replace` if they exist, like a left join.
+    `frame` must have unique index values.
+    """
+    name = 'join'
+
+    def __init__(self, frame, replace=(), name=None):
+        self.frame = frame
+        self.replace = replace
+        if name is not None:
+            self.name = name
+
+    def apply(self, state):
+        for col in self.replace:
+            if col in state:
+                state.drop(col)
+        overlap = list(col for col in self.frame.columns if col in state)
+        if len(overlap) > 0:
+            raise ValueError('columns overlap: {}'.format(overlap))
+        joined = self.frame.reindex(state.index())
+        for col in joined.columns:
+            state.set(col, joined[col].values)
+
+
+class JoinDithers(Stage):
+    """
+    Add the columns `ditheredRA` and `ditheredDec` from the `DitherTable`
+    `table` for the rows with the same index values, replacing them if they
+    exist. Rows are matched by `np.searchsorted` on the sorted `obsHistID`
+    of the table, and a `ValueError` is raised if any row has no dithers.
+    """
+    name = 'joinDithers'
+
+    def __init__(self, table, name=None):
+        self.table = table
+        if name is not None:
+            self.name = name
+
+    def apply(self, state):
+        ra, dec = self.table.join(state.index())
+        for col, values in (('ditheredRA', ra), ('ditheredDec', dec)):
+            if col in state:
+                state.drop(col)
+            state.set(col, values)
+
+
+class ComputeColumns(Stage):
+    """
+    Add the columns `outputs` of the `pd.DataFrame` returned by `func` when
+    called with a `pd.DataFrame` of the columns `inputs`, replacing the
+    columns `replace` if they exist.
+    """
+    name = 'compute'
+
+    def __init__(self, func, inputs, outputs, replace=(), name=None):
+        self.func = func
+        self.inputs = inputs
+        self.outputs = outputs
+        self.replace = replace
+        if name is not None:
+            self.name = name
+
+    def apply(self, state):
+        frame = pd.DataFrame(OrderedDict((col, state.column(col))
+                                         for col in self.inputs),
+                             index=pd.Index(state.index(),
+                                            name=state.indexName()))
+        result = self.func(frame)
+        for col in self.replace:
+            if col in state:
+                state.drop(col)
+        for col in self.outputs:
+            state.set(col, result[col].values)
+
+
+class ZeroDDFDithers(Stage):
+    """
+    Set the dithered coordinates of visits in the DDF proposals
+    `ddfPropID` to the field coordinates. If the index is not unique, all
+    rows with the index of a DDF row are changed.
+    """
+    name = 'zeroDDFDithers'
+
+    def __init__(self, ddfPropID):
+        self.ddfPropID = ddfPropID
+
+    def apply(self, state):
+        mask = np.isin(state.column('propID'), self.ddfPropID)
+        if not mask.any():
+            return
+        index = np.asarray(state.index())
+        if not pd.Index(index).is_unique:
+            mask = np.isin(index, index[mask])
+        for dithered, field in (('ditheredRA', 'fieldRA'),
+                                ('ditheredDec', 'fieldDec')):
+            state.set(dithered, np.where(mask, state.column(field),
+                                         state.column(dithered)))
+
+
+class RadianCoordinates(Stage):
+    """
+    Add the columns `_ra` and `_dec` with the dithered coordinates in
+    radians, given the unit `angleUnit` of the dithered coordinates.
+    """
+    name = 'radians'
+
+    def __init__(self, angleUnit):
+        if angleUnit not in ('degrees', 'radians'):
+            raise ValueError('angle unit of ra and dec Columns not recognized\n')
+        self.angleUnit = angleUnit
+
+    def apply(self, state):
+        for col, dithered in (('_ra', 'ditheredRA'), ('_dec', 'ditheredDec')):
+            values = state.column(dithered)
+            if self.angleUnit == 'degrees':
+                state.set(col, np.radians(values))
+            else:
+                state.set(col, values.copy())
+
+
+class NormalizationPipeline(object):
+    """
+    Sequence of stages applied to a `pd.DataFrame`.
+
+    Parameters
+    ----------
+    stages : sequence of `Stage` instances
+        stages applied in order
+
+    Attributes
+    ----------
+    timings : `OrderedDict`
+        time in seconds taken by each stage, and by gathering the result
+        (`materialize`), in the last call to `run`
+    """
+    def __init__(self, stages):
+        self.stages = list(stages)
+        self.timings = OrderedDict()
+
+    def run(self, frame, inplace=False):
+        """
+        Apply the stages to `frame`.
+
+        Parameters
+        ----------
+        frame : `pd.DataFrame`
+            table to which the stages are applied
+        inplace : Bool, defaults to `False`
+            if `True`, set the columns computed by the stages in `frame`,
+            which is only possible if no stage selects rows or changes the
+            index. Otherwise, return a new `pd.DataFrame`.
+
+        Returns
+        -------
+        `pd.DataFrame`
+        """
+        self.timings = OrderedDict()
+        state = PipelineState(frame)
+        for stage in self.stages:
+            tstart = time.time()
+            stage.apply(state)
+            self.timings[stage.name] = time.time() - tstart
+
+        tstart = time.time()
+        if inplace:
+            if state.rows is not None or state.indexColumn is not None:
+                raise ValueError('stages changing rows cannot be run inplace')
+            frame = state.assignTo(frame)
+        else:
+            frame = state.toFrame()
+        self.timings['materialize'] = time.time() - tstart
+        return frame
@@ -0,0 +1,274 @@
+"""
+Module to compute statistics of the visits covering HEALPix pixels in each
+filter, eg. the coadded depth, the median seeing or the number of nights.
+The statistics are computed from the visits of each pixel, given as CSR
+arrays (see `HealPixelizedOpSim`) or found with a `PointingTree`, with
+reductions over segments of sorted arrays of the visits of all the pixels.
+"""
+from __future__ import division, print_function, absolute_import
+__all__ = ['defaultReducers', 'aggregateVisits', 'pixelStatistics',
+           'statisticsMaps']
+import time
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import numpy as np
+import pandas as pd
+import healpy as hp
+from .coverage import pixelCenters, footprintPixels
+
+# name of the statistic: (column of the visits, reduction)
+defaultReducers = {'numVisits': (None, 'count'),
+                   'coaddedDepth': ('fiveSigmaDepth', 'coadd'),
+                   'medianFWHMeff': ('FWHMeff', 'median'),
+                   'firstMJD': ('expMJD', 'min'),
+                   'lastMJD': ('expMJD', 'max'),
+                   'numNights': ('night', 'nunique')}
+
+_reductions = ('count', 'sum', 'mean', 'min', 'max', 'median', 'nunique',
+               'coadd')
+
+
+def _checkReducers(reducers, columns):
+    """Raise a `ValueError` if the `reducers` are not valid for visits with
+    `columns`"""
+    for name, (col, reduction) in reducers.items():
+        if reduction not in _reductions:
+            raise ValueError('reduction {0} of {1} must be one of {2}'.format(
+                reduction, name, _reductions))
+        if reduction != 'count' and col not in columns:
+            raise ValueError('column {0} of {1} not in the visits'.format(
+                col, name))
+
+
+def _segmentMedians(values, starts, lengths):
+    """medians of segments of `values` sorted within each segment"""
+    lo = starts + (lengths - 1) // 2
+    hi = starts + lengths // 2
+    return 0.5 * (values[lo] + values[hi])
+
+
+def aggregateVisits(visits, hids, indptr, rows, reducers=None,
+                    filterCol='filter'):
+    """
+    Return a `pd.DataFrame` with the statistics of the visits covering each
+    pixel in each filter.
+
+    Parameters
+    ----------
+    visits : `pd.DataFrame`
+        visits with the columns used by `reducers` and `filterCol`
+    hids : `np.ndarray` of int
+        ids of the pixels
+    indptr : `np.ndarray` of int
+        the visits covering `hids[i]` are `rows[indptr[i]:indptr[i+1]]`
+    rows : `np.ndarray` of int
+        row offsets of the visits in `visits`
+    reducers : dict, defaults to `None`
+        dictionary whose keys are the names of the statistics, and values
+        are tuples of a column of `visits` and a reduction, one of
+        {'count'|'sum'|'mean'|'min'|'max'|'median'|'nunique'|'coadd'}, where
+        'coadd' is the coadded depth `1.25 log10(sum(10**(0.8 m5)))` of
+        the five sigma depths `m5`. If `None`, `defaultReducers`.
+    filterCol : string, defaults to 'filter'
+        column of the filter of the visits
+
+    Returns
+    -------
+    `pd.DataFrame` with a row for each pixel and filter with visits, sorted
+    by `hid` and `filter`, with the columns `hid`, `filter` and the
+    statistics.
+    """
+    if reducers is None:
+        reducers = defaultReducers
+    _checkReducers(reducers, visits.columns)
+    filters = pd.Categorical(visits[filterCol].values)
+    return _aggregate(visits, filters, _ranks(visits, reducers), hids,
+                      indptr, rows, reducers)
+
+
+def _ranks(visits, reducers):
+    """Return a dictionary of the ranks of the visits in the columns whose
+    reductions require sorted values"""
+    ranks = dict()
+    for col, reduction in reducers.values():
+        if reduction in ('median', 'nunique') and col not in ranks:
+            rank = np.empty(len(visits), dtype=np.int64)
+            rank[np.argsort(visits[col].values)] = np.arange(len(visits))
+            ranks[col] = rank
+    return ranks
+
+
+def _aggregate(visits, filters, ranks, hids, indptr, rows, reducers):
+    """`aggregateVisits` with the filters of the visits as the categorical
+    `filters`, and the ranks of the visits computed by `_ranks`"""
+    rows = np.asarray(rows, dtype=np.intp)
+    lengths = np.diff(indptr)
+    pixpos = np.repeat(np.arange(len(hids), dtype=np.int64), lengths)
+    codes = np.asarray(filters.codes)[rows]
+
+    # segments of the visits of each (pixel, filter)
+    segkeys = pixpos * len(filters.categories) + codes
+    order = np.argsort(segkeys, kind='stable')
+    keys = segkeys[order]
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    if len(rows) == 0:
+        starts = np.zeros(0, dtype=np.intp)
+    seglengths = np.diff(np.concatenate((starts, [len(rows)])))
+    segpix = pixpos[order][starts]
+    segcodes = codes[order][starts]
+
+    stats = dict(hid=np.asarray(hids)[segpix],
+                 filter=np.asarray(filters.categories)[segcodes])
+    for name, (col, reduction) in reducers.items():
+        if reduction == 'count':
+            stats[name] = seglengths
+            continue
+        if len(rows) == 0:
+            stats[name] = np.zeros(0)
+            continue
+        values = visits[col].values[rows]
+        if reduction in ('median', 'nunique'):
+            # sorted by value within the same segments, the ranks of the
+            # visits are unique
+            vorder = np.argsort(segkeys * len(visits) + ranks[col][rows])
+            vals = values[vorder]
+            if reduction == 'median':
+                stats[name] = _segmentMedians(vals.astype(np.float64), starts,
+                                              seglengths)
+            else:
+                new = np.concatenate(([True], vals[1:] != vals[:-1]))
+                new[starts] = True
+                stats[name] = np.add.reduceat(new.astype(np.intp), starts)
+            continue
+
+        vals = values[order].astype(np.float64)
+        if reduction == 'sum':
+            stats[name] = np.add.reduceat(vals, starts)
+        elif reduction == 'mean':
+            stats[name] = np.add.reduceat(vals, starts) / seglengths
+        elif reduction == 'min':
+            stats[name] = np.minimum.reduceat(vals, starts)
+        elif reduction == 'max':
+            stats[name] = np.maximum.reduceat(vals, starts)
+        elif reduction == 'coadd':
+            stats[name] = 1.25 * np.log10(np.add.reduceat(10.**(0.8 * vals),
+                                                          starts))
+    return pd.DataFrame(stats, columns=['hid', 'filter'] + list(reducers))
+
+
+def _blockStatistics(job):
+    """Return the statistics of the pixels of a block of `job`"""
+    (tree, visits, filters, ranks, hids, radius, reducers, nside, nest,
+     workers) = job
+    ra, dec = pixelCenters(nside, nest)
+    X = np.column_stack((np.radians(dec[hids]), np.radians(ra[hids])))
+    inds = tree.query_radius(X, radius, workers=workers)
+    lengths = np.fromiter((len(ind) for ind in inds), dtype=np.intp,
+                          count=len(inds))
+    indptr = np.concatenate(([0], np.cumsum(lengths)))
+    rows = np.concatenate(list(inds) + [np.zeros(0, dtype=np.intp)])
+    return _aggregate(visits, filters, ranks, hids, indptr, rows, reducers)
+
+
+def pixelStatistics(pointingTree, visits, nside=256, nest=True, radius=1.75,
+                    reducers=None, filterCol='filter', coarseNside=64,
+                    blockSize=16384, workers=None):
+    """
+    Return a `pd.DataFrame` with the statistics of the visits within
+    `radius` of the centers of HEALPix pixels in each filter, see
+    `aggregateVisits`.
+
+    Parameters
+    ----------
+    pointingTree : `PointingTree`
+        tree of the pointings of `visits`
+    visits : `pd.DataFrame`
+        visits in the same order as the pointings of `pointingTree`
+    nside : int, defaults to 256
+        `NSIDE` of the pixelization
+    nest : Bool, defaults to `True`
+        if `True` use the `nest` ordering, else `ring`
+    radius : float, degrees, defaults to 1.75
+        radius of the field of view
+    reducers : dict, defaults to `None`
+        statistics computed, see `aggregateVisits`
+    filterCol : string, defaults to 'filter'
+        column of the filter of the visits
+    coarseNside : int, defaults to 64
+        `NSIDE` of the coarse pixelization used by `footprintPixels`
+    blockSize : int, defaults to 16384
+        number of pixels whose statistics are computed together
+    workers : int, defaults to `None`
+        number of threads computing blocks of pixels, if `None` the number
+        of cpus
+    """
+    tstart = time.time()
+    if reducers is None:
+        reducers = defaultReducers
+    _checkReducers(reducers, visits.columns)
+    filters = pd.Categorical(visits[filterCol].values)
+    ranks = _ranks(visits, reducers)
+    pra, pdec = pointingTree.raDec
+    hids = footprintPixels(pra, pdec, radius, nside, nest=nest,
+                           coarseNside=coarseNside)
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    jobs = list((pointingTree, visits, filters, ranks,
+                 hids[start:start + blockSize],
+                 np.radians(radius), reducers, nside, nest,
+                 1 if workers > 1 else None)
+                for start in range(0, len(hids), blockSize))
+    if workers > 1 and len(jobs) > 1:
+        pool = ThreadPool(processes=min(workers, len(jobs)))
+        try:
+            tables = pool.map(_blockStatistics, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        tables = list(_blockStatistics(job) for job in jobs)
+    if len(tables) == 0:
+        tables = [_aggregate(visits, filters, ranks, hids,
+                             np.zeros(1, dtype=np.intp),
+                             np.zeros(0, dtype=np.intp), reducers)]
+    stats = pd.concat(tables, ignore_index=True)
+    print('computed statistics of {0} pixels in {1:.1f} s'.format(
+        stats.hid.nunique(), time.time() - tstart))
+    return stats
+
+
+def statisticsMaps(stats, nside, names=None):
+    """
+    Return dense HEALPix maps of the statistics of pixels returned by
+    `aggregateVisits` or `pixelStatistics`.
+
+    Parameters
+    ----------
+    stats : `pd.DataFrame`
+        statistics with the columns `hid` and `filter`
+    nside : int
+        `NSIDE` of the pixels `hid`
+    names : sequence of strings, defaults to `None`
+        names of the statistics, if `None` all the columns of `stats` other
+        than `hid` and `filter`
+
+    Returns
+    -------
+    dictionary whose keys are the names of the statistics, and values
+    dictionaries of the maps for each filter, with the value `hp.UNSEEN`
+    for pixels without visits in the filter. The maps are in the ordering
+    of `hid`.
+    """
+    if names is None:
+        names = list(col for col in stats.columns
+                     if col not in ('hid', 'filter'))
+    npix = hp.nside2npix(nside)
+    maps = dict((name, dict()) for name in names)
+    for band, df in stats.groupby('filter', sort=True):
+        hids = df.hid.values
+        for name in names:
+            hmap = np.full(npix, hp.UNSEEN)
+            hmap[hids] = df[name].values
+            maps[name][band] = hmap
+    return maps
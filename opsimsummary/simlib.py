@@ -145,7 +145,11 @@ class SimlibMixin(object):
         # reasonable guess that columns have not been added
         if 'simLibSkySig' not in opsimtable.columns:
             df  = self.add_simlibCols(opsimtable, pixelSize=self.pixelSize)
-            df['filter'] = list(map(self._capitalizeY, opsimtable['filter']))
+            if isinstance(opsimtable['filter'].dtype, pd.CategoricalDtype):
+                # map the categories rather than every row
+                df['filter'] = opsimtable['filter'].map(self._capitalizeY)
+            else:
+                df['filter'] = list(map(self._capitalizeY, opsimtable['filter']))
         else:
             df = opsimtable
         return df
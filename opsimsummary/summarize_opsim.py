@@ -9,8 +9,12 @@ import pandas as pd
 from sqlalchemy import create_engine
 import matplotlib.pyplot as plt
 from sklearn.neighbors import BallTree
+from scipy.spatial import cKDTree
 import healpy as hp
 from .opsim_out import OpSimOutput
+from .columnar import write_columnar, read_columnar
+from .coverage import pixelCenters, visitCounts, hierarchicalCounts
+from .pixelstats import pixelStatistics, statisticsMaps
 from .trig import (convertToSphericalCoordinates,
                    convertToCelestialCoordinates,
                    angSep)
@@ -26,7 +30,8 @@ class SynOpSim(object):
                  angleUnit='degrees',
                  indexCol='obsHistID',
                  usePointingTree=False,
-                 subset='None'):
+                 subset='None',
+                 pointingTreeBackend='balltree'):
 
         self.pointings = pointings
         self.raCol = raCol
@@ -36,7 +41,78 @@ class SynOpSim(object):
         self.subset = subset
 
         self.usePointingTree = usePointingTree
+        self.pointingTreeBackend = pointingTreeBackend
         self._pointingTree = None
+        self._memmapDir = None
+
+    # Columns of the pointings needed for simlibs and coverage
+    memmapColumns = ('_ra', '_dec', 'expMJD', 'filter', 'fiveSigmaDepth',
+                     'FWHMeff', 'filtSkyBrightness')
+
+    def writeMemmap(self, dirname, columns=None):
+        """
+        Write the pointings to the directory `dirname` as one `.npy` file per
+        column, so that they may be memory mapped with `fromMemmap`. The
+        `filter` column is stored as integer codes.
+
+        Parameters
+        ----------
+        dirname : string
+            absolute path to the output directory
+        columns : sequence of strings, defaults to `None`
+            columns of `self.pointings` to write out in addition to the
+            index. If `None`, `self.memmapColumns` is used.
+        """
+        if columns is None:
+            columns = list(col for col in self.memmapColumns
+                           if col in self.pointings.columns)
+        df = self.pointings[list(columns)]
+        if 'filter' in df.columns:
+            df = df.assign(filter=pd.Categorical(df['filter']))
+        meta = dict(raCol=self.raCol, decCol=self.decCol,
+                    angleUnit=self.angleUnit, indexCol=self.indexCol,
+                    subset=self.subset)
+        write_columnar(df, dirname, meta=meta)
+
+    @classmethod
+    def fromMemmap(cls, dirname, usePointingTree=False,
+                   pointingTreeBackend='balltree'):
+        """
+        Instantiate a read-only `SynOpSim` whose pointings are memory mapped
+        from a directory written by `writeMemmap`. Processes using such
+        instances share the same pages of the files, and pickling the
+        instance (eg. to send it to a worker process) only sends `dirname`.
+
+        Parameters
+        ----------
+        dirname : string
+            absolute path to the directory written by `writeMemmap`
+        usePointingTree : Bool, defaults to `False`
+            whether to use a `PointingTree`
+        pointingTreeBackend : {'balltree'|'kdtree3d'}, defaults to 'balltree'
+            backend of the `PointingTree`
+        """
+        pointings, meta = read_columnar(dirname, mmap_mode='r',
+                                        return_meta=True)
+        synopsim = cls(pointings, raCol=meta['raCol'], decCol=meta['decCol'],
+                       angleUnit=meta['angleUnit'], indexCol=meta['indexCol'],
+                       usePointingTree=usePointingTree, subset=meta['subset'],
+                       pointingTreeBackend=pointingTreeBackend)
+        synopsim._memmapDir = os.path.abspath(dirname)
+        return synopsim
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._memmapDir is not None:
+            # pointings are memory mapped again when unpickled
+            state['pointings'] = None
+            state['_pointingTree'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._memmapDir is not None:
+            self.pointings = read_columnar(self._memmapDir, mmap_mode='r')
 
     @staticmethod
     def df_subset_columns(df, subset):
@@ -85,6 +161,8 @@ class SynOpSim(object):
                     add_dithers=False,
                     tableNames=('Summary', 'Proposal'),
                     usePointingTree=False,
+                    columns=None,
+                    pointingTreeBackend='balltree',
                     **kwargs):
         """
         Class Method to instantiate this from an OpSim sqlite
@@ -115,6 +193,12 @@ class SynOpSim(object):
             columns will be removed and additional dithered columns
             either by `dithercolumns` or `get_dithercolumns` will
             be used.
+        columns : sequence of strings, defaults to `None`
+            if not `None`, names of the columns of the pointings required.
+            Columns required for constructing the pointings are added
+            automatically. See `OpSimOutput.fromOpSimDB`.
+        pointingTreeBackend : {'balltree'|'kdtree3d'}, defaults to 'balltree'
+            backend of the `PointingTree`, see `PointingTree`
         """
         if kwargs:
             opsout = OpSimOutput.fromOpSimDB(dbname,
@@ -125,6 +209,7 @@ class SynOpSim(object):
                                              dithercolumns=dithercolumns,
                                              add_dithers=add_dithers,
                                              tableNames=tableNames,
+                                             columns=columns,
                                              **kwargs)
         else:
             opsout = OpSimOutput.fromOpSimDB(dbname,
@@ -134,7 +219,8 @@ class SynOpSim(object):
                                              user_propIDs=user_propIDs,
                                              dithercolumns=dithercolumns,
                                              add_dithers=add_dithers,
-                                             tableNames=tableNames)
+                                             tableNames=tableNames,
+                                             columns=columns)
 
         opsimvars = OpSimOutput.get_opsimVariablesForVersion(opsimversion)
 
@@ -145,14 +231,16 @@ class SynOpSim(object):
 
         return bls(opsout.summary, opsimversion=opsimversion, raCol=raCol,
                    decCol=decCol, angleUnit=angleUnit, indexCol=indexCol,
-                   usePointingTree=usePointingTree, subset=subset)
+                   usePointingTree=usePointingTree, subset=subset,
+                   pointingTreeBackend=pointingTreeBackend)
 
     @property
     def pointingTree(self):
         """
         if self.usePointingTree is False, this is set to None. Otherewise
-        contains a `PointingTree` Object. This contains a `BallTree` of the
-        pointings, and a method to find all pointings enclosed in a given radii. 
+        contains a `PointingTree` Object. This contains a `BallTree` (or a
+        `cKDTree` if `pointingTreeBackend` is 'kdtree3d') of the pointings,
+        and a method to find all pointings enclosed in a given radii.
         """
         if self.usePointingTree is True:
             if self._pointingTree is None:
@@ -160,7 +248,8 @@ class SynOpSim(object):
                                                   raCol='_ra',
                                                   decCol='_dec',
                                                   indexCol=self.indexCol,
-                                                  leafSize=50)
+                                                  leafSize=50,
+                                                  backend=self.pointingTreeBackend)
         return self._pointingTree
 
     def pointingsEnclosing(self, ra, dec, circRadius=0., pointingRadius=1.75,
@@ -222,14 +311,58 @@ class SynOpSim(object):
                 yield self.df_subset_columns(self.pointings.loc[idx], subset)
 
 
+    def visitCounts(self, nside=256, nest=True, radii=1.75,
+                    footprintOnly=True, workers=None):
+        """
+        Return a `pd.DataFrame` indexed by the healpixel ID `hid` with the
+        `ra` and `dec` of the healpixel centers in degrees, and the number of
+        visits within each of `radii` of the center in the column
+        `numVisits` if `radii` is a float, or else `numVisits_<radius>` for
+        each radius. See `visitCounts` in `opsimsummary.coverage`.
+
+        Parameters
+        ----------
+        nside : int, defaults to 256
+            `NSIDE` of the healpixels
+        nest : Bool, defaults to `True`
+            use the `nest` method rather than `ring`
+        radii : float or sequence of floats, degrees, defaults to 1.75
+            radii of the field of view
+        footprintOnly : Bool, defaults to `True`
+            if `True`, leave out healpixels far from all the visits, which
+            have no visits
+        workers : int, defaults to `None`
+            number of threads used, if `None` the number of cpus
+        """
+        if self.usePointingTree is False:
+            raise NotImplementedError('This method works only with `PointingTree`')
+        hids, counts = visitCounts(self.pointingTree, nside=nside, nest=nest,
+                                   radii=radii, footprintOnly=footprintOnly,
+                                   workers=workers)
+        ra, dec = pixelCenters(nside, nest)
+        survey = pd.DataFrame(dict(hid=hids, ra=ra[hids], dec=dec[hids]))
+        if np.ndim(radii) == 0:
+            survey['numVisits'] = counts
+        else:
+            for j, radius in enumerate(radii):
+                survey['numVisits_{:g}'.format(radius)] = counts[:, j]
+        return survey.set_index('hid')
+
     def observedVisitsinRegion(self, nside=256, nest=True, minVisits=1,
-                               maxVisits=None, outFile=None, writeFile=False):
+                               maxVisits=None, outFile=None, writeFile=False,
+                               pointingRadius=1.75, workers=None,
+                               hierarchical=False):
         """
         return a `pd.DataFrame` with the healpixelID='hid', ra and dec of the
-        healpixels 'hpix_ra', 'hpix_dec' in radians, and count the number of
-        visits for all healpixels that have visits satisfying
-        minVisits <= count <= maxVisits . This will also write out a csv
-        outFile clobbering past version with this dataframe. 
+        healpixels 'hpix_ra', 'hpix_dec' in degrees, and count the number of
+        visits within `pointingRadius` degrees for all healpixels that have
+        visits satisfying minVisits <= count <= maxVisits . This will also
+        write out a csv outFile clobbering past version with this dataframe.
+        Healpixels far from all the visits are only counted if `minVisits`
+        is less than 1, and the counts use `workers` threads (see
+        `visitCounts`). If `hierarchical` is `True`, the same healpixels and
+        counts are found by refining coarser healpixels only where the
+        counts vary, see `hierarchicalCounts` in `opsimsummary.coverage`.
         """
         if self.usePointingTree is False:
             raise NotImplementedError('This method works only with `PointingTree`')
@@ -237,23 +370,29 @@ class SynOpSim(object):
         if writeFile:
             assert outFile is not None
 
-        ipix = np.arange(hp.nside2npix(nside))
-        hpix_ra, hpix_dec = hp.pix2ang(nside, ipix, nest=nest, lonlat=True)
-
-        # Input array for Tree query
-        X = np.zeros(shape=(len(hpix_ra), 2))
-        X[:, 0] = np.radians(hpix_dec)
-        X[:, 1]= np.radians(hpix_ra)
+        if hierarchical:
+            hids, counts = hierarchicalCounts(self.pointingTree, nside=nside,
+                                              nest=nest,
+                                              radius=pointingRadius,
+                                              minVisits=minVisits,
+                                              maxVisits=maxVisits,
+                                              workers=workers)
+            ra, dec = pixelCenters(nside, nest)
+            survey = pd.DataFrame(dict(hid=hids, ra=ra[hids], dec=dec[hids],
+                                       numVisits=counts)).set_index('hid')
+            if writeFile:
+                survey.to_csv(outFile)
+            return survey
 
         # count visits for each healpixel in the sky
-        counts = self.pointingTree.tree.query_radius(X, r=np.radians(1.75),
-                                                     count_only=True)
-        survey = pd.DataFrame(dict(hid=ipix, ra=hpix_ra, dec=hpix_dec,
-                                   numVisits=counts)).set_index('hid')
+        survey = self.visitCounts(nside=nside, nest=nest,
+                                  radii=pointingRadius,
+                                  footprintOnly=minVisits > 0,
+                                  workers=workers)
 
         # maxVisits is None, imply don't apply maxVisits 
         if maxVisits is None:
-            maxVisits =  counts.max() + 1
+            maxVisits = survey.numVisits.max() + 1 if len(survey) > 0 else 0
 
         survey = survey.query('numVisits >= @minVisits and numVisits <=@maxVisits')
         if writeFile:
@@ -262,9 +401,50 @@ class SynOpSim(object):
 
 
 
+    def pixelStatistics(self, nside=256, nest=True, pointingRadius=1.75,
+                        reducers=None, maps=False, workers=None):
+        """
+        Return statistics of the visits within `pointingRadius` of the
+        centers of healpixels in each filter, by default the number of
+        visits, the coadded depth, the median `FWHMeff`, the first and last
+        `expMJD` and the number of nights.
+
+        Parameters
+        ----------
+        nside : int, defaults to 256
+            `NSIDE` of the healpixels
+        nest : Bool, defaults to `True`
+            use the `nest` method rather than `ring`
+        pointingRadius : degrees, defaults to 1.75
+            radius of the field of view
+        reducers : dict, defaults to `None`
+            statistics computed, see `aggregateVisits` in
+            `opsimsummary.pixelstats`
+        maps : Bool, defaults to `False`
+            if `True`, return dense healpix maps of each statistic in each
+            filter instead of a table, see `statisticsMaps`
+        workers : int, defaults to `None`
+            number of threads used, if `None` the number of cpus
+
+        Returns
+        -------
+        `pd.DataFrame` with the columns `hid`, `filter` and the statistics
+        for each healpixel and filter with visits, or a dictionary of maps
+        if `maps` is `True`
+        """
+        if self.usePointingTree is False:
+            raise NotImplementedError('This method works only with `PointingTree`')
+        stats = pixelStatistics(self.pointingTree, self.pointings,
+                                nside=nside, nest=nest, radius=pointingRadius,
+                                reducers=reducers, workers=workers)
+        if maps:
+            return statisticsMaps(stats, nside)
+        return stats
+
     def sampleRegion(self, numFields=50000, minVisits=1, nest=True, nside=256,
                      rng=np.random.RandomState(1), outfile=None,
-                     usePointingTree=True, subset='wfd', mwebv=0.):
+                     usePointingTree=True, subset='wfd', mwebv=0.,
+                     hierarchical=False):
         """This method samples a number `numFields` fields provided they have
         a minimal number of visits `minVisits`
 
@@ -284,6 +464,10 @@ class SynOpSim(object):
             whether to use PointingTree or not
         subset : {'wfd'|'ddf'|'combined'}
             which subset to use.
+        hierarchical : Bool, defaults to `False`
+            if `True`, find the tiles with more than `minVisits` visits by
+            refining coarser tiles only near the edges of the selection, see
+            `hierarchicalCounts` in `opsimsummary.coverage`
         """
         if subset == 'ddf':
             X = self.pointings[['_ra', '_dec']].drop_duplicates().apply(np.degrees)
@@ -298,13 +482,19 @@ class SynOpSim(object):
         else:
             if self.usePointingTree is False:
                 raise NotImplementedError('This method works only with `PointingTree`')
-            ipix = np.arange(hp.nside2npix(nside))
-            hpix_ra, hpix_dec = hp.pix2ang(nside, ipix, nest=nest, lonlat=True)
-            X = np.zeros(shape=(len(hpix_ra), 2))
-            X[:, 0] = np.radians(hpix_dec)
-            X[:, 1]= np.radians(hpix_ra)
-            counts = self.pointingTree.tree.query_radius(X, r=np.radians(1.75),
-                                                         count_only=True)
+            if hierarchical:
+                # tiles with counts > minVisits, whose counts are not needed
+                lowest = int(np.floor(minVisits)) + 1
+                ipix, counts = hierarchicalCounts(self.pointingTree,
+                                                  nside=nside, nest=nest,
+                                                  radius=1.75,
+                                                  minVisits=lowest,
+                                                  countsRequired=False)
+                counts = np.where(counts == -1, np.inf, counts)
+            else:
+                ipix, counts = visitCounts(self.pointingTree, nside=nside,
+                                           nest=nest, radii=1.75,
+                                           footprintOnly=minVisits >= 0)
 
             mask = counts > minVisits
             hids = ipix[mask]
@@ -371,7 +561,9 @@ class PointingTree(object):
                  raCol='_ra',
                  decCol='_dec',
                  indexCol='obsHistID',
-                 leafSize=50):
+                 leafSize=50,
+                 backend='balltree',
+                 workers=-1):
         """
         Create a tree of pointings
 
@@ -383,6 +575,17 @@ class PointingTree(object):
             column name for a column holding ra values in radians
         decCol :  string
             column name for a column holding dec values in radians
+        leafSize : int, defaults to 50
+            number of pointings in the leaves of the tree
+        backend : {'balltree'|'kdtree3d'}, defaults to 'balltree'
+            if 'balltree', a `sklearn.neighbors.BallTree` of (dec, ra) with
+            the haversine metric. If 'kdtree3d', a `scipy.spatial.cKDTree`
+            of the unit vectors of the pointings, queried with the chord
+            length corresponding to the angular radius, which is faster and
+            uses `workers` threads. Both return the same pointings.
+        workers : int, defaults to -1
+            number of threads used in queries of the 'kdtree3d' backend, -1
+            uses all the cpus.
 
         .. note : raCol and decCol are assumed to hold ra and dec in units of
         radians
@@ -394,16 +597,34 @@ class PointingTree(object):
             self.decCol = decCol
         else:
             raise ValueError('pointings, and the provided values of raCol, decCol {0}, {1} are incompatible'.format(raCol, decCol))
+        if backend not in self.backends:
+            raise ValueError('backend must be one of {0}, not {1}'.format(
+                self.backends, backend))
+        self.backend = backend
+        self.workers = workers
 
         # tree queries
         # Keep mapping from integer indices to obsHistID
-        pointings.loc[:, 'intindex'] = np.arange(len(pointings)).astype(np.int)
+        pointings.loc[:, 'intindex'] = np.arange(len(pointings)).astype(np.int64)
         self.indMapping = pointings['intindex'].reset_index().set_index('intindex')
 
         # Build Tree
-        self.tree = BallTree(pointings[[decCol, raCol]].values,
-                             leaf_size=leafSize,
-                             metric='haversine')
+        self._decra = pointings[[decCol, raCol]].values
+        if backend == 'kdtree3d':
+            self.tree = cKDTree(self._unitvectors(self._decra),
+                                leafsize=leafSize)
+        else:
+            self.tree = BallTree(self._decra,
+                                 leaf_size=leafSize,
+                                 metric='haversine')
+
+    backends = ('balltree', 'kdtree3d')
+
+    @property
+    def raDec(self):
+        """tuple of the arrays of the ra and dec of the pointings in
+        degrees, in the order of the integer indices of the tree"""
+        return np.degrees(self._decra[:, 1]), np.degrees(self._decra[:, 0])
 
     @staticmethod
     def validatePointings(pointings, raCol, decCol):
@@ -429,6 +650,114 @@ class PointingTree(object):
             print(' do not exist')
             return False
 
+    @staticmethod
+    def _unitvectors(X):
+        """unit vectors of an array `X` of (dec, ra) in radians"""
+        dec = X[:, 0]
+        ra = X[:, 1]
+        cosdec = np.cos(dec)
+        return np.column_stack((cosdec * np.cos(ra), cosdec * np.sin(ra),
+                                np.sin(dec)))
+
+    @staticmethod
+    def _rdist(X, Y):
+        """haversine function of the angular distance between (dec, ra) in
+        radians of `X` and `Y`, computed as by the `BallTree`"""
+        sin_0 = np.sin(0.5 * (X[..., 0] - Y[..., 0]))
+        sin_1 = np.sin(0.5 * (X[..., 1] - Y[..., 1]))
+        return sin_0 * sin_0 + np.cos(X[..., 0]) * np.cos(Y[..., 0]) * sin_1 * sin_1
+
+    def _within(self, X, candidates, r):
+        """Return a list of the arrays of indices in `candidates` of the
+        pointings at an angular distance of at most `r` radians from the
+        corresponding (dec, ra) in `X`, with the criterion of the
+        `BallTree`"""
+        lengths = np.fromiter((len(cand) for cand in candidates),
+                              dtype=np.intp, count=len(candidates))
+        if lengths.sum() == 0:
+            return list(np.zeros(0, dtype=np.intp) for _ in candidates)
+        inds = np.concatenate(list(cand for cand in candidates
+                                   if len(cand) > 0)).astype(np.intp)
+        rdist = self._rdist(self._decra[inds], np.repeat(X, lengths, axis=0))
+        keep = rdist <= np.sin(0.5 * r) ** 2
+        offsets = np.cumsum(lengths)[:-1]
+        return list(ind[k] for ind, k in zip(np.split(inds, offsets),
+                                             np.split(keep, offsets)))
+
+    def query_radius(self, X, r, count_only=False, workers=None):
+        """
+        Return the integer indices (or the number) of the pointings within an
+        angular distance `r` of each position in `X`, as
+        `BallTree.query_radius` with the haversine metric does for both
+        backends.
+
+        Parameters
+        ----------
+        X : `np.ndarray` of shape (num, 2)
+            dec and ra of the positions in radians
+        r : float, radians
+            angular radius
+        count_only : Bool, defaults to `False`
+            if `True`, return the number of pointings for each position
+        workers : int, defaults to `None`
+            number of threads used by the 'kdtree3d' backend, if `None`
+            `self.workers`
+
+        Returns
+        -------
+        `np.ndarray` of the number of pointings of each position if
+        `count_only`, or else an object array of arrays of integer indices
+        of the pointings.
+        """
+        X = np.atleast_2d(X)
+        if self.backend == 'balltree':
+            return self.tree.query_radius(X, r=r, count_only=count_only)
+
+        # chord length of the angular radius. Candidates are found with a
+        # slightly larger chord and kept if their distance is within `r` as
+        # computed by the `BallTree`, so that rounding errors do not change
+        # the pointings found.
+        chord = 2.0 * np.sin(0.5 * min(r, np.pi))
+        outer = chord * (1. + 1.0e-8) + 1.0e-12
+        inner = chord * (1. - 1.0e-8) - 1.0e-12
+        if workers is None:
+            workers = self.workers
+        vecs = self._unitvectors(X)
+        if inner > 0.:
+            innercounts = self.tree.query_ball_point(vecs, inner,
+                                                     workers=workers,
+                                                     return_length=True)
+        else:
+            innercounts = np.zeros(len(X), dtype=np.intp)
+
+        # only positions with pointings close to the edge of the circle
+        # are checked
+        if count_only:
+            counts = self.tree.query_ball_point(vecs, outer,
+                                                workers=workers,
+                                                return_length=True)
+            edge = np.flatnonzero(counts != innercounts)
+            if len(edge) > 0:
+                candidates = self.tree.query_ball_point(vecs[edge], outer,
+                                                        workers=workers)
+                counts[edge] = list(len(inds) for inds in
+                                    self._within(X[edge], candidates, r))
+            return counts
+
+        candidates = self.tree.query_ball_point(vecs, outer,
+                                                workers=workers,
+                                                return_sorted=False)
+        inds = np.empty(len(X), dtype=object)
+        for i, cand in enumerate(candidates):
+            inds[i] = np.asarray(cand, dtype=np.intp)
+        edge = np.flatnonzero(np.fromiter((len(cand) for cand in candidates),
+                                          dtype=np.intp, count=len(X)) !=
+                              innercounts)
+        if len(edge) > 0:
+            for i, ind in zip(edge, self._within(X[edge], inds[edge], r)):
+                inds[i] = ind
+        return inds
+
     def pointingsEnclosing(self, ra, dec, circRadius, pointingRadius=1.75):
         """
         Parameters
@@ -454,12 +783,8 @@ class PointingTree(object):
         obj_posns[:, 1] = np.radians(ra)
 
         total_radius = np.radians(circRadius + pointingRadius)
-        inds, dist = self.tree.query_radius(obj_posns,
-                                            r=total_radius,
-                                            count_only=False,
-                                            return_distance=True)
+        inds = self.query_radius(obj_posns, r=total_radius)
 
-        xx = self.indMapping
         return list(self.indMapping.obsHistID.loc[ptval].values for ptval in inds)
 
 
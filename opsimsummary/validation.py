@@ -0,0 +1,174 @@
+"""
+Module to validate tables of pointings such as `OpSimOutput.summary`. All of
+the checks requested are done in a single pass over the columns they need,
+and the time taken by each check is recorded. Failures raise
+`ValidationError` describing the failed check.
+"""
+from __future__ import division, print_function, absolute_import
+__all__ = ['ValidationError', 'PointingValidator', 'validationLevels']
+import time
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+
+validationLevels = ('off', 'fast', 'full')
+
+
+class ValidationError(ValueError):
+    """
+    Exception raised when a table of pointings fails a validation check.
+
+    Attributes
+    ----------
+    check : string
+        name of the check that failed, one of {'columns'|'fiveSigmaDepth'|
+        'angles'|'nulls'}
+    columns : list of strings
+        columns of the table which failed the check
+    numInvalid : int
+        number of values which failed the check
+    timings : `OrderedDict`
+        time in seconds taken by the checks done before the failure
+    """
+    def __init__(self, check, message, columns=(), numInvalid=0,
+                 timings=None):
+        ValueError.__init__(self, 'validation check {0} failed: {1}'.format(
+            check, message))
+        self.check = check
+        self.columns = list(columns)
+        self.numInvalid = numInvalid
+        self.timings = OrderedDict() if timings is None else timings
+
+
+class PointingValidator(object):
+    """
+    Validate tables of pointings at a given level of thoroughness.
+
+    Parameters
+    ----------
+    level : {'off'|'fast'|'full'}, defaults to 'fast'
+        'off' does no checks. 'fast' checks that `fiveSigmaDepth` exists and
+        has no null values, and optionally that the `_ra` and `_dec` columns
+        exist and are finite angles in radians. 'full' in addition checks
+        that no column of the table has null values.
+
+    Attributes
+    ----------
+    timings : `OrderedDict`
+        time in seconds taken by each check in the last call to `validate`
+    """
+    def __init__(self, level='fast'):
+        if level not in validationLevels:
+            raise ValueError('validation level {0} not in {1}'.format(
+                level, validationLevels))
+        self.level = level
+        self.timings = OrderedDict()
+
+    @staticmethod
+    def _scan(series):
+        """Return a tuple of the number of null values, and the minimum and
+        maximum of `series` if it is of floating point type (or else `None`),
+        using as few passes over the values as possible"""
+        values = series.values
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            return int((series.cat.codes.values == -1).sum()), None, None
+        if values.dtype.kind in 'iub':
+            return 0, None, None
+        if values.dtype.kind == 'f':
+            if len(values) == 0:
+                return 0, None, None
+            # min and max propagate nans, so only count them on failure
+            vmin, vmax = values.min(), values.max()
+            if np.isnan(vmin) or np.isnan(vmax):
+                return int(np.isnan(values).sum()), vmin, vmax
+            return 0, vmin, vmax
+        return int(pd.isnull(values).sum()), None, None
+
+    def validate(self, summary, checkAngles=False, checkDepth=True):
+        """
+        Validate the table of pointings `summary`, raising `ValidationError`
+        if a check fails.
+
+        Parameters
+        ----------
+        summary : `pd.DataFrame`
+            table of pointings
+        checkAngles : Bool, defaults to `False`
+            if `True`, check the `_ra` and `_dec` columns
+        checkDepth : Bool, defaults to `True`
+            if `True`, check the `fiveSigmaDepth` column
+
+        Returns
+        -------
+        timings : `OrderedDict` of the time in seconds taken by each check
+        """
+        self.timings = OrderedDict()
+        if self.level == 'off':
+            return self.timings
+
+        # results of scanning each column, so that it is scanned once
+        scanned = dict()
+
+        def scan(col):
+            if col not in scanned:
+                scanned[col] = self._scan(summary[col])
+            return scanned[col]
+
+        def fail(check, message, columns=(), numInvalid=0):
+            raise ValidationError(check, message, columns=columns,
+                                  numInvalid=numInvalid, timings=self.timings)
+
+        required = []
+        if checkDepth:
+            required.append('fiveSigmaDepth')
+        if checkAngles:
+            required += ['_ra', '_dec']
+
+        tstart = time.time()
+        missing = list(col for col in required if col not in summary.columns)
+        self.timings['columns'] = time.time() - tstart
+        if len(missing) > 0:
+            fail('columns', 'missing columns {}'.format(missing),
+                 columns=missing)
+
+        if checkDepth:
+            tstart = time.time()
+            numNull = scan('fiveSigmaDepth')[0]
+            self.timings['fiveSigmaDepth'] = time.time() - tstart
+            if numNull > 0:
+                fail('fiveSigmaDepth', '{} null values'.format(numNull),
+                     columns=['fiveSigmaDepth'], numInvalid=numNull)
+
+        if checkAngles:
+            tstart = time.time()
+            limits = dict(_ra=2.0 * np.pi, _dec=np.pi)
+            for col in ('_ra', '_dec'):
+                numNull, vmin, vmax = scan(col)
+                if numNull > 0:
+                    fail('angles', '{0} null values in {1}'.format(numNull,
+                                                                   col),
+                         columns=[col], numInvalid=numNull)
+                if vmin is not None and \
+                        max(np.fabs(vmin), np.fabs(vmax)) > limits[col]:
+                    numBad = int((np.fabs(summary[col].values) >
+                                  limits[col]).sum())
+                    fail('angles', '{0} values of {1} are not angles in '
+                         'radians'.format(numBad, col), columns=[col],
+                         numInvalid=numBad)
+            self.timings['angles'] = time.time() - tstart
+
+        if self.level == 'full':
+            tstart = time.time()
+            nulls = OrderedDict()
+            for col in summary.columns:
+                numNull = scan(col)[0]
+                if numNull > 0:
+                    nulls[col] = numNull
+            self.timings['nulls'] = time.time() - tstart
+            if len(nulls) > 0:
+                fail('nulls', 'null values in columns {}'.format(dict(nulls)),
+                     columns=list(nulls.keys()),
+                     numInvalid=sum(nulls.values()))
+
+        return self.timings
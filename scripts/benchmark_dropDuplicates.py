@@ -0,0 +1,104 @@
+"""
+Script to compare the time taken by `OpSimOutput.dropDuplicates` with the
+earlier pandas based implementation on a synthetic summary table with
+visits shared between proposals.
+    To get usage : python benchmark_dropDuplicates.py -h
+"""
+from __future__ import print_function, division
+import time
+from argparse import ArgumentParser
+import numpy as np
+import pandas as pd
+from opsimsummary import OpSimOutput
+
+
+def dropDuplicates_pandas(df, propIDDict, opsimversion):
+    """earlier implementation of `OpSimOutput.dropDuplicates`, keeping the
+    first row for each `obsHistID`"""
+    if opsimversion == 'sstf':
+        return df
+    minPropID = df.propID.min()
+    ddfmask = np.isin(df.propID, propIDDict['ddf'])
+    wfdmask = np.isin(df.propID, propIDDict['wfd'])
+    df['orig_propID'] = df.propID.values
+    df.loc[ddfmask, 'propID'] = minPropID - 1
+    df.loc[wfdmask, 'propID'] = minPropID - 2
+    df = df.drop_duplicates(subset='obsHistID', keep='first', inplace=False)
+    del df['propID']
+    df.rename(columns=dict(orig_propID='propID'), inplace=True)
+    df.sort_values(by='expMJD', inplace=True)
+    return df
+
+
+def synthetic_summary(numVisits, sharedFraction=0.1, numColumns=30,
+                      rng=np.random.RandomState(0)):
+    """
+    Return a summary table with `numVisits` visits where a fraction
+    `sharedFraction` of WFD visits appear again as DDF visits. As in OpSim,
+    the rows of a shared visit only differ by `propID`, and the rows are
+    shuffled, so that the DDF row may follow the WFD row.
+    """
+    wfdID, ddfID, otherID = 364, 366, 362
+    propID = rng.choice([wfdID, wfdID, otherID], size=numVisits)
+    shared = (propID == wfdID) & (rng.uniform(size=numVisits) < sharedFraction)
+    visits = np.concatenate([np.arange(numVisits), np.flatnonzero(shared)])
+    props = np.concatenate([propID, np.repeat(ddfID, shared.sum())])
+    order = rng.permutation(len(visits))
+    visits = visits[order]
+    df = pd.DataFrame(dict(obsHistID=visits + 1, propID=props[order]))
+    df['expMJD'] = 59580. + df.obsHistID.values * 30. / 86400.
+    for i in range(numColumns):
+        df['col{}'.format(i)] = rng.normal(size=numVisits)[visits]
+    propIDDict = dict(ddf=ddfID, wfd=wfdID)
+    return df, propIDDict
+
+
+def best_time(func, df, propIDDict, repeat):
+    """smallest time over `repeat` calls of `func` on copies of `df`"""
+    times = []
+    for i in range(repeat):
+        frame = df.copy()
+        tstart = time.time()
+        result = func(frame, propIDDict, 'lsstv3')
+        times.append(time.time() - tstart)
+    return min(times), result
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='benchmark dropDuplicates')
+    parser.add_argument('--numVisits', type=int, default=2500000,
+                        help='number of visits in the summary table')
+    parser.add_argument('--numColumns', type=int, default=30,
+                        help='number of additional float columns')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of times each implementation is run')
+    args = parser.parse_args()
+
+    df, propIDDict = synthetic_summary(args.numVisits,
+                                       numColumns=args.numColumns)
+    print('summary with {0} rows and {1} columns, {2:.1f} MB'.format(
+        len(df), len(df.columns), df.memory_usage().sum() / 1.0e6))
+
+    t_pandas, res_pandas = best_time(dropDuplicates_pandas, df, propIDDict,
+                                     args.repeat)
+    t_numpy, res_numpy = best_time(OpSimOutput.dropDuplicates, df,
+                                   propIDDict, args.repeat)
+    # The earlier implementation keeps the first row of a shared visit, and
+    # `dropDuplicates` the row of the proposal with the highest priority.
+    # Only `propID` differs between the rows of a visit.
+    res_pandas = res_pandas.reset_index(drop=True)
+    res_numpy = res_numpy.reset_index(drop=True)
+    same = res_pandas.drop(columns='propID').equals(
+        res_numpy.drop(columns='propID'))
+    ddfKept = np.all(np.isin(res_numpy.obsHistID.values,
+                             df.obsHistID.values[df.propID.values ==
+                                                 propIDDict['ddf']]) ==
+                     (res_numpy.propID.values == propIDDict['ddf']))
+    print('pandas implementation : {0:.3f} s'.format(t_pandas))
+    print('numpy implementation  : {0:.3f} s'.format(t_numpy))
+    print('speedup {0:.1f}, visits and columns other than propID identical '
+          ': {1}'.format(t_pandas / t_numpy, same))
+    print('rows with a different propID : {0}, DDF rows kept for all '
+          'shared visits : {1}'.format(
+              np.sum(res_pandas.propID.values != res_numpy.propID.values),
+              ddfKept))
@@ -0,0 +1,36 @@
+"""
+Script to convert a csv file of dithers provided by DESC (eg.
+`descDithers_minion_1016.csv`) to the binary dither file format of
+`opsimsummary.DitherTable`, which can be memory mapped and joined to the
+summary table without parsing text.
+    To get usage : python make_ditherfile.py -h
+"""
+from __future__ import print_function
+import os
+import time
+from argparse import ArgumentParser
+from opsimsummary import DitherTable
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='convert a DESC csv file of dithers '
+                            'to a binary dither file')
+    parser.add_argument('csvfile', help='path to the DESC csv file of dithers')
+    parser.add_argument('--output', help='path to the dither file written out,'
+                        ' defaults to the csv file name with the extension '
+                        '.dithers', default=None)
+    args = parser.parse_args()
+
+    output = args.output
+    if output is None:
+        output = os.path.splitext(args.csvfile)[0] + '.dithers'
+
+    tstart = time.time()
+    table = DitherTable.fromDESCCSV(args.csvfile)
+    tread = time.time()
+    table.write(output)
+    tend = time.time()
+    print('read {0} dithers from {1} in {2:.2f} s'.format(len(table),
+                                                          args.csvfile,
+                                                          tread - tstart))
+    print('wrote {0} in {1:.2f} s'.format(output, tend - tread))
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""
+Script to convert an OpSim database file to the columnar format read by
+`OpSimOutput.fromOpSimColumnar`. The entire summary table (subset `_all`) is
+written out by default, so that any subset can be read from it, with visits
+in row groups partitioned by `propID` or `night`.
+    To get usage : python make_opsim_columnar.py -h
+"""
+from __future__ import print_function
+import os
+import time
+import argparse
+import opsimsummary as oss
+
+example_dir = os.path.join(oss.__path__[0], 'example_data')
+dbName = os.path.join(example_dir, 'enigma_1189_micro.db')
+
+parser = argparse.ArgumentParser(description='Write out the visits of an'
+                                 ' OpSim sqlite file to a columnar directory,'
+                                 ' read by OpSimOutput.fromOpSimColumnar')
+parser.add_argument('--OpSimDBPath', type=str, default=None,
+                    help='absolute path to the OpSim sqlite database, defaults'
+                    ' to None, which does this for `example_dir/enigma_1189_micro.db`')
+parser.add_argument('--outDir', type=str, default=None,
+                    help='absolute path to the output columnar directory, '
+                    'defaults to None, which writes to the directory of the '
+                    'database, named as the database with the suffix '
+                    '`_columnar`')
+parser.add_argument('--opsimversion', type=str, default='lsstv3',
+                    help='version of opsim used lsstv3|lsstv4|sstf, defaults '
+                    'to lsstv3')
+parser.add_argument('--subset', type=str, default='_all',
+                    help='subset of visits written out, defaults to `_all` '
+                    'so that any subset can be read')
+parser.add_argument('--partitionBy', type=str, default='propID',
+                    help='column propID|night by which visits are stored in '
+                    'row groups, defaults to propID')
+parser.add_argument('--rowGroupSize', type=int, default=100000,
+                    help='maximal number of visits in a row group, defaults '
+                    'to 100000')
+args = parser.parse_args()
+
+if args.OpSimDBPath is not None:
+    dbName = args.OpSimDBPath
+outDir = args.outDir
+if outDir is None:
+    outDir = os.path.splitext(os.path.abspath(dbName))[0] + '_columnar'
+
+tstart = time.time()
+# dithers in DDF are set to zero when subsets are read
+opout = oss.OpSimOutput.fromOpSimDB(dbname=dbName, subset=args.subset,
+                                    opsimversion=args.opsimversion,
+                                    zeroDDFDithers=False)
+tread = time.time()
+opout.writeOpSimColumnar(outDir, partitionBy=args.partitionBy,
+                         rowGroupSize=args.rowGroupSize)
+print('read {0} visits in {1:.2f} s and wrote {2} in {3:.2f} s'.format(
+    len(opout.summary), tread - tstart, outDir, time.time() - tread))
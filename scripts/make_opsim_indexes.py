@@ -0,0 +1,34 @@
+"""
+Script to build indexes on the proposal ID, night and MJD columns of the
+summary table of an OpSim database, which make queries for subsets of visits
+faster. The indexes are built in the database, or in a sidecar copy of it
+which `opsimsummary.OpSimOutput` uses in place of the database.
+    To get usage : python make_opsim_indexes.py -h
+"""
+from __future__ import print_function
+import time
+from argparse import ArgumentParser
+from opsimsummary import build_indexes, benchmark_indexes
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='build indexes on the summary table '
+                            'of an OpSim database')
+    parser.add_argument('dbname', help='absolute path to the OpSim database')
+    parser.add_argument('--opsimversion', help='version of OpSim, one of '
+                        'lsstv3, lsstv4, sstf', default='lsstv3')
+    parser.add_argument('--sidecar', help='build the indexes in a copy of the'
+                        ' database next to it, or at the path given, rather '
+                        'than in the database', nargs='?', const=True,
+                        default=False)
+    parser.add_argument('--benchmark', help='print the time taken by queries '
+                        'with and without the indexes', action='store_true')
+    args = parser.parse_args()
+
+    tstart = time.time()
+    dbname = build_indexes(args.dbname, opsimversion=args.opsimversion,
+                           sidecar=args.sidecar)
+    print('built indexes in {0} in {1:.2f} s'.format(dbname,
+                                                     time.time() - tstart))
+    if args.benchmark:
+        print(benchmark_indexes(dbname, opsimversion=args.opsimversion))
@@ -106,7 +106,7 @@ if __name__ == '__main__':
                         default='/')
     parser.add_argument('--dbname', help='path to sqlite database output from OpSim relative to data_root, defaults to "minion_1016_sqlite.db"',
                         default='minion_1016_sqlite.db')
-    parser.add_argument('--ditherfiles', help='path to ditherfile relative to data root, defaults to `None`', default=None) 
+    parser.add_argument('--ditherfiles', help='path to ditherfile (DESC csv or binary file from make_ditherfile.py) relative to data root, defaults to `None`', default=None) 
     parser.add_argument('--no_construct_ditherfiles', help='do not try to construct ditherfiles if ditherfiles is None',
                         dest='No_construct_ditherfiles', action='store_true')
     # parser.add_argument('--write_ddf_simlib', help='Whether to write out DDF simlib',
@@ -137,6 +137,8 @@ if __name__ == '__main__':
                         default=50000, type=int)
     parser.add_argument('--filterNull', help='if added, then the summary table of the OpSim file will be filtered of rows that appear to have null values',
                         dest='filt_Null', action='store_true')
+    parser.add_argument('--cache_dir', help='absolute path to a directory used to cache the summary tables read from the OpSim database, defaults to `None` for no caching',
+                        default=None)
     print("read in command line options and figuring out what to do\n")
     print("we are using opsimsummary version {0} and the library is located at {1}".format(oss.__version__, oss.__file__))
     print("we are using the path {}".format(sys.path))
@@ -174,12 +176,10 @@ if __name__ == '__main__':
             print(ditherfiles)
             assert os.path.exists(ditherfiles)
             assert os.path.getsize(ditherfiles) > 0
-    
-            dithercolumns = pd.read_csv(ditherfiles)
-            dithercolumns = dithercolumns.rename(columns=dict(observationId='obsHistID',
-                                                               descDitheredRA='ditheredRA',
-                                                               descDitheredDec='ditheredDec')
-                                                              ).set_index('obsHistID')
+
+            # binary dither files from make_ditherfile.py are memory
+            # mapped, DESC csv files are parsed and sorted
+            dithercolumns = oss.DitherTable.fromFile(ditherfiles)
     
     sys.stdout.flush()
     summaryTableName = args.summaryTableName
@@ -207,12 +207,28 @@ if __name__ == '__main__':
     print(args)
     
     sys.stdout.flush()
+    # read the database into a `pd.DataFrame` once, the DDF visits are
+    # taken from the combined subset
+    tstart = time.time()
+    print("\n\n Task: reading database {0} at time {1}. This can take a while ... ".format(dbname, tstart))
+    sys.stdout.flush()
+    opsout = OpSimOutput.fromOpSimDB(dbname,
+                                     opsimversion=opsimversion,
+                                     tableNames=(summaryTableName, 'Proposal'),
+                                     subset='combined', dithercolumns=dithercolumns,
+                                     filterNull=filternulls,
+                                     cache_dir=args.cache_dir)
+    tend = time.time()
+    print("finished reading database {0} at time {1}".format(dbname, tend))
+    print("reading the db took {} minutes".format((tend-tstart)/60.0))
+    sys.stdout.flush()
+    # the DDF visits are only needed for the DDF pixels or simlib
+    if get_ddf_pixels or write_ddf_simlib:
+        opsout_ddf = opsout.subsetView('ddf')
+
     # find ddf healpixels
     if get_ddf_pixels:
         print('Finding the DDF healpixels \n')
-        opsout_ddf = OpSimOutput.fromOpSimDB(dbname, opsimversion=opsimversion,
-                                             subset='ddf', dithercolumns=dithercolumns,
-                                             filterNull=filternulls)
         if len(opsout_ddf.summary) > 0:
             print("writing out ddf pixels\n")
             simlib_ddf = Simlibs(opsout_ddf.summary, opsimversion=opsimversion,
@@ -224,19 +240,6 @@ if __name__ == '__main__':
         ddf_hid = set([])
         print("written out null set of ddf pixels\n")
     print('There are {} pixels in the ddf fields'.format(len(ddf_hid)))
-    # read the database into a `pd.DataFrame`
-    tstart = time.time()
-    print("\n\n Task: reading database {0} at time {1}. This can take a while ... ".format(dbname, tstart))
-    sys.stdout.flush()
-    opsout = OpSimOutput.fromOpSimDB(dbname,
-                                     opsimversion=opsimversion,
-                                     tableNames=(summaryTableName, 'Proposal'),
-                                     subset='combined', dithercolumns=dithercolumns,
-                                     filterNull=filternulls)
-    tend = time.time()
-    print("finished reading database {0} at time {1}".format(dbname, tend))
-    print("reading the db took {} minutes".format((tend-tstart)/60.0))
-    sys.stdout.flush()
     summary = opsout.summary
     script_name = os.path.abspath(__file__)
     if write_ddf_simlib:
@@ -0,0 +1,110 @@
+""" Fixtures shared by the tests, including small synthetic OpSim databases
+"""
+from __future__ import print_function, division, absolute_import
+import sqlite3
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def make_opsim_db(dbname, opsimversion='lsstv3', numVisits=3000, seed=0):
+    """
+    Write a small OpSim database of version `opsimversion` ('lsstv3' or
+    'sstf') with a summary and a `Proposal` table, and return the summary
+    written. The visits are repeated visits to fields, most of them in the
+    WFD and DDF proposals. In 'lsstv3', about a tenth of the visits are
+    shared between the WFD and DDF proposals, with the rows of either
+    proposal first, and have dithers in the database.
+    """
+    rng = np.random.RandomState(seed)
+    numFields = 200
+    fieldRA = rng.uniform(0., 2. * np.pi, size=numFields)
+    fieldDec = np.arcsin(rng.uniform(-1., 0.2, size=numFields))
+    fieldID = rng.randint(0, numFields, size=numVisits)
+    expMJD = 59580. + np.cumsum(rng.uniform(0.001, 0.1, size=numVisits))
+    summary = pd.DataFrame(dict(obsHistID=np.arange(1, numVisits + 1),
+                                propID=rng.choice([0, 1, 2, 3], size=numVisits,
+                                                  p=[0.1, 0.1, 0.2, 0.6]),
+                                fieldID=fieldID,
+                                fieldRA=fieldRA[fieldID],
+                                fieldDec=fieldDec[fieldID],
+                                filter=rng.choice(list('ugrizy'),
+                                                  size=numVisits),
+                                expMJD=expMJD,
+                                night=np.floor(expMJD - 59580.).astype(int),
+                                FWHMeff=rng.uniform(0.6, 1.5, size=numVisits),
+                                filtSkyBrightness=rng.normal(21., 1.,
+                                                             size=numVisits),
+                                fiveSigmaDepth=rng.normal(24., 0.5,
+                                                          size=numVisits),
+                                moonAlt=rng.uniform(-1., 1., size=numVisits)))
+    if opsimversion == 'lsstv3':
+        # proposals 2 and 3 are the DDF and WFD
+        propIDs = np.array([362, 363, 366, 364])
+        summary['propID'] = propIDs[summary.propID.values]
+        summary['ditheredRA'] = np.mod(summary.fieldRA.values +
+                                       rng.uniform(-0.02, 0.02,
+                                                   size=numVisits),
+                                       2. * np.pi)
+        summary['ditheredDec'] = summary.fieldDec.values + \
+            rng.uniform(-0.02, 0.02, size=numVisits)
+
+        # rows of shared visits, before or after the row of the visit
+        shared = np.flatnonzero(np.isin(summary.propID.values, (364, 366)) &
+                                (rng.uniform(size=numVisits) < 0.1))
+        dups = summary.iloc[shared].copy()
+        dups['propID'] = np.where(dups.propID.values == 364, 366, 364)
+        position = np.concatenate((np.arange(numVisits, dtype=float),
+                                   shared + rng.choice([-0.5, 0.5],
+                                                       size=len(shared))))
+        summary = pd.concat([summary, dups]).iloc[np.argsort(position)]
+        summary = summary.reset_index(drop=True)
+        proposals = pd.DataFrame(dict(
+            propID=propIDs,
+            propConf=['../conf/survey/GalacticPlaneProp.conf',
+                      '../conf/survey/SouthCelestialPole-18.conf',
+                      '../conf/survey/DDcosmology1.conf',
+                      '../conf/survey/Universal-18-0824B.conf']))
+        tableName = 'Summary'
+    elif opsimversion == 'sstf':
+        summary['fieldRA'] = np.degrees(summary.fieldRA.values)
+        summary['fieldDec'] = np.degrees(summary.fieldDec.values)
+        names = dict(obsHistID='observationId', propID='proposalId',
+                     fieldID='fieldId', expMJD='observationStartMJD',
+                     FWHMeff='seeingFwhmEff',
+                     filtSkyBrightness='skyBrightness')
+        summary = summary.rename(columns=names)
+        proposals = pd.DataFrame(dict(propId=[0, 1, 2, 3],
+                                      propName=['GalacticPlane',
+                                                'SouthCelestialPole',
+                                                'Deep Drilling',
+                                                'WideFastDeep']))
+        tableName = 'SummaryAllProps'
+    else:
+        raise ValueError('opsimversion {} not supported'.format(opsimversion))
+
+    con = sqlite3.connect(dbname)
+    summary.to_sql(tableName, con, index=False)
+    proposals.to_sql('Proposal', con, index=False)
+    con.close()
+    return summary
+
+
+@pytest.fixture(scope='session')
+def opsimdbs(tmpdir_factory):
+    """dictionary of the paths to synthetic OpSim databases written by
+    `make_opsim_db` for the versions 'lsstv3' and 'sstf'"""
+    dirname = tmpdir_factory.mktemp('opsimdb')
+    dbnames = dict()
+    for opsimversion in ('lsstv3', 'sstf'):
+        dbnames[opsimversion] = str(dirname.join(
+            'opsim_{}.db'.format(opsimversion)))
+        make_opsim_db(dbnames[opsimversion], opsimversion=opsimversion)
+    return dbnames
+
+
+@pytest.fixture(params=['lsstv3', 'sstf'])
+def opsimdb(request, opsimdbs):
+    """tuple of the path to a synthetic OpSim database and its version, for
+    each of the versions of `opsimdbs`"""
+    return opsimdbs[request.param], request.param
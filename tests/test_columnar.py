@@ -0,0 +1,58 @@
+""" Tests for the code in `opsimsummary/columnar.py`
+"""
+from __future__ import print_function, division, absolute_import
+import pytest
+import numpy as np
+import pandas as pd
+from opsimsummary import write_columnar, read_columnar
+
+
+def test_columnar_roundtrip(tmpdir):
+    """check that a dataframe with numeric, string and categorical columns
+    is read back identically, with and without memory mapping"""
+    n = 100
+    rng = np.random.RandomState(0)
+    df = pd.DataFrame(dict(expMJD=59580. + rng.uniform(size=n),
+                           night=np.arange(n) // 10,
+                           filter=rng.choice(list('ugrizy'), size=n),
+                           band=pd.Categorical(rng.choice(list('ugr'), size=n))),
+                      index=pd.Index(np.arange(n) + 1, name='obsHistID'))
+    df.loc[3, 'filter'] = np.nan
+    dirname = str(tmpdir.join('frame'))
+    write_columnar(df, dirname, meta=dict(opsimversion='lsstv3'))
+
+    df_read, meta = read_columnar(dirname, return_meta=True)
+    assert df_read.equals(df)
+    assert meta['opsimversion'] == 'lsstv3'
+
+    df_mmap = read_columnar(dirname, columns=['night', 'expMJD'],
+                            mmap_mode='r')
+    assert df_mmap.equals(df[['night', 'expMJD']])
+
+
+@pytest.mark.parametrize("partitionBy", [None, 'propID', 'night'])
+def test_columnar_predicates(tmpdir, partitionBy):
+    """check that row groups are returned in the original order and that
+    predicates select the same rows as pandas"""
+    n = 1000
+    rng = np.random.RandomState(1)
+    df = pd.DataFrame(dict(night=np.sort(rng.randint(0, 50, size=n)),
+                           propID=rng.choice([362, 364, 366], size=n),
+                           filter=rng.choice(list('ugrizy'), size=n),
+                           fiveSigmaDepth=rng.normal(24., 1., size=n)),
+                      index=pd.Index(rng.permutation(n), name='obsHistID'))
+    df.loc[df.index[5], 'fiveSigmaDepth'] = np.nan
+    dirname = str(tmpdir.join('frame'))
+    write_columnar(df, dirname, partitionBy=partitionBy, rowGroupSize=100)
+    assert read_columnar(dirname).equals(df)
+
+    predicates = [('propID', 'in', [364, 366]), ('night', '>=', 10),
+                  ('night', '<', 20), ('filter', 'in', ['g', 'r']),
+                  ('fiveSigmaDepth', '>', 23.), ('obsHistID', '!=', 7)]
+    selected = read_columnar(dirname, columns=['filter', 'night'],
+                             predicates=predicates)
+    expected = df.query('propID in [364, 366] and night >= 10 and '
+                        'night < 20 and filter in ["g", "r"] and '
+                        'fiveSigmaDepth > 23. and obsHistID != 7')
+    assert selected.equals(expected[['filter', 'night']])
+    assert len(read_columnar(dirname, predicates=[('propID', '==', 0)])) == 0
@@ -0,0 +1,136 @@
+""" Tests for the code in `opsimsummary/coverage.py`
+"""
+from __future__ import print_function, division, absolute_import
+import numpy as np
+import pandas as pd
+import healpy as hp
+import pytest
+from numpy.testing import assert_array_equal
+import opsimsummary.coverage as coverage
+from opsimsummary import (SynOpSim, PointingTree, pixelCenters,
+                          footprintPixels, visitCounts, hierarchicalCounts)
+
+
+def _pointings(numVisits=4000, numFields=300):
+    """visits to fields in part of the sky"""
+    rng = np.random.RandomState(1)
+    fieldra = rng.uniform(0., np.pi, size=numFields)
+    fielddec = np.arcsin(rng.uniform(-1., 0., size=numFields))
+    fields = rng.randint(0, numFields, size=numVisits)
+    return pd.DataFrame(dict(_ra=fieldra[fields], _dec=fielddec[fields],
+                             expMJD=np.arange(numVisits) * 0.01),
+                        index=pd.Index(np.arange(numVisits),
+                                       name='obsHistID'))
+
+
+def test_pixelCenters():
+    """check that the pixel centers are cached and cannot be changed"""
+    ra, dec = pixelCenters(16, nest=False)
+    assert ra is pixelCenters(16, nest=False)[0]
+    eqra, eqdec = hp.pix2ang(16, np.arange(hp.nside2npix(16)), lonlat=True)
+    assert_array_equal(ra, eqra)
+    assert_array_equal(dec, eqdec)
+    with pytest.raises(ValueError):
+        ra[0] = 0.
+
+
+@pytest.mark.parametrize('nest', (True, False))
+def test_visitCounts(nest):
+    """check the counts of the footprint pixels, computed in blocks by
+    several threads, against the counts of all pixels"""
+    pointings = _pointings()
+    nside = 32
+    tree = PointingTree(pointings.copy())
+    ra, dec = pixelCenters(nside, nest)
+    X = np.column_stack((np.radians(dec), np.radians(ra)))
+    counts = tree.tree.query_radius(X, r=np.radians(1.75), count_only=True)
+
+    footprint = footprintPixels(np.degrees(pointings._ra.values),
+                                np.degrees(pointings._dec.values), 1.75,
+                                nside, nest=nest, coarseNside=8)
+    assert np.all(np.diff(footprint) > 0)
+    assert set(np.flatnonzero(counts)) <= set(footprint)
+    assert len(footprint) < len(counts)
+
+    hids, fcounts = visitCounts(tree, nside=nside, nest=nest,
+                                coarseNside=8, blockSize=500, workers=2)
+    assert_array_equal(hids, footprint)
+    assert_array_equal(fcounts, counts[hids])
+
+    hids, rcounts = visitCounts(tree, nside=nside, nest=nest,
+                                radii=(1., 1.75), footprintOnly=False,
+                                blockSize=500, workers=1)
+    assert rcounts.shape == (len(counts), 2)
+    assert_array_equal(rcounts[:, 1], counts)
+    assert np.all(rcounts[:, 0] <= rcounts[:, 1])
+
+    # the children of coarse pixels are only defined for powers of 2
+    for n, coarse in ((48, 8), (32, 12)):
+        with pytest.raises(ValueError):
+            footprintPixels(np.degrees(pointings._ra.values),
+                            np.degrees(pointings._dec.values), 1.75, n,
+                            nest=nest, coarseNside=coarse)
+
+
+def test_observedVisitsinRegion():
+    """check that the pixels with at least `minVisits` are counted, and
+    that counts of several radii are columns of `visitCounts`"""
+    synopsim = SynOpSim(_pointings(), usePointingTree=True)
+    survey = synopsim.observedVisitsinRegion(nside=32, minVisits=0)
+    assert len(survey) == hp.nside2npix(32)
+    observed = synopsim.observedVisitsinRegion(nside=32, minVisits=1)
+    assert observed.equals(survey.query('numVisits >= 1'))
+
+    counts = synopsim.visitCounts(nside=32, radii=[1., 1.75])
+    assert list(counts.columns) == ['ra', 'dec', 'numVisits_1',
+                                    'numVisits_1.75']
+    assert_array_equal(counts.loc[observed.index, 'numVisits_1.75'],
+                       observed.numVisits)
+
+
+@pytest.mark.parametrize('nest', (True, False))
+def test_hierarchicalCounts(nest, monkeypatch):
+    """check that the counts are the same as those of `visitCounts` for
+    ranges of counts, while fewer pixels are counted"""
+    pointings = _pointings(numVisits=20000, numFields=100)
+    tree = PointingTree(pointings.copy())
+    nside = 128
+    hids, counts = visitCounts(tree, nside=nside, nest=nest,
+                               footprintOnly=False)
+
+    # record the number of pixels counted
+    queried = []
+    _counts = coverage._counts
+
+    def counting(pointingTree, X, radii, blockSize, workers):
+        queried.append(len(X))
+        return _counts(pointingTree, X, radii, blockSize, workers)
+    monkeypatch.setattr(coverage, '_counts', counting)
+
+    for minVisits, maxVisits in ((1, None), (0, None), (150, 250)):
+        del queried[:]
+        mask = counts >= minVisits
+        if maxVisits is not None:
+            mask &= counts <= maxVisits
+        hhids, hcounts = hierarchicalCounts(tree, nside=nside, nest=nest,
+                                            minVisits=minVisits,
+                                            maxVisits=maxVisits)
+        assert_array_equal(hhids, hids[mask])
+        assert_array_equal(hcounts, counts[mask])
+        assert sum(queried) < len(counts) / 2
+
+        hhids, hcounts = hierarchicalCounts(tree, nside=nside, nest=nest,
+                                            minVisits=minVisits,
+                                            maxVisits=maxVisits,
+                                            countsRequired=False)
+        assert_array_equal(hhids, hids[mask])
+        known = hcounts != -1
+        assert_array_equal(hcounts[known], counts[mask][known])
+
+    synopsim = SynOpSim(pointings, usePointingTree=True)
+    survey = synopsim.observedVisitsinRegion(nside=nside, nest=nest,
+                                             maxVisits=300)
+    hsurvey = synopsim.observedVisitsinRegion(nside=nside, nest=nest,
+                                              maxVisits=300,
+                                              hierarchical=True)
+    assert hsurvey.equals(survey)
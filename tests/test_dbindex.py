@@ -0,0 +1,109 @@
+""" Tests for the code in `opsimsummary/dbindex.py`
+"""
+from __future__ import print_function, division, absolute_import
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+import pytest
+from opsimsummary import (OpSimOutput, build_indexes, summary_indexes,
+                          sidecar_dbname, indexed_dbname, benchmark_indexes)
+
+
+def _make_db(dbname, numVisits=2000):
+    """write a small lsstv3 style database with a Summary table having
+    visits of proposals 1 (DDF) and 2 (WFD), and a Proposal table"""
+    rng = np.random.RandomState(0)
+    obsHistID = np.arange(numVisits)
+    summary = pd.DataFrame(dict(obsHistID=obsHistID,
+                                propID=rng.choice([1, 2], size=numVisits,
+                                                  p=[0.1, 0.9]),
+                                night=obsHistID // 50,
+                                expMJD=59580. + obsHistID / 50.,
+                                filter=rng.choice(list('ugrizy'),
+                                                  size=numVisits)))
+    proposals = pd.DataFrame(dict(propID=[1, 2],
+                                  propConf=['conf/survey/DDcosmology1.conf',
+                                            'conf/survey/Universal-18-0824B.conf']))
+    con = sqlite3.connect(dbname)
+    summary.to_sql('Summary', con, index=False)
+    proposals.to_sql('Proposal', con, index=False)
+    con.close()
+    return summary
+
+
+def test_build_indexes(tmpdir):
+    """check that indexes are built in the database and found"""
+    dbname = str(tmpdir.join('opsim.db'))
+    _make_db(dbname)
+    con = sqlite3.connect(dbname)
+    assert summary_indexes(con, 'Summary') == dict()
+    con.close()
+
+    assert build_indexes(dbname) == dbname
+    con = sqlite3.connect(dbname)
+    indexes = summary_indexes(con, 'Summary')
+    con.close()
+    assert sorted(indexes.keys()) == ['expMJD', 'night', 'propID']
+    # existing indexes are not built again
+    build_indexes(dbname)
+    con = sqlite3.connect(dbname)
+    assert summary_indexes(con, 'Summary') == indexes
+    con.close()
+    assert indexed_dbname(dbname) == dbname
+
+
+def test_sidecar(tmpdir):
+    """check that a sidecar database is used in place of the database while
+    it is up to date, and leaves the database unchanged"""
+    dbname = str(tmpdir.join('opsim.db'))
+    _make_db(dbname)
+    sidecar = build_indexes(dbname, sidecar=True)
+    assert sidecar == sidecar_dbname(dbname) == \
+        str(tmpdir.join('opsim_indexed.db'))
+    assert indexed_dbname(dbname) == sidecar
+    con = sqlite3.connect(dbname)
+    assert summary_indexes(con, 'Summary') == dict()
+    con.close()
+
+    # a sidecar older than the database is ignored
+    mtime = os.path.getmtime(sidecar)
+    os.utime(dbname, (mtime + 10., mtime + 10.))
+    assert indexed_dbname(dbname) == dbname
+
+
+@pytest.mark.parametrize("subset", ['ddf', 'wfd', 'combined'])
+def test_summary_query_notIndexed(subset, tmpdir):
+    """check that scanning the table gives the same visits as using the
+    index, and that large subsets are read by scanning the table"""
+    dbname = str(tmpdir.join('opsim.db'))
+    _make_db(dbname)
+    build_indexes(dbname)
+    opsimVars = OpSimOutput.get_opsimVariablesForVersion('lsstv3')
+    propIDs = dict(ddf=[1], wfd=[2], combined=[1, 2])[subset]
+    con = sqlite3.connect(dbname)
+    dfs = list(pd.read_sql_query(OpSimOutput._summary_query(
+        opsimVars, propIDs, subset, notIndexed=notIndexed), con)
+        for notIndexed in (False, True))
+    assert OpSimOutput._useTableScan(con, opsimVars, propIDs, subset) == \
+        (subset != 'ddf')
+    assert not OpSimOutput._useTableScan(con, opsimVars, propIDs, '_all')
+    con.close()
+    pd.testing.assert_frame_equal(dfs[0].sort_values('obsHistID')
+                                  .reset_index(drop=True),
+                                  dfs[1].sort_values('obsHistID')
+                                  .reset_index(drop=True))
+
+
+def test_benchmark_indexes(tmpdir):
+    """check the table of timings of queries"""
+    dbname = str(tmpdir.join('opsim.db'))
+    _make_db(dbname)
+    with pytest.raises(ValueError):
+        benchmark_indexes(dbname)
+    build_indexes(dbname)
+    df = benchmark_indexes(dbname, repeat=1)
+    assert list(df['query']) == ['subset ddf', 'subset wfd', 'subset combined',
+                                 'night range', 'mjd range']
+    assert list(df.loaderUsesIndex) == [True, False, False, True, True]
+    assert (df.numRows > 0).all()
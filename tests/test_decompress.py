@@ -0,0 +1,94 @@
+""" Tests for the code in `opsimsummary/decompress.py`
+"""
+from __future__ import print_function, division, absolute_import
+import os
+import bz2
+import gzip
+import lzma
+import sqlite3
+import numpy as np
+import pandas as pd
+import pytest
+from opsimsummary import (OpSimOutput, DecompressionCache,
+                          compression_format)
+
+
+def _make_db(dbname, num=500):
+    """write a database with a Summary table and return its contents"""
+    df = pd.DataFrame(dict(obsHistID=np.arange(num),
+                           expMJD=59580. + np.arange(num) / 50.))
+    con = sqlite3.connect(dbname)
+    df.to_sql('Summary', con, index=False)
+    con.close()
+    with open(dbname, 'rb') as fh:
+        return fh.read()
+
+
+def _compress(dbname, fmt):
+    """write a copy of `dbname` compressed in the format `fmt`"""
+    opener, ext = dict(gzip=(gzip.open, '.gz'), xz=(lzma.open, '.xz'),
+                       bz2=(bz2.open, '.bz2'))[fmt]
+    with open(dbname, 'rb') as src, opener(dbname + ext, 'wb') as dst:
+        dst.write(src.read())
+    return dbname + ext
+
+
+@pytest.mark.parametrize("fmt", ['gzip', 'xz', 'bz2'])
+def test_decompression_cache(fmt, tmpdir):
+    """check that compressed databases are decompressed once, and copies
+    with the same contents are shared"""
+    dbname = str(tmpdir.join('opsim.db'))
+    contents = _make_db(dbname)
+    compressed = _compress(dbname, fmt)
+    assert compression_format(compressed) == fmt
+    assert compression_format(dbname) is None
+
+    cache = DecompressionCache(str(tmpdir.join('cache')))
+    assert cache.get(dbname) == dbname
+    path = cache.get(compressed)
+    with open(path, 'rb') as fh:
+        assert fh.read() == contents
+    mtime = os.path.getmtime(path)
+    assert cache.get(compressed) == path
+    assert os.path.getmtime(path) == mtime
+    assert cache.get(_compress(dbname, 'gzip' if fmt != 'gzip' else 'xz')) \
+        == path
+    assert len(cache.entries()) == 1
+    assert cache.size() == len(contents)
+    cache.clear()
+    assert cache.entries() == []
+    assert cache.get(compressed) == path
+
+
+def test_decompression_cache_eviction(tmpdir):
+    """check that the least recently used copies are removed"""
+    cache = DecompressionCache(str(tmpdir.join('cache')))
+    paths = []
+    for i in range(3):
+        dbname = str(tmpdir.join('opsim{}.db'.format(i)))
+        _make_db(dbname, num=500 + i)
+        paths.append(cache.get(_compress(dbname, 'gzip')))
+        os.utime(paths[-1], (1000. + i, os.path.getmtime(paths[-1])))
+    # the first copy is used again
+    os.utime(paths[0], (2000., os.path.getmtime(paths[0])))
+    cache.max_bytes = sum(os.path.getsize(path) for path in paths[:2])
+    cache.evict()
+    assert list(os.path.exists(path) for path in paths) == [True, False, True]
+    cache.max_bytes = 0
+    cache.evict(keep=paths[2])
+    assert list(os.path.exists(path) for path in paths) == [False, False, True]
+
+
+def test_compressed_connection(tmpdir, monkeypatch):
+    """check that compressed databases are read by the loaders"""
+    monkeypatch.setenv('OPSIMSUMMARY_DECOMPRESSION_CACHE',
+                       str(tmpdir.join('cache')))
+    dbname = str(tmpdir.join('opsim.db'))
+    _make_db(dbname)
+    compressed = _compress(dbname, 'xz')
+    for backend in ('sqlite3', 'sqlalchemy'):
+        con = OpSimOutput._get_connection(compressed, backend=backend)
+        df = pd.read_sql_query('SELECT * FROM Summary', con=con)
+        assert len(df) == 500
+        if backend == 'sqlite3':
+            con.close()
@@ -0,0 +1,77 @@
+""" Tests for the code in `opsimsummary/ditherfile.py`
+"""
+from __future__ import print_function, division, absolute_import
+import pytest
+import numpy as np
+import pandas as pd
+from opsimsummary import (DitherTable, is_ditherfile, NormalizationPipeline,
+                          JoinDithers)
+
+
+def dithers(num=1000):
+    rng = np.random.RandomState(0)
+    obsHistID = rng.permutation(num) * 3 + 1
+    return pd.DataFrame(dict(ditheredRA=rng.uniform(0., 2. * np.pi, num),
+                             ditheredDec=rng.uniform(-1.5, 0.5, num)),
+                        index=pd.Index(obsHistID, name='obsHistID'))
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_ditherfile_roundtrip(tmpdir, mmap):
+    """check that dithers read back from the binary file and from a DESC csv
+    file are the same and sorted"""
+    df = dithers()
+    csvfile = str(tmpdir.join('descDithers.csv'))
+    df.reset_index().rename(columns=dict(obsHistID='observationId',
+                                         ditheredRA='descDitheredRA',
+                                         ditheredDec='descDitheredDec')
+                            ).to_csv(csvfile, index=False)
+    table = DitherTable.fromDESCCSV(csvfile)
+    assert not is_ditherfile(csvfile)
+
+    fname = str(tmpdir.join('dithers.dithers'))
+    table.write(fname)
+    assert is_ditherfile(fname)
+    table_read = DitherTable.read(fname, mmap=mmap)
+    assert isinstance(table_read.obsHistID, np.memmap) == mmap
+    expected = pd.read_csv(csvfile).sort_values('observationId')
+    np.testing.assert_array_equal(table_read.obsHistID,
+                                  expected.observationId.values)
+    np.testing.assert_array_equal(table_read.ditheredRA,
+                                  expected.descDitheredRA.values)
+    assert table_read.fingerprint() == DitherTable.fromFile(csvfile).fingerprint()
+
+
+def test_ditherfile_join():
+    """check the join against `pd.DataFrame.reindex`, and that missing or
+    duplicate visits raise"""
+    df = dithers()
+    table = DitherTable.fromDataFrame(df)
+    visits = df.index.values[::-2]
+    ra, dec = table.join(visits)
+    np.testing.assert_array_equal(ra, df.ditheredRA.reindex(visits).values)
+    np.testing.assert_array_equal(dec, df.ditheredDec.reindex(visits).values)
+
+    pos, found = table.positions(np.array([0, 1, 2, 3001]))
+    np.testing.assert_array_equal(found, [False, True, False, False])
+    with pytest.raises(ValueError):
+        table.join(np.array([1, 2]))
+    with pytest.raises(ValueError):
+        DitherTable.fromArrays([1, 2, 1], [0., 0., 0.], [0., 0., 0.])
+
+
+def test_JoinDithers():
+    """check that `JoinDithers` replaces the dithered columns like
+    `JoinColumns`"""
+    df = dithers()
+    summary = pd.DataFrame(dict(expMJD=np.arange(10.), ditheredRA=0.,
+                                ditheredDec=0., propID=1),
+                           index=pd.Index(df.index.values[:10],
+                                          name='obsHistID'))
+    pipeline = NormalizationPipeline([JoinDithers(DitherTable.fromDataFrame(df))])
+    result = pipeline.run(summary)
+    assert list(result.columns) == ['expMJD', 'propID', 'ditheredRA',
+                                    'ditheredDec']
+    np.testing.assert_array_equal(result.ditheredRA.values,
+                                  df.ditheredRA.values[:10])
+    assert 'joinDithers' in pipeline.timings
@@ -0,0 +1,113 @@
+""" Tests for the code in `opsimsummary/dithers.py`
+"""
+from __future__ import print_function, division, absolute_import
+import pytest
+import numpy as np
+import pandas as pd
+from opsimsummary import (DitherEngine, spherical_offsets, hex_pattern,
+                          spiral_pattern, OpSimOutput)
+
+
+def visits(num=2000):
+    rng = np.random.RandomState(0)
+    return dict(fieldRA=rng.uniform(0., 2. * np.pi, num),
+                fieldDec=np.arcsin(rng.uniform(-1., 1., num)),
+                obsHistID=np.arange(num),
+                night=np.arange(num) // 100,
+                propID=rng.choice([364, 366], size=num))
+
+
+def separation(ra1, dec1, ra2, dec2):
+    cossep = np.sin(dec1) * np.sin(dec2) + \
+        np.cos(dec1) * np.cos(dec2) * np.cos(ra1 - ra2)
+    return np.arccos(np.clip(cossep, -1., 1.))
+
+
+def test_spherical_offsets():
+    """check the distance and direction of offsets"""
+    ra, dec = spherical_offsets(np.array([1., 1.]), np.array([0.5, -1.5]),
+                                np.array([0.1, 0.1]),
+                                np.array([0., np.pi / 2.]))
+    np.testing.assert_allclose(dec[0], 0.6)
+    np.testing.assert_allclose(ra[0], 1.)
+    np.testing.assert_allclose(separation(1., -1.5, ra[1], dec[1]), 0.1)
+    assert ra[1] > 1.
+
+
+def test_patterns():
+    radius, angle = hex_pattern(3)
+    assert len(radius) == 37
+    assert radius[0] == 0.
+    assert radius.max() <= 1. + 1.0e-12
+    radius, angle = spiral_pattern(60)
+    assert len(radius) == 60
+    assert radius.max() < 1.
+
+
+@pytest.mark.parametrize("method", DitherEngine.methods())
+def test_dither_engine(method):
+    """check that the dithers are within the maximal offsets, and are the
+    same for a subset of visits"""
+    v = visits()
+    engine = DitherEngine(method, wfdRadius=1.75, ddfRadius=0.2,
+                          ddfPropIDs=366, seed=2)
+    ra, dec = engine.dither(v['fieldRA'], v['fieldDec'], v['obsHistID'],
+                            v['night'], v['propID'])
+    sep = np.degrees(separation(v['fieldRA'], v['fieldDec'], ra, dec))
+    maxRadius = np.where(v['propID'] == 366, 0.2, 1.75)
+    assert np.all(sep <= maxRadius * (1. + 1.0e-9))
+    assert np.all((ra >= 0.) & (ra < 2. * np.pi))
+
+    sub = slice(150, 450)
+    ra_sub, dec_sub = engine.dither(*(v[key][sub] for key in
+                                      ('fieldRA', 'fieldDec', 'obsHistID',
+                                       'night', 'propID')))
+    np.testing.assert_array_equal(ra_sub, ra[sub])
+    np.testing.assert_array_equal(dec_sub, dec[sub])
+
+    raDeg, decDeg = np.degrees(v['fieldRA']), np.degrees(v['fieldDec'])
+    ra_deg, dec_deg = engine.dither(raDeg, decDeg, v['obsHistID'],
+                                    v['night'], v['propID'],
+                                    angleUnit='degrees')
+    ra_rad, dec_rad = engine.dither(np.radians(raDeg), np.radians(decDeg),
+                                    v['obsHistID'], v['night'], v['propID'])
+    np.testing.assert_allclose(np.radians(dec_deg), dec_rad, atol=1.0e-12)
+
+
+def test_dither_timescales():
+    """check that offsets are shared on the timescale of the method"""
+    v = visits()
+    fraction, angle = DitherEngine('RandomPerNight').offsets(
+        v['obsHistID'], v['night'], v['fieldRA'], v['fieldDec'])
+    assert len(np.unique(angle)) == len(np.unique(v['night']))
+    fieldRA = np.tile(v['fieldRA'][:10], 200)
+    fraction, angle = DitherEngine('HexPerFieldPerNight').offsets(
+        v['obsHistID'], v['night'], fieldRA, np.zeros(len(fieldRA)))
+    groups = pd.DataFrame(dict(field=fieldRA, night=v['night'], angle=angle))
+    assert np.all(groups.groupby(['field', 'night']).angle.nunique() == 1)
+    assert np.all(groups.groupby('night').angle.nunique() > 1)
+    seeds = list(DitherEngine('RandomPerVisit', seed=seed).offsets(
+        v['obsHistID'], v['night'], v['fieldRA'], v['fieldDec'])[1]
+                 for seed in (1, 1, 2))
+    np.testing.assert_array_equal(seeds[0], seeds[1])
+    assert not np.any(seeds[0] == seeds[2])
+    with pytest.raises(ValueError):
+        DitherEngine('FlatSky')
+
+
+def test_get_dithercolumns_FlatSky():
+    """check that all visits are offset by the WFD scale in the FlatSky
+    method, as in earlier versions"""
+    v = visits()
+    summary = pd.DataFrame(dict(fieldRA=v['fieldRA'],
+                                fieldDec=v['fieldDec'], propID=v['propID'],
+                                night=v['night']),
+                           index=pd.Index(v['obsHistID'], name='obsHistID'))
+    df = OpSimOutput.get_dithercolumns(summary, 'lsstv3', method='FlatSky',
+                                       ddfId=366,
+                                       rng=np.random.RandomState(1))
+    offset = np.degrees(np.hypot(df.ditheredDec - summary.fieldDec,
+                                 np.mod(df.ditheredRA - summary.fieldRA
+                                        + np.pi, 2. * np.pi) - np.pi))
+    np.testing.assert_allclose(offset, 1.75)
+    assert np.all(df.ditheredRA < 2. * np.pi)
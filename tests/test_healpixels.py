@@ -0,0 +1,96 @@
+""" Tests for the code in `opsimsummary/healpixels.py`
+"""
+from __future__ import print_function, division, absolute_import
+import sqlite3
+import numpy as np
+import pandas as pd
+import healpy as hp
+import pytest
+import opsimsummary as oss
+from numpy.testing import assert_array_equal
+from opsimsummary import HealPixelizedOpSim
+
+
+def _pointings(numVisits=3000, numFields=200):
+    """visits to a set of fields, some of them dithered, in random time
+    order"""
+    rng = np.random.RandomState(0)
+    fieldra = rng.uniform(0., 2. * np.pi, size=numFields)
+    fielddec = np.arcsin(rng.uniform(-1., 0.2, size=numFields))
+    fields = rng.randint(0, numFields, size=numVisits)
+    ra = fieldra[fields]
+    dec = fielddec[fields]
+    dithered = rng.uniform(size=numVisits) < 0.3
+    ra[dithered] = (ra[dithered] + 0.01) % (2. * np.pi)
+    return pd.DataFrame(dict(_ra=ra, _dec=dec,
+                             expMJD=rng.permutation(numVisits) * 0.01),
+                        index=pd.Index(np.arange(numVisits) + 10,
+                                       name='obsHistID'))
+
+
+def test_HealPixelizedOpSim():
+    """check the visits of each pixel against `query_disc` for each visit,
+    and that they are in time order"""
+    pointings = _pointings()
+    nside = 32
+    hpo = HealPixelizedOpSim(pointings, NSIDE=nside)
+    assert hpo.opsimdf.expMJD.is_monotonic_increasing
+
+    visits = dict()
+    for obsHistID, ra, dec in zip(pointings.index.values,
+                                  np.degrees(pointings._ra.values),
+                                  np.degrees(pointings._dec.values)):
+        vec = hp.ang2vec(ra, dec, lonlat=True)
+        for pix in hp.query_disc(nside, vec, np.radians(1.75),
+                                 inclusive=True, nest=True):
+            visits.setdefault(pix, []).append(obsHistID)
+
+    assert_array_equal(hpo.hids, np.sort(list(visits.keys())))
+    assert hpo.indptr[-1] == sum(len(v) for v in visits.values())
+    expMJD = pointings.expMJD
+    for pix in hpo.hids[::7]:
+        expected = np.array(sorted(visits[pix], key=lambda x: expMJD[x]))
+        assert_array_equal(hpo.obsHistIdsForTile(pix), expected)
+        assert hpo.numVisits[pix] == len(expected)
+        assert hpo.visitsForTile(pix).expMJD.is_monotonic_increasing
+
+    unobserved = np.setdiff1d(np.arange(hp.nside2npix(nside)), hpo.hids)
+    assert len(hpo.obsHistIdsForTile(unobserved[0])) == 0
+
+
+def test_HealPixelizedOpSim_writeToDB(tmpdir):
+    """check that `writeToDB` writes the visits of each pixel"""
+    pointings = _pointings(numVisits=500)
+    hpo = HealPixelizedOpSim(pointings, NSIDE=16)
+    dbname = str(tmpdir.join('healpixels.db'))
+    hpo.writeToDB(dbname, chunkSize=1000)
+
+    con = sqlite3.connect(dbname)
+    df = pd.read_sql_query('SELECT * FROM simlib', con)
+    indexes = con.execute('PRAGMA index_list(simlib)').fetchall()
+    con.close()
+    assert len(df) == hpo.indptr[-1]
+    assert len(indexes) == 1
+    pix = hpo.hids[len(hpo.hids) // 2]
+    assert_array_equal(df.query('ipix == @pix').obsHistId.values,
+                       hpo.obsHistIdsForTile(pix))
+
+    with pytest.raises(ValueError):
+        HealPixelizedOpSim(pointings, raCol='ditheredRA')
+
+
+def test_HealPixelizedOpSim_fromOpSimDB(opsimdbs):
+    """check that the instance read from the database indexes its visits"""
+    dbname = opsimdbs['lsstv3']
+    hpo = HealPixelizedOpSim.fromOpSimDB(dbname, subset='combined', NSIDE=64)
+    opsout = oss.OpSimOutput.fromOpSimDB(dbname, subset='combined')
+    assert len(hpo.opsimdf) == len(opsout.summary)
+    pix = hpo.numVisits.idxmax()
+    ra, dec = hp.pix2ang(64, pix, nest=True, lonlat=True)
+    vec = hp.ang2vec(ra, dec, lonlat=True)
+    vecs = hp.ang2vec(np.degrees(opsout.summary._ra.values),
+                      np.degrees(opsout.summary._dec.values), lonlat=True)
+    # visits whose centers are well within the field of view of the pixel
+    inside = opsout.summary.index.values[np.dot(vecs, vec) >
+                                         np.cos(np.radians(1.6))]
+    assert set(inside) <= set(hpo.obsHistIdsForTile(pix))
@@ -2,6 +2,7 @@
 """
 from __future__ import print_function, division, absolute_import
 import os
+import sqlite3
 import pytest
 import numpy as np
 import pandas as pd
@@ -56,3 +57,435 @@ def test_OpSimOutput_fromOmSimDB(fname, opsimversion, tableName, expected):
         assert opsout.summary[pointingRA].max() > 10.
     elif opsout.opsimVars['angleUnit'] == 'radians':
         assert opsout.summary[pointingDec].max() < 2.* np.pi + 1.0e-5
+
+
+def test_fromOpSimDB_columns(opsimdb):
+    """check that reading a subset of columns gives the same values as
+    reading all columns and then selecting them, and that columns required
+    for the pointings are added"""
+    fname, opsimversion = opsimdb
+    columns = ['expMJD', 'filter', 'fiveSigmaDepth', 'FWHMeff', 'night']
+    opsout = OpSimOutput.fromOpSimDB(fname, opsimversion=opsimversion,
+                                     columns=columns)
+    opsout_all = OpSimOutput.fromOpSimDB(fname, opsimversion=opsimversion)
+    summary = opsout.summary
+    for col in columns + ['_ra', '_dec', 'propID']:
+        assert col in summary.columns
+    assert len(summary.columns) < len(opsout_all.summary.columns)
+    assert opsout_all.summary[summary.columns].equals(summary)
+
+    with pytest.raises(ValueError):
+        OpSimOutput.fromOpSimDB(fname, opsimversion=opsimversion,
+                                columns=['notAColumn'])
+
+
+def test_iter_summary(opsimdb):
+    """check that the chunks from `iter_summary` put together give the
+    same summary as `fromOpSimDB` even with duplicates across chunks"""
+    fname, opsimversion = opsimdb
+    opsout = OpSimOutput.fromOpSimDB(fname, opsimversion=opsimversion)
+    chunks = list(OpSimOutput.iter_summary(fname, chunksize=1001,
+                                           opsimversion=opsimversion))
+    assert len(chunks) > 1
+    summary = pd.concat(chunks)
+    assert summary.index.is_unique
+    assert len(summary) == len(opsout.summary)
+    assert summary.sort_index().equals(opsout.summary.sort_index())
+
+
+def test_fromOpSimDB_sqlite3_backend(opsimdb):
+    """check that the `sqlite3` backend gives the same summary as the
+    default `sqlalchemy` backend"""
+    fname, opsimversion = opsimdb
+    opsout = OpSimOutput.fromOpSimDB(fname, opsimversion=opsimversion)
+    opsout_sq = OpSimOutput.fromOpSimDB(fname, opsimversion=opsimversion,
+                                        backend='sqlite3')
+    assert opsout_sq.summary.equals(opsout.summary)
+    assert opsout_sq.propIDDict == opsout.propIDDict
+
+
+def test_fromOpSimDB_cache(opsimdb, tmpdir):
+    """check that summaries read from the cache are the same as those read
+    from the database, and that changing options creates new entries"""
+    fname, opsimversion = opsimdb
+    cache_dir = str(tmpdir.join('cache'))
+    opsout = OpSimOutput.fromOpSimDB(fname, opsimversion=opsimversion)
+    opsout_first = OpSimOutput.fromOpSimDB(fname, opsimversion=opsimversion,
+                                           cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 1
+    opsout_cached = OpSimOutput.fromOpSimDB(fname, opsimversion=opsimversion,
+                                            cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 1
+    assert opsout_first.summary.equals(opsout.summary)
+    assert opsout_cached.summary.equals(opsout.summary)
+    assert opsout_cached.proposalTable.equals(opsout.proposalTable)
+
+    # the sqlalchemy URL of the database has the same entry
+    opsout_url = OpSimOutput.fromOpSimDB('sqlite:///' + fname,
+                                         opsimversion=opsimversion,
+                                         cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 1
+    assert opsout_url.summary.equals(opsout.summary)
+
+    OpSimOutput.fromOpSimDB(fname, opsimversion=opsimversion, subset='ddf',
+                            cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_fromOpSimDB_cache_subsetView(opsimdbs, tmpdir):
+    """check that summaries read from the cache keep the setting of
+    `zeroDDFDithers`, so that subsets taken from them are those of the
+    database"""
+    fname = opsimdbs['lsstv3']
+    cache_dir = str(tmpdir.join('cache'))
+    for i in range(2):
+        _all = OpSimOutput.fromOpSimDB(fname, subset='_all',
+                                       cache_dir=cache_dir)
+        assert _all.zeroDDFDithers
+        with pytest.raises(ValueError):
+            _all.subsetView('wfd')
+    assert _all.subsetView('combined').summary.equals(
+        OpSimOutput.fromOpSimDB(fname, subset='combined').summary)
+
+    wfd = OpSimOutput.fromOpSimDB(fname, subset='wfd')
+    for i in range(2):
+        _all = OpSimOutput.fromOpSimDB(fname, subset='_all',
+                                       zeroDDFDithers=False,
+                                       cache_dir=cache_dir)
+        assert not _all.zeroDDFDithers
+        assert _all.subsetView('wfd').summary.equals(wfd.summary)
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_fromOpSimDB_compact(opsimdb):
+    """check the types of the `compact` dtype profile, and that the values
+    of columns needed for simlibs are unchanged"""
+    fname, opsimversion = opsimdb
+    opsout = OpSimOutput.fromOpSimDB(fname, opsimversion=opsimversion)
+    opsout_c = OpSimOutput.fromOpSimDB(fname, opsimversion=opsimversion,
+                                       dtype_profile='compact')
+    summary = opsout_c.summary
+    assert opsout_c.memorySaved > 0
+    assert summary.index.dtype == np.int32
+    assert summary.propID.dtype == np.int32
+    assert isinstance(summary['filter'].dtype, pd.CategoricalDtype)
+    assert 'y' not in summary['filter'].cat.categories
+    for col in ('expMJD', 'fiveSigmaDepth', 'filtSkyBrightness', 'FWHMeff',
+                '_ra', '_dec'):
+        assert summary[col].dtype == np.float64
+        np.testing.assert_array_equal(summary[col].values,
+                                      opsout.summary[col].values)
+
+    with pytest.raises(ValueError):
+        OpSimOutput.fromOpSimDB(fname, opsimversion=opsimversion,
+                                dtype_profile='notAProfile')
+
+
+def test_fromOpSimDB_add_dithers(opsimdbs):
+    """check that dithers in the database are kept by `add_dithers` unless
+    `replace_dithers`, and the default scales of the dithers created"""
+    fname = opsimdbs['lsstv3']
+    opsout = OpSimOutput.fromOpSimDB(fname, subset='_all',
+                                     zeroDDFDithers=False)
+    summary = opsout.summary
+    opsout_add = OpSimOutput.fromOpSimDB(fname, subset='_all',
+                                         zeroDDFDithers=False,
+                                         add_dithers=True)
+    assert opsout_add.summary.equals(summary)
+    for subset in ('wfd', 'combined'):
+        expected = OpSimOutput.fromOpSimDB(fname, subset=subset)
+        assert OpSimOutput.fromOpSimDB(fname, subset=subset,
+                                       add_dithers=True,
+                                       method='FlatSky').summary.equals(
+                                           expected.summary)
+
+    replaced = OpSimOutput.fromOpSimDB(fname, subset='_all',
+                                       zeroDDFDithers=False, add_dithers=True,
+                                       method='RandomPerVisit',
+                                       replace_dithers=True).summary
+    assert not np.any(replaced.ditheredRA.values == summary.ditheredRA.values)
+    offset = np.degrees(np.arccos(np.clip(
+        np.sin(replaced.fieldDec) * np.sin(replaced.ditheredDec) +
+        np.cos(replaced.fieldDec) * np.cos(replaced.ditheredDec) *
+        np.cos(replaced.fieldRA - replaced.ditheredRA), -1., 1.)))
+    ddf = replaced.propID.values == 366
+    assert offset[ddf].max() <= 0.2 + 1.0e-8
+    assert offset[~ddf].max() <= 1.75 + 1.0e-8
+    assert offset[~ddf].max() > 0.2
+
+    # FlatSky offsets all visits by the WFD scale of 0.2 degrees
+    flat = OpSimOutput.fromOpSimDB(opsimdbs['sstf'], opsimversion='sstf',
+                                   method='FlatSky').summary
+    offset = np.hypot(flat.ditheredDec - flat.fieldDec,
+                      np.mod(flat.ditheredRA - flat.fieldRA + 180., 360.)
+                      - 180.)
+    np.testing.assert_allclose(offset, 0.2)
+
+
+def test_dropDuplicates():
+    """check that shared visits keep the DDF row over the WFD row, and
+    the WFD row over other proposals, with the result ordered by expMJD"""
+    df = pd.DataFrame(dict(obsHistID=[3, 3, 1, 2, 2, 1, 4, 4],
+                           propID=[364, 366, 362, 362, 364, 364, 362, 363],
+                           expMJD=[3., 3., 1., 2., 2., 1., 0.5, 0.5],
+                           fiveSigmaDepth=np.arange(8.)))
+    propIDDict = dict(ddf=366, wfd=364)
+    res = OpSimOutput.dropDuplicates(df, propIDDict, 'lsstv3')
+    assert list(res.obsHistID) == [4, 1, 2, 3]
+    assert list(res.propID) == [362, 364, 364, 366]
+    assert list(res.fiveSigmaDepth) == [6., 5., 4., 1.]
+    assert res.columns[-1] == 'propID'
+    assert OpSimOutput.dropDuplicates(df, propIDDict, 'sstf') is df
+
+
+def test_summary_query_dedup(tmpdir):
+    """check that dropping duplicates in the sql query keeps the same rows
+    as `dropDuplicates`"""
+    df = pd.DataFrame(dict(obsHistID=[3, 3, 1, 2, 2, 1, 4, 4, 5],
+                           propID=[364, 366, 362, 362, 364, 364, 362, 363, 366],
+                           expMJD=[3., 3., 1., 2., 2., 1., 0.5, 0.5, 0.1],
+                           fiveSigmaDepth=np.arange(9.)))
+    dbname = str(tmpdir.join('summary.db'))
+    engine = create_engine('sqlite:///' + dbname)
+    df.to_sql('Summary', con=engine, index=False)
+    opsimVars = OpSimOutput.get_opsimVariablesForVersion('lsstv3')
+    propIDDict = dict(ddf=366, wfd=364)
+    sql_query = OpSimOutput._summary_query(opsimVars, (362, 363, 364, 366),
+                                           'combined', columns=list(df.columns),
+                                           dedupPropIDDict=propIDDict)
+    res = pd.read_sql_query(sql_query, con=engine)
+    expected = OpSimOutput.dropDuplicates(df, propIDDict, 'lsstv3')
+    expected = expected.reset_index(drop=True)[list(df.columns)]
+    assert res.equals(expected)
+
+
+def test_fromOpSimDB_validation(opsimdb):
+    """check that the validation level does not change the summary and that
+    the checks are timed"""
+    fname, opsimversion = opsimdb
+    opsout = OpSimOutput.fromOpSimDB(fname, opsimversion=opsimversion)
+    opsout_off = OpSimOutput.fromOpSimDB(fname, opsimversion=opsimversion,
+                                         validation='off')
+    assert opsout_off.summary.equals(opsout.summary)
+    assert len(opsout_off.validationTimings) == 0
+    assert 'angles' in opsout.validationTimings
+
+
+@pytest.mark.parametrize("subset", ['_all', 'ddf', 'wfd', 'combined'])
+def test_OpSimColumnar(subset, opsimdbs, tmpdir):
+    """check that subsets read from the columnar output of the entire
+    OpSim output are the same as those read from the database"""
+    fname = opsimdbs['lsstv3']
+    dirname = str(tmpdir.join('columnar'))
+    opsout_all = OpSimOutput.fromOpSimDB(fname, subset='_all',
+                                         zeroDDFDithers=False)
+    opsout_all.writeOpSimColumnar(dirname, partitionBy='propID',
+                                  rowGroupSize=5000)
+    opsout = OpSimOutput.fromOpSimDB(fname, subset=subset)
+    opsout_col = OpSimOutput.fromOpSimColumnar(dirname, subset=subset)
+    assert opsout_col.summary.equals(opsout.summary)
+    assert opsout_col.propIDDict == opsout.propIDDict
+
+    opsout_sel = OpSimOutput.fromOpSimColumnar(dirname, subset=subset,
+                                               night_range=(10, 100),
+                                               filters=['g', 'r'])
+    expected = opsout.summary.query('night >= 10 and night <= 100 and '
+                                    'filter in ["g", "r"]')
+    assert opsout_sel.summary.equals(expected)
+
+
+def test_filter_stats_query(tmpdir):
+    """check that the aggregate query counts visits shared between
+    proposals once"""
+    df = pd.DataFrame(dict(obsHistID=[3, 3, 1, 2, 2, 1, 4, 5],
+                           propID=[364, 366, 364, 362, 364, 366, 362, 366],
+                           expMJD=[3., 3., 1., 2., 2., 1., 0.5, 0.1],
+                           filter=list('rrggggrr'),
+                           fiveSigmaDepth=[1., 1., 2., 3., 3., 2., 4., None]))
+    dbname = str(tmpdir.join('summary.db'))
+    engine = create_engine('sqlite:///' + dbname)
+    df.to_sql('Summary', con=engine, index=False)
+    opsimVars = OpSimOutput.get_opsimVariablesForVersion('lsstv3')
+    sql_query = OpSimOutput._filter_stats_query(opsimVars, (364, 366),
+                                                'combined', 'lsstv3')
+    res = pd.read_sql_query(sql_query, con=engine).set_index('filter')
+    assert res.numVisits.to_dict() == dict(g=2, r=2)
+    assert res.minMJD.to_dict() == dict(g=1., r=0.1)
+    sql_query = OpSimOutput._filter_stats_query(opsimVars, (364, 366),
+                                                '_all', 'lsstv3',
+                                                filterNull=True)
+    res = pd.read_sql_query(sql_query, con=engine).set_index('filter')
+    assert res.numVisits.to_dict() == dict(g=4, r=3)
+
+
+def test_fromOpSimDB_lazy(opsimdb):
+    """check that lazy instances give the same statistics before reading
+    the summary, and the same summary"""
+    fname, opsimversion = opsimdb
+    opsout = OpSimOutput.fromOpSimDB(fname, opsimversion=opsimversion)
+    opsout_lazy = OpSimOutput.fromOpSimDB(fname, opsimversion=opsimversion,
+                                          lazy=True)
+    assert opsout_lazy.propIDDict == opsout.propIDDict
+    assert opsout_lazy.filterStatistics.equals(opsout.filterStatistics)
+    assert opsout_lazy.numVisits == len(opsout.summary)
+    assert not opsout_lazy.isLoaded
+    assert opsout_lazy.summary.equals(opsout.summary)
+    assert opsout_lazy.isLoaded
+
+
+def test_summary_predicates(tmpdir):
+    """check that the sql conditions select the visits in ranges of time and
+    position, including ranges of right ascension wrapping around 0"""
+    rng = np.random.RandomState(0)
+    num = 1000
+    df = pd.DataFrame(dict(obsHistID=np.arange(num),
+                           propID=rng.choice([364, 366], size=num),
+                           expMJD=59580. + rng.uniform(0., 100., size=num),
+                           night=rng.randint(0, 100, size=num),
+                           filter=rng.choice(list('ugrizy'), size=num),
+                           ditheredRA=rng.uniform(0., 2. * np.pi, size=num),
+                           ditheredDec=np.arcsin(rng.uniform(-1., 0.5,
+                                                             size=num))))
+    engine = create_engine('sqlite:///' + str(tmpdir.join('summary.db')))
+    df.to_sql('Summary', con=engine, index=False)
+    opsimVars = OpSimOutput.get_opsimVariablesForVersion('lsstv3')
+
+    def select(**kwargs):
+        predicates = OpSimOutput._summary_predicates(opsimVars, **kwargs)
+        sql_query = OpSimOutput._summary_query(opsimVars, (364, 366),
+                                               'combined',
+                                               predicates=predicates)
+        return np.sort(pd.read_sql_query(sql_query, con=engine)
+                       .obsHistID.values)
+
+    expected = df.query('expMJD >= 59590. and expMJD <= 59600.5')
+    assert np.array_equal(select(mjd_range=(59590., 59600.5)),
+                          np.sort(expected.obsHistID.values))
+    expected = df.query('night >= 10 and night <= 20 and '
+                        'filter in ["g", "r"]')
+    assert np.array_equal(select(night_range=(10, 20), filters=['g', 'r']),
+                          np.sort(expected.obsHistID.values))
+    expected = df.query('propID == 366')
+    assert np.array_equal(select(where='propID = 366'),
+                          np.sort(expected.obsHistID.values))
+    for ra_range, dec_range in (((350., 20.), None), ((-10., 20.), None),
+                                ((30., 90.), (-40., -10.)),
+                                ((0., 360.), (-90., -60.))):
+        mask = OpSimOutput._sky_mask(df.ditheredRA.values,
+                                     df.ditheredDec.values,
+                                     ra_range=ra_range, dec_range=dec_range)
+        assert 0 < mask.sum() < num
+        assert np.array_equal(select(ra_range=ra_range, dec_range=dec_range),
+                              np.sort(df.obsHistID.values[mask]))
+    ra = np.degrees(df.ditheredRA.values)
+    assert np.array_equal(OpSimOutput._sky_mask(df.ditheredRA.values,
+                                                df.ditheredDec.values,
+                                                ra_range=(350., 20.)),
+                          (ra >= 350.) | (ra <= 20.))
+    with pytest.raises(ValueError):
+        OpSimOutput._summary_predicates(opsimVars, mjd_range=(59600., 59590.))
+    with pytest.raises(ValueError):
+        OpSimOutput._summary_predicates(opsimVars, dec_range=(10., -10.))
+
+
+def test_fromOpSimDB_predicates(opsimdb):
+    """check that visits selected in the sql query are those selected from
+    the summary"""
+    fname, opsimversion = opsimdb
+    summary = OpSimOutput.fromOpSimDB(fname, opsimversion=opsimversion).summary
+    mjd_range = (summary.expMJD.min() + 10., summary.expMJD.min() + 40.)
+    opsout = OpSimOutput.fromOpSimDB(fname, opsimversion=opsimversion,
+                                     mjd_range=mjd_range, filters=['g', 'r'],
+                                     ra_range=(300., 60.))
+    ra = np.degrees(summary._ra.values)
+    selected = summary.expMJD.between(*mjd_range).values & \
+        summary['filter'].isin(['g', 'r']).values
+    mask = selected & ((ra >= 300.) | (ra <= 60.))
+    assert opsout.summary.index.equals(summary.index[mask])
+    chunks = list(OpSimOutput.iter_summary(fname, opsimversion=opsimversion,
+                                           mjd_range=mjd_range,
+                                           filters=['g', 'r'],
+                                           ra_range=(300., 60.)))
+    assert sum(len(chunk) for chunk in chunks) == mask.sum()
+    opsout_lazy = OpSimOutput.fromOpSimDB(fname, opsimversion=opsimversion,
+                                          mjd_range=mjd_range,
+                                          filters=['g', 'r'], lazy=True)
+    assert opsout_lazy.numVisits == selected.sum()
+    assert not opsout_lazy.isLoaded
+
+
+def test_subsetView(opsimdb):
+    """check that subsets taken from a summary in memory are the same as
+    those read from the database, and that subsets which cannot be taken
+    raise an error"""
+    fname, opsimversion = opsimdb
+    combined = OpSimOutput.fromOpSimDB(fname, opsimversion=opsimversion,
+                                       subset='combined')
+    ddf = OpSimOutput.fromOpSimDB(fname, opsimversion=opsimversion,
+                                  subset='ddf')
+    view = combined.subsetView('ddf')
+    assert view.subset == 'ddf'
+    assert view.summary.equals(ddf.summary)
+    assert combined.subsetView('combined').summary.equals(combined.summary)
+    with pytest.raises(ValueError):
+        ddf.subsetView('combined')
+    if opsimversion != 'sstf':
+        with pytest.raises(ValueError):
+            combined.subsetView('wfd')
+
+    if opsimversion != 'lsstv3':
+        return
+    _all = OpSimOutput.fromOpSimDB(fname, opsimversion=opsimversion,
+                                   subset='_all', zeroDDFDithers=False)
+    for subset in ('ddf', 'wfd', 'combined'):
+        expected = OpSimOutput.fromOpSimDB(fname, opsimversion=opsimversion,
+                                           subset=subset)
+        view = _all.subsetView(subset, zeroDDFDithers=True)
+        assert view.summary.equals(expected.summary)
+    with pytest.raises(ValueError):
+        combined.subsetView('ddf', zeroDDFDithers=False)
+
+
+@pytest.mark.parametrize("read_pool", ['process', 'thread'])
+def test_read_summary_partitioned(read_pool, tmpdir):
+    """check that ranges of rows read concurrently give the rows of a
+    single read in the same order and types"""
+    num = 1000
+    df = pd.DataFrame(dict(obsHistID=np.arange(num) // 2,
+                           propID=np.tile([364, 366], num // 2),
+                           expMJD=59580. + np.arange(num) / 100.,
+                           filter=np.array(list('ugrizy'))[np.arange(num) % 6],
+                           moonAlt=np.where(np.arange(num) < 600, np.nan,
+                                            1.)))
+    dbname = str(tmpdir.join('summary.db'))
+    engine = create_engine('sqlite:///' + dbname)
+    df.to_sql('Summary', con=engine, index=False)
+    con = sqlite3.connect(dbname)
+    assert OpSimOutput._rowid_ranges(con, 'Summary', 3) == \
+        [(1, 334), (334, 667), (667, 1001)]
+    con.close()
+    opsimVars = OpSimOutput.get_opsimVariablesForVersion('lsstv3')
+    for subset, propIDs in (('_all', None), ('ddf', [366])):
+        summary = OpSimOutput._read_summary_partitioned(
+            dbname, opsimVars, propIDs, subset, read_workers=3,
+            read_pool=read_pool)
+        expected = df if propIDs is None else df.query('propID == 366')
+        pd.testing.assert_frame_equal(summary,
+                                      expected.reset_index(drop=True))
+    with pytest.raises(ValueError):
+        OpSimOutput._read_summary_partitioned(dbname, opsimVars, None,
+                                              '_all', read_pool='fork')
+
+
+def test_fromOpSimDB_read_workers(opsimdb):
+    """check that summaries read from ranges of rows in parallel are the
+    same as those read sequentially"""
+    fname, opsimversion = opsimdb
+    for subset in ('ddf', 'combined'):
+        opsout = OpSimOutput.fromOpSimDB(fname, opsimversion=opsimversion,
+                                         subset=subset)
+        opsout_parallel = OpSimOutput.fromOpSimDB(fname,
+                                                  opsimversion=opsimversion,
+                                                  subset=subset,
+                                                  read_workers=3)
+        assert opsout_parallel.summary.equals(opsout.summary)
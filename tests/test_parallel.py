@@ -0,0 +1,26 @@
+""" Tests for the code in `opsimsummary/parallel.py`
+"""
+from __future__ import print_function, division, absolute_import
+import pytest
+from opsimsummary import OpSimOutput, load_many
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_load_many(max_workers, opsimdbs, tmpdir):
+    """check that summaries read concurrently are the same as those read
+    one after another, and that statistics are recorded"""
+    versions = ['lsstv3', 'sstf']
+    fnames = list(opsimdbs[version] for version in versions)
+    outputs, stats = load_many(fnames, opsimversion=versions, subset='ddf',
+                               max_workers=max_workers,
+                               cache_dir=str(tmpdir.join('cache')))
+    assert len(outputs) == len(stats) == 2
+    for opsout, fname, version in zip(outputs, fnames, versions):
+        expected = OpSimOutput.fromOpSimDB(fname, opsimversion=version,
+                                           subset='ddf')
+        assert opsout.summary.equals(expected.summary)
+    assert list(stats.numVisits) == list(len(opsout.summary)
+                                         for opsout in outputs)
+    assert (stats.readSeconds > 0.).all()
+    # the peak memory is only that of a single read in a new process
+    assert stats.maxRSSMB.isnull().all() == (max_workers == 1)
@@ -0,0 +1,71 @@
+""" Tests for the code in `opsimsummary/pipeline.py`
+"""
+from __future__ import print_function, division, absolute_import
+import pytest
+import numpy as np
+import pandas as pd
+from opsimsummary import (NormalizationPipeline, FilterNull, RenameColumns,
+                          DropDuplicateVisits, SetIndex, JoinColumns,
+                          ZeroDDFDithers, RadianCoordinates, OpSimOutput)
+
+
+def raw_summary():
+    """summary table as read from an OpSim v4 like database with a shared
+    visit and a null depth"""
+    return pd.DataFrame(dict(observationId=[3, 3, 1, 2, 4],
+                             proposalId=[2, 5, 2, 3, 2],
+                             observationStartMJD=[3., 3., 1., 2., 4.],
+                             fieldRA=[10., 10., 20., 30., 40.],
+                             fieldDec=[-10., -10., -20., -30., -40.],
+                             fiveSigmaDepth=[24., 24., np.nan, 23., 22.],
+                             filter=list('rrgiz')))
+
+
+def test_pipeline_matches_pandas():
+    """check the pipeline against the same steps done with pandas"""
+    raw = raw_summary()
+    propIDDict = dict(ddf=5, wfd=2)
+    rename = dict(observationId='obsHistID', proposalId='propID',
+                  observationStartMJD='expMJD')
+    dithers = pd.DataFrame(dict(ditheredRA=[11., 21., 31., 41.],
+                                ditheredDec=[-11., -21., -31., -41.]),
+                           index=pd.Index([3, 1, 2, 4], name='obsHistID'))
+    pipeline = NormalizationPipeline([FilterNull('fiveSigmaDepth'),
+                                      RenameColumns(rename),
+                                      DropDuplicateVisits(propIDDict),
+                                      SetIndex('obsHistID'),
+                                      JoinColumns(dithers)])
+    summary = pipeline.run(raw)
+
+    expected = raw[np.isfinite(raw.fiveSigmaDepth)].rename(columns=rename)
+    expected = OpSimOutput.dropDuplicates(expected, propIDDict, 'lsstv4')
+    expected = expected.set_index('obsHistID').join(dithers)
+    assert summary.equals(expected)
+    assert list(summary.columns) == list(expected.columns)
+    assert summary.loc[3, 'propID'] == 5
+    assert list(pipeline.timings.keys()) == ['filterNull', 'rename',
+                                             'dropDuplicates', 'setIndex',
+                                             'join', 'materialize']
+    # the input is unchanged
+    assert raw.equals(raw_summary())
+
+
+def test_pipeline_inplace():
+    """check the stages used by the constructor change the frame inplace"""
+    summary = raw_summary().rename(columns=dict(proposalId='propID'))
+    summary['ditheredRA'] = summary.fieldRA + 1.
+    summary['ditheredDec'] = summary.fieldDec + 1.
+    pipeline = NormalizationPipeline([ZeroDDFDithers(5),
+                                      RadianCoordinates('degrees')])
+    res = pipeline.run(summary, inplace=True)
+    assert res is summary
+    np.testing.assert_array_equal(summary.ditheredRA.values,
+                                  [11., 10., 21., 31., 41.])
+    np.testing.assert_allclose(summary._dec.values,
+                               np.radians(summary.ditheredDec.values))
+    assert list(summary.columns[-2:]) == ['_ra', '_dec']
+
+    with pytest.raises(ValueError):
+        NormalizationPipeline([FilterNull()]).run(summary, inplace=True)
+    with pytest.raises(ValueError):
+        RadianCoordinates('arcsec')
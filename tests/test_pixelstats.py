@@ -0,0 +1,107 @@
+""" Tests for the code in `opsimsummary/pixelstats.py`
+"""
+from __future__ import print_function, division, absolute_import
+import numpy as np
+import pandas as pd
+import healpy as hp
+import pytest
+from numpy.testing import assert_allclose, assert_array_equal
+from opsimsummary import (SynOpSim, HealPixelizedOpSim, aggregateVisits,
+                          statisticsMaps)
+
+
+def _visits(numVisits=3000, numFields=100):
+    """visits to fields in part of the sky, with the columns used by the
+    default statistics"""
+    rng = np.random.RandomState(2)
+    fieldra = rng.uniform(0., np.pi, size=numFields)
+    fielddec = np.arcsin(rng.uniform(-1., 0., size=numFields))
+    fields = rng.randint(0, numFields, size=numVisits)
+    expMJD = 59580. + np.sort(rng.uniform(0., 365., size=numVisits))
+    return pd.DataFrame(dict(_ra=fieldra[fields], _dec=fielddec[fields],
+                             expMJD=expMJD,
+                             night=np.floor(expMJD - 59580.).astype(int),
+                             filter=rng.choice(list('ugrizy'),
+                                               size=numVisits),
+                             fiveSigmaDepth=rng.normal(24., 0.5,
+                                                       size=numVisits),
+                             FWHMeff=rng.uniform(0.6, 1.2, size=numVisits)),
+                        index=pd.Index(np.arange(numVisits),
+                                       name='obsHistID'))
+
+
+def _expected(visits):
+    """statistics of the visits in each filter computed with pandas"""
+    g = visits.groupby('filter')
+    coadd = g.fiveSigmaDepth.apply(
+        lambda m5: 1.25 * np.log10(np.sum(10.**(0.8 * m5))))
+    return pd.DataFrame(dict(numVisits=g.size(), coaddedDepth=coadd,
+                             medianFWHMeff=g.FWHMeff.median(),
+                             firstMJD=g.expMJD.min(), lastMJD=g.expMJD.max(),
+                             numNights=g.night.nunique()))
+
+
+def test_pixelStatistics():
+    """check the statistics of pixels against those computed from the
+    visits within the field of view of the pixel centers"""
+    visits = _visits()
+    synopsim = SynOpSim(visits, usePointingTree=True)
+    nside = 32
+    stats = synopsim.pixelStatistics(nside=nside, workers=2)
+    assert list(stats.columns) == ['hid', 'filter', 'numVisits',
+                                   'coaddedDepth', 'medianFWHMeff',
+                                   'firstMJD', 'lastMJD', 'numNights']
+    survey = synopsim.observedVisitsinRegion(nside=nside)
+    assert_array_equal(stats.groupby('hid').numVisits.sum(),
+                       survey.numVisits)
+
+    vecs = hp.ang2vec(np.degrees(visits._ra.values),
+                      np.degrees(visits._dec.values), lonlat=True)
+    for hid in survey.index.values[::20]:
+        vec = hp.ang2vec(survey.ra[hid], survey.dec[hid], lonlat=True)
+        inside = np.dot(vecs, vec) >= np.cos(np.radians(1.75))
+        expected = _expected(visits[inside])
+        result = stats.query('hid == @hid').set_index('filter')
+        assert_array_equal(result.index, expected.index)
+        for col in expected.columns:
+            assert_allclose(result[col].values, expected[col].values)
+
+    maps = synopsim.pixelStatistics(nside=nside, maps=True)
+    assert sorted(maps['coaddedDepth']) == sorted('ugrizy')
+    hmap = maps['numNights']['r']
+    rstats = stats.query('filter == "r"')
+    assert_array_equal(hmap[rstats.hid.values], rstats.numNights.values)
+    assert np.sum(hmap != hp.UNSEEN) == len(rstats)
+
+
+def test_aggregateVisits():
+    """check the statistics of the visits of the pixels of a
+    `HealPixelizedOpSim` and of other reducers"""
+    visits = _visits(numVisits=500)
+    hpo = HealPixelizedOpSim(visits, NSIDE=16)
+    stats = hpo.statistics()
+    for hid in hpo.hids[::10]:
+        expected = _expected(hpo.visitsForTile(hid))
+        result = stats.query('hid == @hid').set_index('filter')
+        for col in expected.columns:
+            assert_allclose(result[col].values, expected[col].values)
+
+    reducers = dict(meanDepth=('fiveSigmaDepth', 'mean'),
+                    sumMJD=('expMJD', 'sum'))
+    stats = aggregateVisits(hpo.opsimdf, hpo.hids, hpo.indptr, hpo.rows,
+                            reducers=reducers)
+    hid = hpo.hids[0]
+    g = hpo.visitsForTile(hid).groupby('filter')
+    result = stats.query('hid == @hid')
+    assert_allclose(result.meanDepth.values, g.fiveSigmaDepth.mean().values)
+    assert_allclose(result.sumMJD.values, g.expMJD.sum().values)
+
+    maps = statisticsMaps(stats, 16, names=['meanDepth'])
+    assert list(maps) == ['meanDepth']
+
+    with pytest.raises(ValueError):
+        aggregateVisits(hpo.opsimdf, hpo.hids, hpo.indptr, hpo.rows,
+                        reducers=dict(x=('FWHMeff', 'mode')))
+    with pytest.raises(ValueError):
+        aggregateVisits(hpo.opsimdf, hpo.hids, hpo.indptr, hpo.rows,
+                        reducers=dict(x=('seeing', 'mean')))
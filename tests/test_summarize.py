@@ -9,6 +9,7 @@ import opsimsummary as oss
 from opsimsummary import (OpSimOutput, SynOpSim, PointingTree)
 import healpy as hp
 from numpy.testing import assert_allclose, assert_array_equal
+from scipy.spatial import cKDTree
 
 
 
@@ -157,3 +158,77 @@ def test_synopsimPointings(fname, opsimversion, tableNames, angleUnit):
     np.testing.assert_array_equal(ptslens, ptshlens)
     assert max(ptslens) > 0
     
+
+
+def test_synopsimMemmap(opsimdb, tmpdir):
+    """check that pointings written with `writeMemmap` are read back as
+    read-only memory mapped arrays with the same values, and survive
+    pickling"""
+    import pickle
+    fname, opsimversion = opsimdb
+    synopsim = SynOpSim.fromOpSimDB(fname, opsimversion=opsimversion)
+    dirname = str(tmpdir.join('pointings'))
+    synopsim.writeMemmap(dirname)
+    synmm = SynOpSim.fromMemmap(dirname)
+
+    cols = ['_ra', '_dec', 'expMJD', 'fiveSigmaDepth']
+    assert synmm.pointings[cols].equals(synopsim.pointings[cols])
+    assert_array_equal(synmm.pointings['filter'].astype(str).values,
+                       synopsim.pointings['filter'].values)
+    assert isinstance(synmm.pointings['_ra'].values, np.memmap)
+    assert not synmm.pointings['_ra'].values.flags.writeable
+
+    synpickled = pickle.loads(pickle.dumps(synmm))
+    assert synpickled.pointings[cols].equals(synmm.pointings[cols])
+
+
+def test_pointingTree_kdtree3d():
+    """check that the 'kdtree3d' backend of `PointingTree` finds the same
+    pointings as the 'balltree' backend, for positions and for the counts
+    of `SynOpSim.observedVisitsinRegion`"""
+    rng = np.random.RandomState(0)
+    # repeated visits to a set of fields
+    fieldra = rng.uniform(0., 2. * np.pi, size=500)
+    fielddec = np.arcsin(rng.uniform(-1., 0.2, size=500))
+    fields = rng.randint(0, 500, size=5000)
+    pointings = pd.DataFrame(dict(_ra=fieldra[fields], _dec=fielddec[fields],
+                                  expMJD=np.arange(5000) * 0.01),
+                             index=pd.Index(np.arange(5000) + 1,
+                                            name='obsHistID'))
+
+    ball = PointingTree(pointings.copy(), backend='balltree')
+    kd = PointingTree(pointings.copy(), backend='kdtree3d', workers=2)
+    ra, dec = kd.raDec
+    assert_array_equal(ra, np.degrees(pointings._ra.values))
+    assert_array_equal(dec, np.degrees(pointings._dec.values))
+    radeg = rng.uniform(0., 360., size=200)
+    decdeg = np.degrees(np.arcsin(rng.uniform(-1., 0.2, size=200)))
+    for circRadius in (0., 2.5):
+        pts = ball.pointingsEnclosing(radeg, decdeg, circRadius)
+        ptskd = kd.pointingsEnclosing(radeg, decdeg, circRadius)
+        assert sum(len(pt) for pt in pts) > 0
+        for pt, ptkd in zip(pts, ptskd):
+            assert_array_equal(np.sort(pt), np.sort(ptkd))
+
+    # radii equal to the distance to field centres are decided by the
+    # haversine distance of the BallTree
+    X = np.column_stack((fielddec[:50], fieldra[:50]))
+    r = 2. * np.arcsin(np.sqrt(PointingTree._rdist(X, X[::-1])))
+    for i in range(50):
+        inds = kd.query_radius(X[i:i + 1], r[i])[0]
+        rdist = PointingTree._rdist(kd._decra, X[i])
+        assert_array_equal(np.sort(inds),
+                           np.flatnonzero(rdist <= np.sin(0.5 * r[i]) ** 2))
+        assert kd.query_radius(X[i:i + 1], r[i], count_only=True)[0] == \
+            len(inds)
+
+    synopsim = SynOpSim(pointings.copy(), usePointingTree=True)
+    synopsimkd = SynOpSim(pointings.copy(), usePointingTree=True,
+                          pointingTreeBackend='kdtree3d')
+    survey = synopsim.observedVisitsinRegion(nside=16)
+    surveykd = synopsimkd.observedVisitsinRegion(nside=16)
+    assert isinstance(synopsimkd.pointingTree.tree, cKDTree)
+    assert survey.equals(surveykd)
+
+    with pytest.raises(ValueError):
+        PointingTree(pointings.copy(), backend='kdtree')
@@ -0,0 +1,62 @@
+""" Tests for the code in `opsimsummary/validation.py`
+"""
+from __future__ import print_function, division, absolute_import
+import pytest
+import numpy as np
+import pandas as pd
+from opsimsummary import PointingValidator, ValidationError, OpSimOutput
+
+
+def pointings(num=10):
+    rng = np.random.RandomState(0)
+    df = pd.DataFrame(dict(obsHistID=np.arange(num),
+                           _ra=rng.uniform(0., 2. * np.pi, num),
+                           _dec=rng.uniform(-np.pi / 2., 0., num),
+                           fiveSigmaDepth=rng.normal(24., 0.5, num),
+                           filter=list('ugrizy' * num)[:num],
+                           note=['a'] * num))
+    return df.set_index('obsHistID')
+
+
+@pytest.mark.parametrize("level,checks",
+                         [('off', []),
+                          ('fast', ['columns', 'fiveSigmaDepth', 'angles']),
+                          ('full', ['columns', 'fiveSigmaDepth', 'angles',
+                                    'nulls'])])
+def test_validation_levels(level, checks):
+    """check the checks done and timed at each level"""
+    validator = PointingValidator(level)
+    timings = validator.validate(pointings(), checkAngles=True)
+    assert list(timings.keys()) == checks
+    assert timings is validator.timings
+
+
+@pytest.mark.parametrize("column,value,level,check",
+                         [('fiveSigmaDepth', np.nan, 'fast', 'fiveSigmaDepth'),
+                          ('_ra', np.nan, 'fast', 'angles'),
+                          ('_dec', 4.0, 'fast', 'angles'),
+                          ('note', None, 'full', 'nulls')])
+def test_validation_failures(column, value, level, check):
+    """check that failures raise `ValidationError` describing the check"""
+    df = pointings()
+    df[column] = df[column].astype(object) if value is None else df[column]
+    df.iloc[[2, 5], df.columns.get_loc(column)] = value
+    with pytest.raises(ValidationError) as excinfo:
+        PointingValidator(level).validate(df, checkAngles=True)
+    assert excinfo.value.check == check
+    assert excinfo.value.columns == [column]
+    assert excinfo.value.numInvalid == 2
+    # the null in the `note` column is only found at the `full` level
+    if level == 'full':
+        PointingValidator('fast').validate(df, checkAngles=True)
+    PointingValidator('off').validate(df, checkAngles=True)
+
+
+def test_validation_missing_columns():
+    df = pointings().drop(columns=['_ra'])
+    with pytest.raises(ValidationError) as excinfo:
+        OpSimOutput.validate_pointings(df, opsimVars=dict())
+    assert excinfo.value.check == 'columns'
+    assert OpSimOutput.validate_pointings(df)
+    with pytest.raises(ValueError):
+        PointingValidator('notALevel')